@@ -0,0 +1,80 @@
+"""
+Benchmark of the time needed to import georetriever.
+
+Imports the package in fresh interpreters and reports the median wall time,
+the slowest imported packages according to `python -X importtime`, and
+which heavy optional dependencies got loaded. Dataset modules, their
+dependencies (cdsapi, geopandas, requests, ...) and data files are only
+loaded once a feature is prepared, so none of them should be listed.
+
+Run as
+    python benchmarks/benchmark_import.py [n_runs]
+"""
+
+import sys
+import time
+import subprocess
+import numpy as np
+
+heavy = [
+    "cdsapi",
+    "geopandas",
+    "requests",
+    "rasterio",
+    "pyproj",
+    "shapely",
+    "scipy.stats",
+    "scipy.sparse",
+    "georetriever.datasets.era5",
+    "georetriever.datasets.macrostrat",
+    "georetriever.datasets.aquifer_depth",
+]
+
+check = (
+    "import sys, georetriever; "
+    f"print(','.join(m for m in {heavy!r} if m in sys.modules))"
+)
+
+
+def run_time(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True)
+    return time.perf_counter() - start
+
+
+def slowest_imports(n=10):
+    """Packages with the largest cumulative import time in microseconds"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import georetriever"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = dict()
+    for line in result.stderr.splitlines()[1:]:
+        _, cumulative, name = line.split("|")
+        if name.strip().count(".") == 0:
+            times[name.strip()] = int(cumulative)
+    return sorted(times.items(), key=lambda item: -item[1])[:n]
+
+
+def main(n_runs=5):
+    startup = np.median([run_time("pass") for _ in range(n_runs)])
+    times = [run_time("import georetriever") for _ in range(n_runs)]
+
+    loaded = subprocess.run(
+        [sys.executable, "-c", check], capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+    print(
+        f"import georetriever: {np.median(times) - startup:.2f}s "
+        f"(median of {n_runs}, without interpreter startup)"
+    )
+    print("Slowest top-level imports:")
+    for name, micros in slowest_imports():
+        print(f"\t{name}: {micros / 1e6:.2f}s")
+    print(f"Heavy dependencies loaded on import: {loaded or 'none'}")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
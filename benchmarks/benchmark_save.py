@@ -0,0 +1,105 @@
+"""
+Benchmark of GeoCutout.to_netcdf on a large synthetic cutout.
+
+Counts the netcdf writes issued by one save and compares its duration to a
+plain xarray write of the same dataset. Before the cutout mode was tracked
+explicitly, every mode check serialized the whole dataset to 'hold.nc',
+such that one save wrote the cutout two to three times.
+
+Run as
+    python benchmarks/benchmark_save.py [n_cells_per_side]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+import xarray as xr
+from contextlib import contextmanager
+from tempfile import mkdtemp
+from shutil import rmtree
+
+# the benchmark runs on the checkout it belongs to, installed or not
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from georetriever import GeoCutout
+from georetriever.utils import LithField
+from georetriever.utils.geo_utils import get_random_lith
+
+
+def synthetic_cutout(path, n):
+    x = slice(0, (n - 1) * 0.01)
+    y = slice(40, 40 + (n - 1) * 0.01)
+    cutout = GeoCutout(path, x=x, y=y, time="2019-01-01", dx=0.01, dy=0.01)
+
+    shape = (cutout.coords["x"].size, cutout.coords["y"].size)
+    liths = np.array([get_random_lith() for _ in range(200)], dtype=object)
+    field = LithField.from_liths(liths[np.random.randint(0, 200, size=shape)])
+
+    temperature = np.random.rand(cutout.coords["time"].size, *shape[::-1]).astype(
+        np.float32
+    )
+
+    cutout.data = xr.merge(
+        [
+            cutout.data,
+            field.to_dataset(("x", "y"), {k: cutout.coords[k] for k in ["x", "y"]}),
+            xr.Dataset({"temperature": (("time", "y", "x"), temperature)}),
+        ]
+    )
+    return cutout
+
+
+@contextmanager
+def count_writes():
+    """Patches xr.Dataset.to_netcdf to count its calls, restoring it on exit"""
+    calls = list()
+    to_netcdf = xr.Dataset.to_netcdf
+
+    def counted(self, *args, **kwargs):
+        calls.append(args[0] if args else kwargs.get("path"))
+        return to_netcdf(self, *args, **kwargs)
+
+    xr.Dataset.to_netcdf = counted
+    try:
+        yield calls
+    finally:
+        xr.Dataset.to_netcdf = to_netcdf
+
+
+def main(n=1000):
+    tmpdir = mkdtemp()
+    try:
+        cutout = synthetic_cutout(os.path.join(tmpdir, "bench.nc"), n)
+        with count_writes() as calls:
+            start = time.perf_counter()
+            cutout.data.to_netcdf(os.path.join(tmpdir, "plain.nc"))
+            plain_time = time.perf_counter() - start
+            calls.clear()
+
+            start = time.perf_counter()
+            cutout.to_netcdf(os.path.join(tmpdir, "cutout.nc"))
+            cutout_time = time.perf_counter() - start
+            n_writes = len(calls)
+
+            cutout.to_object_mode()
+            calls.clear()
+
+            start = time.perf_counter()
+            cutout.to_netcdf(os.path.join(tmpdir, "objects.nc"))
+            object_time = time.perf_counter() - start
+
+        size = os.path.getsize(os.path.join(tmpdir, "cutout.nc")) / 1e6
+        print(f"Cutout of {n}x{n} cells, {size:.1f} MB on disk")
+        print(f"xr.Dataset.to_netcdf: {plain_time:.2f}s")
+        print(f"GeoCutout.to_netcdf: {cutout_time:.2f}s, {n_writes} netcdf write(s)")
+        print(
+            f"GeoCutout.to_netcdf from object mode: {object_time:.2f}s, "
+            f"{len(calls)} netcdf write(s)"
+        )
+    finally:
+        rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -1,13 +1,18 @@
 import pandas as pd
 import xarray as xr
-import os
 from numpy import atleast_1d
-from tempfile import mkstemp, mkdtemp
+from tempfile import mkdtemp
 from shutil import rmtree
 from functools import wraps
-from dask import delayed, compute
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+from itertools import islice
+import numpy as np
 from dask.utils import SerializableLock
-from dask.diagnostics import ProgressBar
 
 import logging
 
@@ -15,36 +20,88 @@ logger = logging.getLogger(__name__)
 
 from .datasets import modules as datamodules
 from .utils.geo_utils import Lith
+from .utils.lith_field import LithField
+from .manifest import Manifest, tile_key
+from .storage import (
+    get_backend,
+    open_cutout,
+    write_cutout,
+    append_variables,
+    initialize_variables,
+    write_region,
+    stored_variables,
+)
 
 feature_mapping = {
     "temperature": "era5",
     "lithology": "macrostrat",
     "aquifer_depth": "aquifer_depth",
+    "crustal_structure": "aquifer_depth",
+    "thermal_conductivity": "geophysics",
+    "heat_capacity": "geophysics",
 }
 
+# features computed from other features of the cutout, which are
+# prepared first
+feature_dependencies = {
+    "thermal_conductivity": ["lithology"],
+    "heat_capacity": ["lithology"],
+}
+
+# maximal number of retrievals per module running at the same time
+# in parallel or tiled preparation
+module_concurrency = {
+    "era5": 2,
+    "macrostrat": 1,
+    "aquifer_depth": 1,
+    "geophysics": 2,
+}
 
-def get_feature(geocutout, module, feature, tmpdir=None):
+
+def get_feature(geocutout, module, feature, tmpdir=None, **module_params):
     """
     Load the feature data for a given module.
     This get the data for a set of features from a module. All modules in
     `atlite.datasets` are allowed.
+
+    Keyword arguments (module_params) are passed to the get_data function
+    of the module, in addition to the attributes of the cutout, e.g.
+    monthly=True for 'era5'.
     """
 
-    parameters = geocutout.data.attrs
+    parameters = {**geocutout.data.attrs, **module_params}
     lock = SerializableLock()
-    datasets = list()
 
     get_data = datamodules[module].get_data
 
-    feature_data = delayed(get_data)(
-        geocutout, feature, tmpdir=tmpdir, lock=lock, **parameters
-    )
-    datasets.append(feature_data)
+    ds = get_data(geocutout, feature, tmpdir=tmpdir, lock=lock, **parameters)
+
+    return annotate_feature(ds, module)
+
+
+def get_feature_chunks(
+    geocutout, module, feature, tmpdir=None, skip=(), **module_params
+):
+    """
+    Like get_feature, but yields the data in chunks as they are retrieved,
+    for modules providing get_data_chunks (e.g. 'era5' per period of time)
+
+    Yields:
+        (dict, xr.Dataset): positions of the chunk in the cutout and its data
+    """
+    parameters = {**geocutout.data.attrs, **module_params}
+    lock = SerializableLock()
+
+    get_data_chunks = datamodules[module].get_data_chunks
 
-    datasets = compute(*datasets)
+    for region, ds in get_data_chunks(
+        geocutout, feature, tmpdir=tmpdir, lock=lock, skip=skip, **parameters
+    ):
+        yield region, annotate_feature(ds, module)
 
-    ds = xr.merge(datasets, compat="equals")
 
+def annotate_feature(ds, module):
+    """Records the module and feature of each variable in its attributes"""
     for v in ds:
 
         ds[v].attrs["module"] = module
@@ -54,6 +111,36 @@ def get_feature(geocutout, module, feature, tmpdir=None):
     return ds
 
 
+def dependency_stages(features):
+    """
+    Groups features and the features they depend on (see
+    feature_dependencies) into stages, such that the features of a stage
+    only depend on features of earlier stages.
+
+    Args:
+        features(List[str]): features in feature_mapping
+
+    Returns:
+        List[List[str]]
+    """
+
+    def depth(feature):
+        return 1 + max(map(depth, feature_dependencies.get(feature, [])), default=-1)
+
+    required = list()
+    queue = list(features)
+    while queue:
+        feature = queue.pop(0)
+        if feature not in required:
+            required.append(feature)
+            queue += feature_dependencies.get(feature, [])
+
+    stages = [list() for _ in range(1 + max(map(depth, required), default=-1))]
+    for feature in required:
+        stages[depth(feature)].append(feature)
+    return stages
+
+
 def maybe_remove_tmpdir(func):
     "Use this wrapper to make tempfile deletion compatible with windows machines."
 
@@ -81,7 +168,8 @@ def make_storable(ds):
     """
     Ensures xr.Dataset can be stored as netcdf
     This entails:
-        - transforming xr.DataArray of Lith objects into a xr.Dataset of str
+        - transforming xr.DataArray of Lith objects into the integer arrays
+          of utils.LithField
 
     Args:
         ds(xr.Dataset): dataset to be made convertible into netcdf
@@ -90,88 +178,538 @@ def make_storable(ds):
         xr.Dataset
     """
 
-    if "lithology" in ds.variables:
+    if "lithology" in ds.variables and ds["lithology"].dtype == object:
         lith = ds["lithology"]
-        ds = ds.drop("lithology")
+        ds = ds.drop_vars("lithology")
         ds = xr.merge([ds, Lith.to_dataset(lith)])
 
     return ds
 
 
-@maybe_remove_tmpdir
-def geocutout_prepare(geocutout, features=None, tmpdir=None, overwrite=False):
+def feature_attrs(geocutout, variables, attrs=None):
+    """Attributes of the cutout after adding variables with attributes attrs"""
+    prepared = list(atleast_1d(geocutout.data.attrs["prepared_features"]))
+    prepared += [key for key in variables if key not in prepared]
+
+    attrs = {**non_bool_dict(geocutout.data.attrs), **(attrs or dict())}
+    attrs.update(prepared_features=list(prepared))
+    return attrs
+
+
+def store_feature_data(geocutout, ds):
+    """
+    Adds the retrieved variables in ds to the stored cutout and reopens it.
+    New variables are appended in place; the whole cutout is only rewritten
+    when stored variables are overwritten.
+    """
+    attrs = feature_attrs(geocutout, ds.keys(), ds.attrs)
+    ds = make_storable(ds).assign_attrs(**attrs)
+
+    stored = stored_variables(geocutout.path)
+    if stored and not stored.intersection(ds.data_vars):
+        if get_backend(geocutout.path) != "zarr":
+            # ds may be computed from the file it is appended to
+            ds = ds.load()
+        geocutout.data.close()
+        append_variables(ds, geocutout.path)
+    else:
+        data = make_storable(geocutout.data).drop_vars(
+            list(ds.data_vars), errors="ignore"
+        )
+        data = data.merge(ds, compat="override").assign_attrs(**attrs)
+        write_cutout(data, geocutout.path)
+        geocutout.data.close()
+
+    geocutout.data = open_cutout(geocutout.path)
+
+
+def get_feature_tiles(
+    geocutout,
+    module,
+    feature,
+    tilesize,
+    tmpdir=None,
+    max_workers=None,
+    skip=(),
+    **module_params,
+):
+    """
+    Retrieves a feature tile by tile (see GeoCutout.tiles) on a thread
+    pool. Tiles are submitted as earlier ones are consumed, such that at
+    most twice the number of workers tiles are held in memory.
+
+    Args:
+        geocutout(GeoCutout): cutout to retrieve data for
+        module(str): module providing the feature
+        feature(str): feature in feature_mapping
+        tilesize(int or dict): cells per tile along x and y
+        tmpdir(str): directory for temporary files
+        max_workers(int): size of the pool, at most the concurrency of the
+                          module in `module_concurrency`, which is also
+                          the default
+        skip(Set[str]): keys of tiles that are not retrieved, see
+                        manifest.tile_key
+        **module_params: passed to get_feature
+
+    Yields:
+        (dict, xr.Dataset): positions of the tile and its data, in the
+                            order in which tiles finish
+    """
+    tiles = (
+        (region, tile)
+        for region, tile in geocutout.tiles(tilesize)
+        if tile_key(region) not in skip
+    )
+    # modules sharing state between retrievals, such as the polygon cache
+    # file of macrostrat, are never run on more threads than allowed
+    concurrency = module_concurrency.get(module, 1)
+    max_workers = min(max_workers or concurrency, concurrency)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = dict()
+
+        def submit(n):
+            for region, tile in islice(tiles, n):
+                future = pool.submit(
+                    get_feature, tile, module, feature, tmpdir=tmpdir, **module_params
+                )
+                futures[future] = region
+
+        submit(2 * max_workers)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield futures.pop(future), future.result()
+            submit(len(done))
+
+
+def tile_template(geocutout, ds):
+    """
+    Lazy dataset covering the whole cutout, holding empty variables like
+    the spatial variables of a tile (or chunk along time) ds
+    """
+    import dask.array
+
+    dims = geocutout.data.dims
+    sizes = {**ds.sizes, **{dim: geocutout.data.sizes[dim] for dim in dims}}
+    chunks = geocutout.chunks or dict()
+
+    variables = {
+        name: xr.Variable(
+            var.dims,
+            dask.array.empty(
+                tuple(sizes[dim] for dim in var.dims),
+                dtype=var.dtype,
+                chunks=tuple(chunks.get(dim, -1) for dim in var.dims),
+            ),
+            attrs=var.attrs,
+        )
+        for name, var in ds.data_vars.items()
+        if {"x", "y"}.issubset(var.dims)
+    }
+    coords = {
+        name: coord
+        for name, coord in ds.coords.items()
+        if not set(dims).intersection(coord.dims)
+    }
 
+    return xr.Dataset(variables, coords={**geocutout.data.coords, **coords})
+
+
+def drop_stored_variables(geocutout, variables):
+    """
+    Rewrites the stored cutout without the given variables, together with
+    the composition tables if 'lithology' is among them, and reopens it
+    """
+    names = stored_variables(geocutout.path).intersection(variables)
+    if not names:
+        return
+    if "lithology" in names:
+        names.update(LithField.variables)
+
+    prepared = atleast_1d(geocutout.data.attrs["prepared_features"])
+    data = make_storable(geocutout.data).drop_vars(list(names), errors="ignore")
+    data.attrs["prepared_features"] = [v for v in prepared if v not in names]
+
+    write_cutout(data, geocutout.path)
+    geocutout.data.close()
+    geocutout.data = open_cutout(geocutout.path)
+
+
+def store_feature_tiles(geocutout, tiles, variables, manifest=None, feature=None):
+    """
+    Stitches the tile data of get_feature_tiles (or get_feature_chunks)
+    into the stored cutout and reopens it. Lithology compositions of each tile are translated into
+    a table shared by all tiles.
+
+    For Zarr stores, the variables are created for the whole cutout
+    first, and each tile is written into its region as soon as it is
+    retrieved, such that memory is bounded by the tiles in flight.
+    Stored variables of the same names have to be removed beforehand,
+    see drop_stored_variables, unless an interrupted run is resumed.
+    Written tiles are then recorded in the manifest, with the composition
+    table as checkpoint, and the variables of the manifest's earlier tiles
+    are kept.
+    For NetCDF files, the tiles are combined in memory and stored at once.
+
+    Args:
+        geocutout(GeoCutout): cutout the tiles belong to
+        tiles(Iterable[(dict, xr.Dataset)]): positions and data of the tiles
+        variables(List[str]): variables of the feature
+        manifest(Manifest): progress records of the cutout
+        feature(str): feature the tiles belong to, required with manifest
+    """
+    path = geocutout.path
+    in_place = get_backend(path) == "zarr"
+
+    field = None
+    if "lithology" in variables:
+        checkpoint = manifest.checkpoint(feature) if manifest and in_place else None
+        if checkpoint is None:
+            checkpoint = {
+                "codes": np.empty((0, 7)),
+                "colors": np.empty((0, 3)),
+                "vocabulary": [],
+            }
+        field = LithField(np.zeros((0, 0)), **checkpoint)
+
+    spatial = [v for v in variables if v not in LithField.variables]
+    initialized = in_place and stored_variables(path).issuperset(spatial)
+
+    parts = list()
+    attrs = dict()
+
+    for region, ds in tiles:
+        ds = make_storable(ds)
+        attrs.update(ds.attrs)
+
+        if field is not None:
+            tile_field = LithField.from_dataset(ds)
+            index = field.merge(tile_field)[tile_field.index]
+            ds = ds.drop_vars(LithField.variables)
+            ds["lithology"] = ds["lithology"].copy(data=index)
+
+        if not in_place:
+            parts.append(ds)
+            continue
+
+        if not initialized:
+            template = tile_template(geocutout, ds)
+            initialize_variables(
+                template.assign_attrs(non_bool_dict(geocutout.data.attrs)), path
+            )
+            initialized = True
+
+        write_region(ds, path, region)
+
+        if manifest is not None:
+            checkpoint = dict()
+            if field is not None:
+                checkpoint = dict(
+                    codes=field.codes,
+                    colors=field.colors,
+                    vocabulary=np.array(field.vocabulary, dtype=str),
+                )
+            manifest.tile_done(feature, region, **checkpoint)
+
+    if not in_place:
+        ds = xr.combine_by_coords(parts, combine_attrs="override")
+        if field is not None:
+            ds = ds.assign(field.to_dataset()[LithField.variables].data_vars)
+        store_feature_data(geocutout, ds.assign_attrs(attrs))
+        return
+
+    # the feature is only marked as prepared once all tiles are stored
+    attrs = feature_attrs(geocutout, variables, attrs)
+    tables = field.to_dataset()[LithField.variables] if field else xr.Dataset()
+    geocutout.data.close()
+    append_variables(tables.assign_attrs(attrs), path)
+    geocutout.data = open_cutout(path)
+
+
+def get_features_parallel(
+    geocutout,
+    features,
+    tmpdir=None,
+    scheduler="threads",
+    max_workers=None,
+    module_params=None,
+):
+    """
+    Retrieves several features at once on a thread or process pool.
+    The number of retrievals running at the same time for one module is
+    bounded by `module_concurrency`.
+
+    Args:
+        geocutout(GeoCutout): cutout to retrieve data for
+        features(List[str]): features in feature_mapping
+        tmpdir(str): directory for temporary files
+        scheduler(str): 'threads' or 'processes'
+        max_workers(int): size of the pool, defaults to the number of features
+        module_params(dict): keyword arguments of get_feature per module
+
+    Returns:
+        xr.Dataset: merged data of all features
+    """
+    assert scheduler in ("threads", "processes"), f"Unknown scheduler {scheduler}"
+
+    Executor = ThreadPoolExecutor if scheduler == "threads" else ProcessPoolExecutor
+    module_params = module_params or dict()
+
+    queued = dict()
+    for feature in features:
+        queued.setdefault(feature_mapping[feature], []).append(feature)
+    running = {module: 0 for module in queued}
+
+    datasets = list()
+    futures = dict()
+
+    with Executor(max_workers=max_workers or len(features)) as pool:
+
+        def submit_ready():
+            for module, waiting in queued.items():
+                while waiting and running[module] < module_concurrency.get(module, 1):
+                    feature = waiting.pop(0)
+                    logger.info(f"Calculating {feature} with module {module}")
+                    future = pool.submit(
+                        get_feature,
+                        geocutout,
+                        module,
+                        feature,
+                        tmpdir=tmpdir,
+                        **module_params.get(module, dict()),
+                    )
+                    futures[future] = module
+                    running[module] += 1
+
+        submit_ready()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                running[futures.pop(future)] -= 1
+                datasets.append(future.result())
+            submit_ready()
+
+    return xr.merge(datasets, compat="override")
+
+
+def streams_chunks(geocutout, module):
+    """
+    Whether the data of module is written to the stored cutout chunk by
+    chunk as it is retrieved, see prepare_feature_chunks
+    """
+    return get_backend(geocutout.path) == "zarr" and hasattr(
+        datamodules[module], "get_data_chunks"
+    )
+
+
+def prepare_feature_chunks(
+    geocutout, module, feature, manifest, tmpdir=None, overwrite=False, **module_params
+):
+    """
+    Retrieves a feature with get_feature_chunks and writes each chunk to
+    the Zarr store of the cutout as it arrives. Chunks are recorded in the
+    manifest, such that an interrupted run only retrieves missing chunks.
+    """
+    variables = list(atleast_1d(datamodules[module].features[feature]))
+    resumed = manifest.start(feature, resume=not overwrite)
+    if not resumed:
+        drop_stored_variables(geocutout, variables)
+
+    chunks = get_feature_chunks(
+        geocutout,
+        module,
+        feature,
+        tmpdir=tmpdir,
+        skip=manifest.finished_tiles(feature),
+        **module_params,
+    )
+    store_feature_tiles(
+        geocutout, chunks, variables, manifest=manifest, feature=feature
+    )
+    manifest.done(feature)
+
+
+@maybe_remove_tmpdir
+def geocutout_prepare(
+    geocutout,
+    features=None,
+    tmpdir=None,
+    overwrite=False,
+    parallel=False,
+    scheduler="threads",
+    max_workers=None,
+    tilesize=None,
+    module_params=None,
+):
     """
     Parameters
     ----------
     cutout : geo_retriever.GeoCutout
     features : str/list, optional
-        Feature(s) to be prepared. The default slice(None) results in all
-        available features.
+        Feature(s) to be prepared. The default None results in all
+        available features. Features listed in `data.feature_dependencies`
+        (e.g. 'lithology' for 'thermal_conductivity') are prepared first.
     tmpdir : str/Path, optional
         Directory in which temporary files (for example retrieved ERA5 netcdf
         files) are stored. If set, the directory will not be deleted and the
         intermediate files can be examined.
     overwrite : bool, optional
         Whether to overwrite variables which are already included in the
-        cutout. The default is False.
+        cutout. The default is False, in which case features whose variables
+        are listed in the 'prepared_features' attribute are skipped.
+        New variables are appended to the stored cutout in place; the whole
+        cutout is only rewritten when stored variables are overwritten.
+    parallel : bool, optional
+        If True, the retrievals of all features are scheduled at once and
+        their merged result is written in a single step (one step per
+        stage of dependent features). The number of
+        simultaneous retrievals per module is bounded by
+        `data.module_concurrency`. The default is False, in which case
+        features are retrieved and stored one after another.
+    scheduler : str, optional
+        Pool used if parallel is True, 'threads' (default) or 'processes'.
+    max_workers : int, optional
+        Size of the pool used if parallel is True. Defaults to the number of
+        features to prepare. With tilesize, the size of the pool on which
+        tiles are retrieved, which is capped by `data.module_concurrency`.
+    tilesize : int or dict, optional
+        If given, each feature is retrieved tile by tile, with tiles of at
+        most tilesize cells along x and y (see GeoCutout.tiles), and
+        features are prepared one after another. Tiles of Zarr stores are
+        written as they arrive, which bounds the memory needed for large
+        cutouts. The default None retrieves the whole cutout at once.
+        Modules that retrieve data in chunks (e.g. 'era5' per year or month)
+        write each chunk to a Zarr store as it arrives, with or without
+        tilesize, such that a single request per chunk covers the whole
+        cutout. For NetCDF files, tiles of such modules are retrieved like
+        any other, e.g. one CDS request per tile and year for 'era5'.
+    module_params : dict, optional
+        Keyword arguments passed to the get_data function of each module,
+        keyed by module name, e.g. {'era5': {'monthly': True,
+        'max_workers': 8, 'cache': False}}.
+
+    The progress of each feature is recorded in a manifest next to the
+    cutout (see manifest.Manifest). Features already stored are skipped
+    when preparing again, and a tiled preparation of a Zarr store that was
+    interrupted resumes with the tiles that are still missing, if it is
+    invoked with the same tilesize. Remote data already obtained is kept
+    in the download caches of the modules, so no checkpoint depends on
+    tmpdir, which is removed after each run.
     Returns
     -------
     geocutout : geo_retriever.GeoCutout
         GeoCutout with prepared data. The variables are stored in `geocutout.data`.
     """
 
-    logger.warning("Overwrite not yet implemented")
-
     if geocutout.prepared and not overwrite:
         logger.info("GeoCutout already prepared")
         return geocutout
 
     logger.info(f"Storing temporary files in {tmpdir}")
 
-    features = atleast_1d(features) if features else slice(None)
+    features = list(atleast_1d(features)) if features else list(feature_mapping)
     prepared = list(atleast_1d(geocutout.data.attrs["prepared_features"]))
 
-    logging.warning("Double download of prepared features not yet prevented")
-
     for feature in features:
         assert feature in feature_mapping, (
             f"No module for feature {feature} "
             + f"\n Available features: {feature_mapping}"
         )
 
-    logging.warning("Double importing not prevented yet")
-    for feature in features:
-        module = feature_mapping[feature]
-
-        logging.info(f"Calculating {feature} with module {module}:")
-
-        ds = get_feature(geocutout, module, feature, tmpdir=tmpdir)
-
-        prepared += [key for key in ds.keys()]
-
-        geocutout.data.attrs.update(dict(prepared_features=list(prepared)))
-
-        attrs = non_bool_dict(geocutout.data.attrs)
-        attrs.update(ds.attrs)
-
-        ds = geocutout.data.merge(ds).assign_attrs(**attrs)
-
-        directory, filename = os.path.split(str(geocutout.path))
-        fd, tmp = mkstemp(suffix=filename, dir=directory)
-
-        os.close(fd)
-
-        with ProgressBar():
-            make_storable(ds).to_netcdf(tmp)
-
-        if geocutout.path.exists():
-            geocutout.data.close()
-            geocutout.path.unlink()
-        os.rename(tmp, geocutout.path)
-
-        geocutout.data = xr.open_dataset(geocutout.path, chunks=geocutout.chunks)
-
-    geocutout.to_object_mode()
+    manifest = Manifest(geocutout.path)
+    module_params = module_params or dict()
+
+    for stage in dependency_stages(features):
+
+        missing = list()
+        for feature in stage:
+            module = datamodules[feature_mapping[feature]]
+            variables = atleast_1d(module.features[feature])
+            # dependencies are only prepared if they are missing
+            if set(variables).issubset(prepared) and not (
+                overwrite and feature in features
+            ):
+                logger.info(f"Skipping {feature}, which is already prepared")
+            else:
+                missing.append(feature)
+
+        if tilesize is not None:
+            for feature in missing:
+                module = feature_mapping[feature]
+                params = module_params.get(module, dict())
+
+                if streams_chunks(geocutout, module):
+                    logger.info(f"Calculating {feature} with module {module} in chunks")
+                    prepare_feature_chunks(
+                        geocutout,
+                        module,
+                        feature,
+                        manifest,
+                        tmpdir,
+                        overwrite,
+                        **params,
+                    )
+                    continue
+
+                logger.info(f"Calculating {feature} with module {module} in tiles")
+
+                variables = list(atleast_1d(datamodules[module].features[feature]))
+                # only tiles written to Zarr stores survive an interruption
+                in_place = get_backend(geocutout.path) == "zarr"
+                resumed = manifest.start(
+                    feature, tilesize, resume=in_place and not overwrite
+                )
+                if in_place and not resumed:
+                    drop_stored_variables(geocutout, variables)
+
+                tiles = get_feature_tiles(
+                    geocutout,
+                    module,
+                    feature,
+                    tilesize,
+                    tmpdir=tmpdir,
+                    max_workers=max_workers,
+                    skip=manifest.finished_tiles(feature),
+                    **params,
+                )
+                store_feature_tiles(
+                    geocutout, tiles, variables, manifest=manifest, feature=feature
+                )
+                manifest.done(feature)
+            continue
+
+        if parallel and missing:
+            for feature in missing:
+                manifest.start(feature)
+            ds = get_features_parallel(
+                geocutout,
+                missing,
+                tmpdir=tmpdir,
+                scheduler=scheduler,
+                max_workers=max_workers,
+                module_params=module_params,
+            )
+            store_feature_data(geocutout, ds)
+            for feature in missing:
+                manifest.done(feature)
+            continue
+
+        for feature in missing:
+            module = feature_mapping[feature]
+
+            logging.info(f"Calculating {feature} with module {module}:")
+            params = module_params.get(module, dict())
+
+            if streams_chunks(geocutout, module):
+                prepare_feature_chunks(
+                    geocutout, module, feature, manifest, tmpdir, overwrite, **params
+                )
+                continue
+
+            manifest.start(feature)
+            ds = get_feature(geocutout, module, feature, tmpdir=tmpdir, **params)
+            store_feature_data(geocutout, ds)
+            manifest.done(feature)
 
     return geocutout
@@ -1,9 +1,29 @@
-from . import era5
-from . import macrostrat
-from . import aquifer_depth
-
-modules = {
-    "era5": era5,
-    "macrostrat": macrostrat,
-    "aquifer_depth": aquifer_depth,
-}
+"""
+Data source modules. The modules, their dependencies and data files are
+only imported once a module is first accessed through `modules`, such
+that importing georetriever stays cheap.
+"""
+
+from importlib import import_module
+from collections.abc import Mapping
+
+
+class LazyModules(Mapping):
+    """Mapping of module names to dataset modules, imported on first access"""
+
+    def __init__(self, names):
+        self._names = list(names)
+
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError(name)
+        return import_module(f".{name}", __name__)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+
+modules = LazyModules(["era5", "macrostrat", "aquifer_depth", "geophysics"])
@@ -1,13 +1,35 @@
 import xarray as xr
 import pandas as pd
 import os
+import hashlib
 import numpy as np
-from scipy.interpolate import griddata
+from functools import lru_cache
+from scipy.interpolate import RegularGridInterpolator
+
+from ..utils.cache import default_cache_dir
+
+import logging
+
+logger = logging.getLogger(__name__)
 
 # aquifer_link = "https://agupubs.onlinelibrary.wiley.com/action/downloadSupplement?doi=10.1029%2F2007GL032244&file=grl24037-sup-0002-ds01.txt"
 # aquifer_file = "aqu_temp.txt"
 
-features = {"aquifer_depth": "aquifer_depth"}
+# columns of the Tesauro et al. table and the resulting variables
+crustal_variables = {
+    "UC": "crust_uc",
+    "LC": "crust_lc",
+    "AVCRUST": "crust_avcrust",
+    "Topo": "crust_topo",
+    "Basement": "crust_basement",
+    "UC/LC": "crust_uc_lc",
+    "Moho": "crust_moho",
+}
+
+features = {
+    "aquifer_depth": "aquifer_depth",
+    "crustal_structure": list(crustal_variables.values()),
+}
 
 data_path = os.path.join(
     os.path.dirname(__file__),
@@ -17,55 +39,223 @@ data_path = os.path.join(
     "raw",
 )
 file_path = os.path.join(data_path, "aquifer_depth_tesauro_etal.txt")
-assert os.path.isfile(file_path), f"Aquifer depth file {file_path} does not exist."
+
+columns = ["X", "Y", "UC", "LC", "AVCRUST", "Topo", "Basement", "UC/LC", "Moho"]
 
 aquifer_depth_coords = ["x", "y"]
 crs = 4326
 
+# degrees around the cutout from which source points are gridded
+margin = 1.0
+
+
+# directory of the binary copies of the text tables
+cache_dir = os.path.join(default_cache_dir, "aquifer_depth")
+
+
+def converted_path(path):
+    """
+    Path of the binary copy of the text table at path in cache_dir,
+    named after the table and a hash of its location
+    """
+    path = os.path.abspath(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    digest = hashlib.sha1(path.encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{name}-{digest}.npy")
+
+
+def read_table(path):
+    """
+    Parses the text table at path. Rows are sorted by latitude, such that
+    the points of a latitude band can be found by binary search.
+    """
+    data = pd.read_csv(path, skiprows=1, sep="\t", header=None, names=columns)
+    return data.sort_values(["Y", "X"], kind="stable").to_numpy(dtype=float)
+
+
+def convert_table(path):
+    """
+    Converts the text table at path into a .npy array in cache_dir.
+
+    Returns:
+        np.ndarray: the parsed table, which is returned in memory if the
+                    binary copy cannot be written
+    """
+    logger.info(f"Converting {path} to binary format")
+    data = read_table(path)
+
+    target = converted_path(path)
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = target + f".{os.getpid()}.tmp.npy"
+        np.save(tmp, data)
+        os.replace(tmp, target)
+    except OSError as e:
+        logger.warning(
+            f"Could not store binary copy of {path} ({e}), keeping it in memory"
+        )
+    return data
+
+
+@lru_cache(maxsize=4)
+def load_table(path):
+    """
+    Memory-maps the binary copy of the table at path, converting the
+    text table first if the copy is missing or outdated. The table is
+    only read when a feature is first retrieved, not on import.
+
+    Returns:
+        np.ndarray: (n_points, len(columns)) sorted by latitude
+    """
+    target = converted_path(path)
+    if not os.path.isfile(path):
+        assert os.path.isfile(target), f"Aquifer depth file {path} does not exist."
+    elif not os.path.isfile(target) or os.path.getmtime(target) < os.path.getmtime(
+        path
+    ):
+        data = convert_table(path)
+        if not os.path.isfile(target):
+            return data
+    return np.load(target, mmap_mode="r")
+
+
+def select_points(table, bounds):
+    """
+    Rows of table within bounds (x0, y0, x1, y1), using binary search on
+    the sorted latitudes and a mask on the longitudes of that band
+    """
+    x0, y0, x1, y1 = bounds
+    y = table[:, columns.index("Y")]
+    start = np.searchsorted(y, y0, side="left")
+    stop = np.searchsorted(y, y1, side="right")
+    band = np.asarray(table[start:stop])
+    x = band[:, columns.index("X")]
+    return band[(x >= x0) & (x <= x1)]
+
+
+@lru_cache(maxsize=4)
+def grid_spacing(path):
+    """
+    Origin and spacing (x0, y0, dx, dy) of the regular grid of the source
+    points in the table at path
+    """
+    table = load_table(path)
+    spacing = list()
+    for column in ["X", "Y"]:
+        values = np.unique(np.round(table[:, columns.index(column)], 6))
+        spacing.append((values[0], np.diff(values).min()))
+    (x0, dx), (y0, dy) = spacing
+    return x0, y0, dx, dy
+
+
+@lru_cache(maxsize=16)
+def source_grid(path, bounds):
+    """
+    Source points within bounds placed on their regular grid, cached per
+    source table and bounds. Grid nodes without a source point hold NaN.
+    The grid is aligned to the whole table, such that a node has the same
+    position and values for any bounds containing it.
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): x and y of the grid nodes and
+                                              the table rows on the grid,
+                                              shape (len(x), len(y),
+                                              len(columns)). None if there
+                                              are fewer than 2 nodes along
+                                              x or y within bounds
+    """
+    rows = select_points(load_table(path), bounds)
+    x0, y0, dx, dy = grid_spacing(path)
+
+    i = np.round((rows[:, columns.index("X")] - x0) / dx).astype(int)
+    j = np.round((rows[:, columns.index("Y")] - y0) / dy).astype(int)
+    if len(rows) == 0 or np.ptp(i) < 1 or np.ptp(j) < 1:
+        return None
+
+    grid = np.full((np.ptp(i) + 1, np.ptp(j) + 1, len(columns)), np.nan)
+    grid[i - i.min(), j - j.min()] = rows
+
+    x = x0 + dx * np.arange(i.min(), i.max() + 1)
+    y = y0 + dy * np.arange(j.min(), j.max() + 1)
+    return x, y, grid
+
+
+def interpolate(coords, variables, path=None):
+    """
+    Bilinearly interpolates columns of the Tesauro et al. table, given on a
+    regular grid, onto the cutout grid. Only source points within the
+    cutout bounds plus `margin` are read. As each cutout cell only depends
+    on the four surrounding source points, the result does not depend on
+    the cutout bounds. Cells next to missing source points are NaN.
+
+    Args:
+        coords(xr.Coordinates): cutout coordinates x and y
+        variables(List[str]): columns of the table
+        path(str): text table, defaults to file_path
 
-def get_data(cutout, *args, **kwargs):
+    Returns:
+        np.ndarray: shape (len(x), len(y), len(variables))
     """
-    Cuts out sediment thickness for cutout region.
+    x, y = coords["x"].values, coords["y"].values
+
+    bounds = (
+        round(float(x.min()) - margin, 6),
+        round(float(y.min()) - margin, 6),
+        round(float(x.max()) + margin, 6),
+        round(float(y.max()) + margin, 6),
+    )
+    x_mesh, y_mesh = np.meshgrid(x, y, indexing="ij")
+
+    grid = source_grid(path or file_path, bounds)
+    if grid is None:
+        return np.full(x_mesh.shape + (len(variables),), np.nan)
+
+    grid_x, grid_y, values = grid
+    interpolator = RegularGridInterpolator(
+        (grid_x, grid_y),
+        values[..., [columns.index(v) for v in variables]],
+        bounds_error=False,
+        fill_value=np.nan,
+    )
+
+    return interpolator((x_mesh, y_mesh))
+
+
+def get_data(cutout, feature="aquifer_depth", *args, layers=None, **kwargs):
+    """
+    Cuts out sediment thickness for cutout region, or for feature
+    'crustal_structure' all layers of the Tesauro et al. table, which
+    are interpolated together in one pass.
 
     Args:
         cutout(Cutout or GeoCutout): requires attribute 'coords'
+        feature(str): 'aquifer_depth' or 'crustal_structure'
+        layers(List[str]): columns of the table retrieved for
+                           'crustal_structure', defaults to all
 
     """
 
     coords = cutout.coords
 
-    data = pd.read_csv(
-        file_path,
-        skiprows=1,
-        sep="\t",
-        header=None,
-    )
-    data.columns = [
-        "X",
-        "Y",
-        "UC",
-        "LC",
-        "AVCRUST",
-        "Topo",
-        "Basement",
-        "UC/LC",
-        "Moho",
-    ]
-
-    x_mesh, y_mesh = np.meshgrid(cutout.coords["x"].values, cutout.coords["y"].values)
-
-    grid_values = griddata(
-        data[["X", "Y"]].to_numpy(), data["Basement"].values, (x_mesh, y_mesh)
-    )
+    if feature == "crustal_structure":
+        layers = list(crustal_variables) if layers is None else list(layers)
+        names = [crustal_variables[layer] for layer in layers]
+    else:
+        layers, names = ["Basement"], ["aquifer_depth"]
+
+    grid_values = interpolate(coords, layers)
 
     ds = xr.Dataset(
-        data_vars=dict(
-            aquifer_depth=(aquifer_depth_coords, grid_values),
-        ),
+        data_vars={
+            name: (aquifer_depth_coords, grid_values[..., i])
+            for i, name in enumerate(names)
+        },
         coords={
             name: vals for (name, vals), _ in zip(coords.indexes.items(), range(2))
         },
     )
+    for name, layer in zip(names, layers):
+        ds[name].attrs["source_column"] = layer
 
     ds = ds.assign_coords(lon=ds.coords["x"], lat=ds.coords["y"])
 
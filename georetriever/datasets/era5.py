@@ -5,11 +5,16 @@ import xarray as xr
 import pandas as pd
 from tempfile import mkstemp
 import weakref
+import threading
 import cdsapi
 import logging
 from numpy import atleast_1d
+from itertools import product
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from ..gis import maybe_swap_spatial_dims
+from ..utils.cache import DownloadCache, default_cache_dir
+from ..manifest import tile_key
 
 try:
     from contextlib import nullcontext
@@ -25,11 +30,29 @@ logger = logging.getLogger(__name__)
 
 crs = 4326
 
-logging.warn("Era 5 missing features: height")
 features = {"temperature": ["temperature", "soil temperature"]}
 
 static_features = {"height"}
 
+_download_cache = None
+_download_cache_lock = threading.Lock()
+
+# HDF5, which reads the downloaded netcdf files, is not thread-safe. Files
+# are downloaded concurrently, but opened one at a time under this lock.
+netcdf_lock = threading.Lock()
+
+
+def download_cache():
+    """
+    Default DownloadCache of ERA5 files, located in the 'era5' subdirectory
+    of the georetriever cache directory
+    """
+    global _download_cache
+    with _download_cache_lock:
+        if _download_cache is None:
+            _download_cache = DownloadCache(os.path.join(default_cache_dir, "era5"))
+    return _download_cache
+
 
 def _rename_and_clean_coords(ds, add_lon_lat=True):
     """Rename 'longitude' and 'latitude' columns to 'x' and 'y' and fix roundings.
@@ -47,16 +70,47 @@ def _rename_and_clean_coords(ds, add_lon_lat=True):
     return ds
 
 
-def get_data_temperature(retrieval_params):
-    """Get wind temperature for given retrieval parameters."""
-    ds = retrieve_data(
-        variable=["2m_temperature", "soil_temperature_level_4"], **retrieval_params
-    )
+# CDS variables retrieved per feature, with the name of the resulting
+# netcdf variable and the name of the GeoCutout variable
+feature_variables = {
+    "temperature": {
+        "2m_temperature": ("t2m", "temperature"),
+        "soil_temperature_level_4": ("stl4", "soil temperature"),
+    },
+}
+
+
+def cds_variables(feature, variables=None):
+    """CDS variables of a feature, or the subset given by variables"""
+    return list(feature_variables[feature]) if variables is None else list(variables)
+
+
+def to_feature(ds, feature, variables=None):
+    """
+    Renames the CDS variables in ds, as opened from a downloaded file, to
+    the variables of feature in the GeoCutout.
+    """
+    names = feature_variables[feature]
+    variables = cds_variables(feature, variables)
 
     ds = _rename_and_clean_coords(ds)
-    ds = ds.rename({"t2m": "temperature", "stl4": "soil temperature"})
+    ds = ds.rename({names[v][0]: names[v][1] for v in variables})
 
-    return ds
+    return ds[[names[v][1] for v in variables]]
+
+
+def get_data_temperature(retrieval_params, variables=None):
+    """
+    Get temperature for given retrieval parameters.
+
+    Args:
+        retrieval_params(dict): arguments passed to retrieve_data
+        variables(List[str]): subset of the CDS variables in
+            feature_variables['temperature'] to retrieve. Defaults to all
+    """
+    variables = cds_variables("temperature", variables)
+    ds = retrieve_data(variable=variables, **retrieval_params)
+    return to_feature(ds, "temperature", variables)
 
 
 def _area(coords):
@@ -66,16 +120,18 @@ def _area(coords):
     return [y1, x0, y0, x1]
 
 
-def retrieval_times(coords, static=False):
+def retrieval_times(coords, static=False, monthly=False):
     """
     Get list of retrieval cdsapi arguments for time dimension in coordinates.
     If static is False, this function creates a query for each year in the
-    time axis in coords. This ensures not running into query limits of the
-    cdsapi. If static is True, the function return only one set of parameters
-    for the very first time point.
+    time axis in coords, or for each month if monthly is True. This ensures
+    not running into query limits of the cdsapi. If static is True, the
+    function return only one set of parameters for the very first time point.
     Parameters
     ----------
     coords : atlite.Cutout.coords
+    monthly : bool, optional
+        Split queries by month instead of year. The default is False.
     Returns
     -------
     list of dicts witht retrieval arguments
@@ -89,11 +145,13 @@ def retrieval_times(coords, static=False):
             "time": time[0].strftime("%H:00"),
         }
 
+    periods = time.to_period("M") if monthly else time.to_period("Y")
+
     times = []
-    for year in time.year.unique():
-        t = time[time.year == year]
+    for period in periods.unique():
+        t = time[periods == period]
         query = {
-            "year": str(year),
+            "year": str(period.year),
             "month": list(t.month.unique()),
             "day": list(t.day.unique()),
             "time": ["%02d:00" % h for h in t.hour.unique()],
@@ -111,11 +169,48 @@ def noisy_unlink(path):
         logger.error(f"Unable to delete file {path}, as it is still in use.")
 
 
-def retrieve_data(product, chunks=None, tmpdir=None, lock=None, **updates):
+def subset_to_request(ds, request):
+    """
+    Selects the area and time steps of a request from a CDS file covering
+    it, e.g. a file served by the download cache for a larger request.
+    """
+    north, west, south, east = request["area"]
+    dx, dy = request.get("grid", (0, 0))
+    lon, lat = ds["longitude"], ds["latitude"]
+    ds = ds.isel(
+        longitude=((lon >= west - dx / 2) & (lon <= east + dx / 2)).values,
+        latitude=((lat >= south - dy / 2) & (lat <= north + dy / 2)).values,
+    )
+
+    time = ds.indexes["time"]
+    selected = (
+        time.year.isin(atleast_1d(request["year"]).astype(int))
+        & time.month.isin(atleast_1d(request["month"]).astype(int))
+        & time.day.isin(atleast_1d(request.get("day", time.day)).astype(int))
+        & time.strftime("%H:00").isin(
+            atleast_1d(request.get("time", time.strftime("%H:00")))
+        )
+    )
+    return ds.isel(time=selected)
+
+
+def download_data(product, tmpdir=None, lock=None, cache=None, **updates):
     """
     Download data like ERA5 from the Climate Data Store (CDS).
     If you want to track the state of your request go to
     https://cds.climate.copernicus.eu/cdsapp#!/yourrequests
+
+    If a DownloadCache is passed as cache, requests are first looked up
+    there and downloads are stored in it. The cached file is pinned and
+    has to be released from the cache once it is opened.
+
+    The file is only downloaded, not opened, such that downloads can run
+    on several threads, see open_data.
+
+    Returns:
+        (str, dict, bool): path of the file, the request and whether the
+                           file matches the request exactly. Cached files
+                           may cover a larger request.
     """
 
     request = {"product_type": "reanalysis", "format": "netcdf"}
@@ -125,25 +220,47 @@ def retrieve_data(product, chunks=None, tmpdir=None, lock=None, **updates):
         request
     ), "Need to specify at least 'variable', 'year' and 'month'"
 
-    client = cdsapi.Client(
-        info_callback=logger.debug, debug=logging.DEBUG >= logging.root.level
-    )
-    result = client.retrieve(product, request)
-
     if lock is None:
         lock = nullcontext()
 
-    with lock:
-        fd, target = mkstemp(suffix=".nc", dir=tmpdir)
-        os.close(fd)
+    target, exact = cache.lookup(product, request) if cache else (None, False)
+
+    if target is None:
+        client = cdsapi.Client(
+            info_callback=logger.debug, debug=logging.DEBUG >= logging.root.level
+        )
+        result = client.retrieve(product, request)
+
+        with lock:
+            yearstr = ", ".join(map(str, atleast_1d(request["year"])))
+            variables = atleast_1d(request["variable"])
+            varstr = "".join(["\t * " + v + f" ({yearstr})\n" for v in variables])
+            logger.info(f"CDS: Downloading variables\n{varstr}")
+
+            if not cache:
+                fd, target = mkstemp(suffix=".nc", dir=tmpdir)
+                os.close(fd)
 
-        yearstr = ", ".join(atleast_1d(request["year"]))
-        variables = atleast_1d(request["variable"])
-        varstr = "".join(["\t * " + v + f" ({yearstr})\n" for v in variables])
-        logger.info(f"CDS: Downloading variables\n{varstr}")
-        result.download(target)
+        if cache:
+            target = cache.add(product, request, result.download)
+            exact = True
+        else:
+            result.download(target)
+    else:
+        logger.info(f"CDS: Serving request from cached file {target}")
 
-    ds = xr.open_dataset(target, chunks=chunks or {})
+    return target, request, exact
+
+
+def open_data(target, request, exact=True, chunks=None):
+    """
+    Opens a file returned by download_data, subset to the request if it
+    covers more. Holds netcdf_lock, as HDF5 is not thread-safe.
+    """
+    with netcdf_lock:
+        ds = xr.open_dataset(target, chunks=chunks or {})
+        if not exact:
+            ds = subset_to_request(ds, request)
     # if tmpdir is None:
     # logger.debug(f"Adding finalizer for {target}")
     # weakref.finalize(ds._file_obj._manager, noisy_unlink, target)
@@ -151,25 +268,143 @@ def retrieve_data(product, chunks=None, tmpdir=None, lock=None, **updates):
     return ds
 
 
-def get_data(geocutout, feature, tmpdir=None, lock=None, **creation_parameters):
+def retrieve_data(product, chunks=None, tmpdir=None, lock=None, cache=None, **updates):
+    """
+    Downloads data from the CDS and opens it, see download_data.
+    Cached files covering a larger request are subset to the requested
+    area and time steps.
+    """
+    target, request, exact = download_data(
+        product, tmpdir=tmpdir, lock=lock, cache=cache, **updates
+    )
+    ds = open_data(target, request, exact, chunks=chunks)
+    if cache:
+        cache.release(target)
+    return ds
+
+
+def get_data_chunks(
+    geocutout,
+    feature,
+    tmpdir=None,
+    lock=None,
+    max_workers=4,
+    monthly=False,
+    split_variables=False,
+    cache=True,
+    load=True,
+    skip=(),
+    **creation_parameters,
+):
+    """
+    Retrieves a feature from ERA5 period by period.
+
+    The time axis is split into one request per year (or per month), and
+    optionally into one request per CDS variable. All requests are submitted
+    concurrently to the CDS on a bounded thread pool. The threads only
+    download, the files are opened in the calling thread as their downloads
+    finish, since HDF5 is not thread-safe.
+
+    Args:
+        geocutout(GeoCutout): cutout providing coords, grid and chunks
+        feature(str): feature in `features`
+        tmpdir(str): directory for downloaded files
+        lock: lock held while creating download targets
+        max_workers(int): maximum number of requests submitted at once
+        monthly(bool): split requests by month instead of year
+        split_variables(bool): request each variable of the feature separately
+        cache(DownloadCache or bool): cache of downloaded files. True
+            (default) uses `download_cache()`, False disables caching
+        load(bool): load the data of each period into memory, o/w it is
+            read lazily from the downloaded files
+        skip(Set[str]): keys of periods that are not retrieved, see
+                        manifest.tile_key
+
+    Yields:
+        (dict, xr.Dataset): positions {'time': slice} of a period in the
+                            cutout and its data, in the order in which the
+                            downloads of the periods finish
+    """
 
     coords = geocutout.coords
+    time = coords["time"].to_index()
 
     retrieval_params = {
         "product": "reanalysis-era5-single-levels",
         "area": _area(geocutout.coords),
-        "chunks": geocutout.chunks,
         "grid": [geocutout.dx, geocutout.dy],
+        "tmpdir": tmpdir,
         "lock": lock,
+        "cache": download_cache() if cache is True else cache or None,
     }
 
-    coords = geocutout.coords
-
-    func = globals().get(f"get_data_{feature}")
-
-    def retrieve_once(time):
-        return func({**retrieval_params, **time})
-
-    datasets = map(retrieve_once, retrieval_times(coords))
+    if feature not in feature_variables:
+        raise NotImplementedError(
+            f"ERA5 feature {feature} is not available yet, "
+            f"missing features: {', '.join(static_features)}"
+        )
+
+    # periods are contiguous in the sorted time axis of the cutout
+    periods = time.to_period("M") if monthly else time.to_period("Y")
+    regions = [
+        {"time": slice(int(positions[0]), int(positions[-1]) + 1)}
+        for positions in (np.flatnonzero(periods == p) for p in periods.unique())
+    ]
+    times = retrieval_times(coords, monthly=monthly)
+
+    if split_variables:
+        variables = [[v] for v in feature_variables[feature]]
+    else:
+        variables = [None]
+
+    requests = [
+        (i, j)
+        for i, j in product(range(len(times)), range(len(variables)))
+        if tile_key(regions[i]) not in skip
+    ]
+
+    def download_once(request):
+        i, j = request
+        return download_data(
+            variable=cds_variables(feature, variables[j]),
+            **retrieval_params,
+            **times[i],
+        )
+
+    parts = dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(download_once, request): request for request in requests}
+        for n, future in enumerate(as_completed(futures), 1):
+            i, j = futures[future]
+            target, request, exact = future.result()
+            ds = open_data(target, request, exact, chunks=geocutout.chunks)
+            if retrieval_params["cache"]:
+                retrieval_params["cache"].release(target)
+            ds = to_feature(ds, feature, variables[j])
+            parts.setdefault(i, dict())[j] = ds
+            logger.info(f"ERA5: {n} of {len(requests)} requests finished")
+
+            if len(parts[i]) < len(variables):
+                continue
+
+            ds = xr.merge(parts.pop(i).values(), compat="override")
+            ds = ds.sel(time=time[regions[i]["time"]])
+            if load:
+                with netcdf_lock:
+                    ds = ds.load()
+            yield regions[i], ds
+
+
+def get_data(geocutout, feature, **kwargs):
+    """
+    Retrieves a feature from ERA5, see get_data_chunks for the arguments.
+    The data is read lazily from the downloaded files.
 
-    return xr.concat(datasets, dim="time").sel(time=coords["time"])
+    Returns:
+        xr.Dataset
+    """
+    chunks = sorted(
+        get_data_chunks(geocutout, feature, **{**kwargs, "load": False}),
+        key=lambda chunk: chunk[0]["time"].start,
+    )
+    return xr.concat([ds for _, ds in chunks], dim="time")
@@ -0,0 +1,145 @@
+"""
+Geophysical properties derived from the lithology of a cutout.
+
+Properties are computed in bulk: the property database is turned into
+lookup arrays over the vocabulary codes of the stored lithology, statistics
+are computed once per distinct composition with
+stats_utils.get_mean_variance_batch, and gathered per cell through the
+dask-parallel lith accessor.
+"""
+
+import numpy as np
+import xarray as xr
+
+from ..utils import Lith
+from ..geophysics.stats_utils import get_mean_variance_batch
+from ..geophysics.thermal_conductivity import thermal_conductivity_database
+from ..geophysics.heat_capacity import heat_capacity_database
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+features = {
+    "thermal_conductivity": [
+        "thermal_conductivity_mean",
+        "thermal_conductivity_variance",
+    ],
+    "heat_capacity": [
+        "heat_capacity_mean",
+        "heat_capacity_variance",
+    ],
+}
+
+databases = {
+    "thermal_conductivity": thermal_conductivity_database,
+    "heat_capacity": heat_capacity_database,
+}
+
+units = {
+    "thermal_conductivity": "W m-1 K-1",
+    "heat_capacity": "MJ m-3 K-1",
+}
+
+# bounds of the share of major, minor and unordered lithologies in a
+# composition, as used by Lith.property_statistics
+share_bounds = {
+    "major": (0.50, 0.99),
+    "minor": (0.0, 0.50),
+    "other": (0.0, 1.0),
+}
+
+
+def lookup_tables(vocabulary, database):
+    """
+    Means and variances of the database entries for each vocabulary code.
+    Rock names missing in the database obtain the 'generic' entry.
+
+    Args:
+        vocabulary(List[str]): rock names indexed by code
+        database(dict): rock name -> (mean, variance)
+
+    Returns:
+        [np.ndarray, np.ndarray]: means and variances indexed by code
+    """
+    params = np.array(
+        [database.get(name, database["generic"]) for name in vocabulary],
+        dtype=float,
+    ).reshape(-1, 2)
+    return params[:, 0], params[:, 1]
+
+
+def composition_statistics(codes, vocabulary, database):
+    """
+    Mean and variance of a property for each composition of a LithField.
+
+    As in Lith.property_statistics, the major and minor lithologies are
+    used with the shares given by share_bounds; only if neither is known,
+    the unordered lithologies are used.
+
+    Args:
+        codes(np.ndarray[int]): (n_compositions, 7) vocabulary codes
+        vocabulary(List[str]): rock names indexed by code
+        database(dict): rock name -> (mean, variance)
+
+    Returns:
+        [np.ndarray, np.ndarray]: (n_compositions,) means and variances,
+                                  NaN for empty compositions
+    """
+    codes = np.asarray(codes).reshape(-1, Lith.n_slots)
+    table_means, table_vars = lookup_tables(vocabulary, database)
+
+    ordered = codes[:, :4]
+    others = codes[:, 4:]
+    use_others = (ordered < 0).all(axis=1, keepdims=True)
+    components = np.where(
+        use_others, np.pad(others, ((0, 0), (0, 1)), constant_values=-1), ordered
+    )
+
+    slot_bounds = np.array(
+        [share_bounds["major"]] + 3 * [share_bounds["minor"]], dtype=float
+    )
+    bounds = np.where(
+        use_others[..., None], np.array(share_bounds["other"]), slot_bounds
+    )
+
+    present = components >= 0
+    means = np.where(present, table_means[components.clip(0)], np.nan)
+    vars = np.where(present, table_vars[components.clip(0)], np.nan)
+    alphas = np.where(present, bounds[..., 0], np.nan)
+    betas = np.where(present, bounds[..., 1], np.nan)
+
+    return get_mean_variance_batch(means, vars, alphas, betas)
+
+
+def get_data(geocutout, feature, **kwargs):
+    """
+    Computes mean and variance rasters of a property from the lithology
+    of the cutout. Requires the feature 'lithology' to be prepared.
+
+    Args:
+        geocutout(GeoCutout): cutout with prepared lithology
+        feature(str): feature in `features`
+
+    Returns:
+        xr.Dataset
+    """
+    ds = geocutout.data
+    if ds["lithology"].dtype == object:
+        ds = Lith.to_dataset(ds["lithology"])
+
+    mean, variance = composition_statistics(
+        ds["lith_codes"].to_numpy(), ds.lith.vocabulary, databases[feature]
+    )
+
+    names = features[feature]
+    result = xr.Dataset(
+        {
+            names[0]: ds.lith.gather(mean),
+            names[1]: ds.lith.gather(variance),
+        }
+    )
+    result[names[0]].attrs["units"] = units[feature]
+    result[names[1]].attrs["units"] = f"({units[feature]})^2"
+
+    return result
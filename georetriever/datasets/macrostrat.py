@@ -1,81 +1,322 @@
+import os
+import time
+import hashlib
+import threading
 import geopandas as gpd
 import requests
 import numpy as np
-import xarray as xr
-from io import StringIO
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PIL import ImageColor
 
-from ..utils import Lith
+from ..gis import grid_points
+from ..utils import Lith, LithField
+from ..utils.cache import PolygonCache, default_cache_dir
 
-features = {"lithology": "lithology"}
+import logging
+
+logger = logging.getLogger(__name__)
+
+features = {"lithology": ["lithology"] + LithField.variables}
 lith_coords = ["x", "y"]
 crs = 4326
 
+api_link = "https://macrostrat.org/api/geologic_units/map"
+cache_path = os.path.join(default_cache_dir, "macrostrat_units.pkl")
+
+
+class RateLimiter:
+    """Thread-safe limiter allowing at most `rate` calls per second"""
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class MacrostratClient:
+    """
+    Concurrent client of the Macrostrat map unit API.
+
+    Requests are sent from a thread pool through a single keep-alive
+    session, whose connection pool matches the concurrency cap. Calls are
+    spaced by a shared rate limit, and failed requests (connection errors,
+    timeouts, HTTP 429 and 5xx) are retried with exponential backoff.
+
+    Args:
+        url(str): endpoint of the map unit API
+        concurrency(int): maximum number of requests in flight
+        rate_limit(float): maximum number of requests per second, None for no limit
+        retries(int): number of retries of a failing request
+        backoff(float): base delay in seconds, doubled with every retry
+        timeout(float): timeout in seconds of a single request
+    """
+
+    retry_status = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        url=api_link,
+        concurrency=8,
+        rate_limit=10.0,
+        retries=5,
+        backoff=0.5,
+        timeout=30.0,
+    ):
+        self.url = url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate_limit)
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=concurrency
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def get_units(self, lng, lat):
+        """
+        Queries all map units at a point
+
+        Returns:
+            gpd.GeoDataFrame: one row per returned map unit
+        """
+        params = dict(format="geojson_bare", lat=lat, lng=lng)
+
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                response = self.session.get(
+                    self.url, params=params, timeout=self.timeout
+                )
+                if response.status_code not in self.retry_status:
+                    response.raise_for_status()
+                    break
+                error = requests.HTTPError(f"Status {response.status_code}")
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                error = exc
+
+            if attempt == self.retries:
+                raise error
+
+            delay = self.backoff * 2**attempt
+            logger.debug(f"Macrostrat: retrying ({lng}, {lat}) in {delay}s: {error}")
+            time.sleep(delay)
+
+        collection = response.json()
+        return gpd.GeoDataFrame.from_features(collection.get("features", []), crs=crs)
+
+    def map(self, points):
+        """
+        Queries map units for several points concurrently
+
+        Args:
+            points(Iterable[(float, float)]): (lng, lat) pairs
+
+        Yields:
+            ((lng, lat), gpd.GeoDataFrame) in order of completion
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = {pool.submit(self.get_units, *point): point for point in points}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+
+def interpret_units(units):
+    """
+    Turns a Macrostrat response into the unit used to fill the grid
+
+    Args:
+        units(gpd.GeoDataFrame): response of the API at a point
+
+    Returns:
+        (unit_id, shapely.geometry.Polygon, Lith) or None if
+        the response holds no map unit. The unit id is the 'map_id' of
+        the unit, or if it is missing a hash of its geometry, such that
+        ids are unique across responses
+    """
+    if units.empty:
+        return None
+
+    lith = Lith()
+    lith, best_info = lith.interpret_macrostrat(units["lith"], return_best_info=True)
+
+    best = units.loc[best_info]
+
+    try:
+        lith.colors = ImageColor.getcolor(best.loc["color"], "RGB")
+    except (TypeError, ValueError, AttributeError):
+        pass
+
+    unit_id = best.get("map_id")
+    if unit_id is None or pd.isnull(unit_id):
+        digest = hashlib.sha256(best.loc["geometry"].wkb).hexdigest()
+        unit_id = f"wkb-{digest[:16]}"
+    return unit_id, best.loc["geometry"], lith
+
+
+def fill_from_cache(grid, cache):
+    """
+    Assigns cached units to all unfilled points of the grid in one
+    vectorized spatial join. Modifies grid['unit'] in place.
+    """
+    unfilled = grid["unit"].isna()
+    if unfilled.any():
+        matched = cache.match(grid.loc[unfilled, ["geometry"]])
+        grid.loc[matched.index, "unit"] = matched.values
+
+    return grid
+
+
+def select_seeds(grid, n_seeds, spacing):
+    """
+    Picks up to n_seeds unfilled points of the grid, at most one per
+    spacing x spacing degree bin, such that a batch of concurrent requests
+    is spread over the uncovered area instead of hitting the same unit.
+    """
+    uncovered = grid.loc[grid["unit"].isna(), ["lng", "lat"]]
+    bins = np.floor(uncovered / spacing).astype(int)
+
+    return uncovered.loc[~bins.duplicated()].iloc[:n_seeds]
+
 
 def get_data(
     geocutout,
     args,
+    cache=None,
+    client=None,
+    seed_spacing=0.1,
     **kwargs,
 ):
+    """
+    Retrieves lithologies from Macrostrat for the cutout grid.
+
+    All map units obtained so far are kept in an on-disk PolygonCache.
+    The grid is first filled from the cache in a single spatial join.
+    Points that remain uncovered are queried in batches of spread-out seed
+    points, sent concurrently through a MacrostratClient. Each response is
+    added to the cache and assigned to all uncovered points within the
+    returned polygon, using the spatial index of the grid.
+    The cache is written after every batch, such that an interrupted run
+    resumes from the units obtained so far.
+
+    Args:
+        geocutout(GeoCutout): cutout providing coords
+        args: feature to be retrieved (only 'lithology')
+        cache(PolygonCache or str): cache or path to a cache file. Defaults
+            to macrostrat_units.pkl in the georetriever cache directory
+        client(MacrostratClient): client used for requests. Defaults to a
+            client with default settings
+        seed_spacing(float): minimal distance in degrees between points
+            queried in the same batch
+
+    Returns:
+        xr.Dataset with lithologies in the compact layout of LithField
+    """
 
     coords = geocutout.coords
 
-    x, y, _ = geocutout.coords.indexes.values()
-    x, y = np.meshgrid(x, y)
+    shape = coords["x"].size, coords["y"].size
+    x, y = grid_points(coords["x"].values, coords["y"].values, indexing="ij")
 
-    grid = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x.flatten(), y.flatten()))
+    if not isinstance(cache, PolygonCache):
+        cache = PolygonCache(cache or cache_path, columns=Lith.index)
 
-    grid["lng"] = x.flatten()
-    grid["lat"] = y.flatten()
-    grid["lith"] = (np.ones(len(grid)) * (-1)).astype("int")
+    grid = gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(x, y),
+        crs=crs,
+    )
+    grid["lng"] = x
+    grid["lat"] = y
+    grid["unit"] = np.nan
+    grid["unit"] = grid["unit"].astype(object)
+
+    grid = fill_from_cache(grid, cache)
+    empty = grid["unit"].isna() & cache.is_empty(grid["lng"], grid["lat"])
+    grid.loc[empty, "unit"] = ""
 
-    request_params = dict(
-        format="geojson_bare",
+    logger.info(
+        f"Macrostrat: {grid['unit'].notna().sum()} of {len(grid)} points "
+        "filled from cache"
     )
-    api_link = "https://macrostrat.org/api/geologic_units/map"
 
-    for idx, row in grid.iterrows():
+    own_client = client is None
+    if own_client:
+        client = MacrostratClient()
 
-        if not grid.loc[idx, "lith"] == -1:
-            continue
+    try:
+        while grid["unit"].isna().any():
 
-        request_params.update(dict(lat=row.lat, lng=row.lng))
+            seeds = select_seeds(grid, 4 * client.concurrency, seed_spacing)
+            points = dict(zip(seeds.itertuples(index=False, name=None), seeds.index))
 
-        result = requests.get(api_link, params=request_params)
+            for (lng, lat), units in client.map(points):
 
-        result = result.content
-        result = StringIO(str(result, "utf-8"))
-        result = gpd.read_file(result)
+                idx = points[(lng, lat)]
+                unit = interpret_units(units)
 
-        lith = Lith()
-        lith, best_info = lith.interpret_macrostrat(
-            result["lith"], return_best_info=True
-        )
+                if unit is None:
+                    cache.add_empty(lng, lat)
+                    grid.loc[idx, "unit"] = ""
+                    continue
+
+                unit_id, polygon, lith = unit
+                cache.add(unit_id, polygon, **dict(zip(Lith.index, lith.tolist())))
+
+                hits = grid.index[grid.sindex.query(polygon, predicate="intersects")]
+                hits = hits[grid.loc[hits, "unit"].isna()]
+                grid.loc[hits, "unit"] = unit_id
+                grid.loc[idx, "unit"] = unit_id
+
+            cache.save()
+            logger.info(
+                f"Macrostrat: {grid['unit'].notna().sum()} of {len(grid)} "
+                f"points filled, {len(cache)} units cached"
+            )
 
-        try:
-            color = result.iloc[best_info].loc["color"]
-            lith.colors = ImageColor.getcolor(color, "RGB")
-        except TypeError:
-            pass
+    except BaseException:
+        cache.save()
+        raise
 
-        polygon = result.iloc[best_info].loc["geometry"]
+    finally:
+        if own_client:
+            client.close()
 
-        assign_mask = grid["geometry"].within(polygon)
-        grid.loc[assign_mask, "lith"] = lith
+    field = LithField(np.zeros(shape), np.empty((0, 7)), np.empty((0, 3)), [])
 
-    grid = grid["lith"].to_numpy().reshape(x.shape[::-1])
+    compositions = {"": field.intern(Lith())}
+    for unit_id in grid["unit"].unique():
+        if unit_id != "":
+            lithlist = cache.units.loc[unit_id, Lith.index].tolist()
+            compositions[unit_id] = field.intern(Lith.from_list(lithlist))
 
-    print("in macrostrat")
-    print(grid.shape)
-    print("coords:")
-    print(coords)
-    print("lith coords")
-    print(lith_coords)
+    field.index = grid["unit"].map(compositions).to_numpy(dtype=np.int32)
+    field.index = field.index.reshape(shape)
 
-    ds = xr.Dataset(
-        data_vars=dict(
-            lithology=(lith_coords, grid),
-        ),
+    ds = field.to_dataset(
+        lith_coords,
         coords={
             name: vals for (name, vals), _ in zip(coords.indexes.items(), range(2))
         },
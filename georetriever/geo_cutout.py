@@ -1,18 +1,15 @@
-import os
+import copy
 import xarray as xr
 import pandas as pd
 import numpy as np
-import dask
-import geopandas as gpd
-import rasterio as rio
 
-from shapely.geometry import box
 from pathlib import Path
-from pyproj import CRS
 
 from .gis import get_coords
-from .utils import Lith
-from .data import geocutout_prepare
+from .utils import Lith, LithField
+from .data import geocutout_prepare, feature_mapping
+from .datasets import modules as datamodules
+from .storage import get_backend, open_cutout, write_cutout, chunks_from_attrs
 
 import logging
 
@@ -23,7 +20,7 @@ class GeoCutout:
 
     CRS = 4326
 
-    def __init__(self, path, **cutoutparams):
+    def __init__(self, path, backend=None, **cutoutparams):
         """
         Adapted from 'Cutout' in the amazing "atlite" package
 
@@ -35,7 +32,14 @@ class GeoCutout:
         Parameters
         ----------
         path : str | path-like
-            NetCDF from which to load or where to store the cutout
+            NetCDF file or Zarr store (suffix .zarr) from which to load or
+            where to store the cutout. Existing cutouts are opened lazily;
+            parameters passed along are checked against the stored ones
+        backend : str, optional
+            'netcdf' or 'zarr'. If given, the suffix of path is set
+            accordingly (.nc or .zarr), o/w it is inferred from the suffix.
+            Zarr stores are written chunk-wise in parallel and allow to add
+            variables or extend along time without rewriting stored chunks
         x : slice, optional
             Outer longitudinal bounds for the cutout (west, east)
         y : slice, optional
@@ -53,14 +57,24 @@ class GeoCutout:
             pandas offset aliases.
         """
 
-        self._prepared = False
+        path = Path(path)
+        assert backend in (None, "netcdf", "zarr"), f"Unknown backend {backend}"
+        if (backend or get_backend(path)) == "zarr":
+            path = path.with_suffix(".zarr")
+        else:
+            path = path.with_suffix(".nc")
+        self.path = path
 
-        path = Path(path).with_suffix(".nc")
+        if path.exists():
+            logger.info(f"Loading existing cutout {path}")
 
-        logger.debug("To be implemented: method to load path and check existence")
-        if False:
-            # Implement cutout-loading here
-            pass
+            self.data = open_cutout(path)
+            self._check_cutoutparams(**cutoutparams)
+
+            prepared = np.atleast_1d(self.data.attrs.get("prepared_features", []))
+            logger.info(
+                f"Variables prepared in {path}: " + (", ".join(prepared) or "none")
+            )
         else:
             logger.info(f"Building new cutout {path}")
 
@@ -75,14 +89,76 @@ class GeoCutout:
                     "passed via argument 'bounds' or 'x' and 'y'."
                 ) from exc
 
+            chunks = {
+                k: cutoutparams.pop(k)
+                for k in list(cutoutparams)
+                if k.startswith("chunksize_")
+            }
+
             coords = get_coords(x, y, time, **cutoutparams)
 
-            attrs = {"prepared_features": list(), **cutoutparams}
+            attrs = {"prepared_features": list(), **cutoutparams, **chunks}
 
-            data = xr.Dataset(coords=coords, attrs=attrs)
+            self.data = xr.Dataset(coords=coords, attrs=attrs)
 
-        self.data = data
-        self.path = path
+    def _check_cutoutparams(self, **cutoutparams):
+        """
+        Raises a ValueError if the parameters requested for a loaded cutout
+        do not match its coordinates. Each of x, y and time is compared on
+        its own, taking unspecified steps from the cutout. Parameters that
+        only apply to new cutouts, e.g. chunksize_*, are ignored with a
+        warning if they differ from the stored ones.
+        """
+        mismatches = list()
+
+        for step in ("dx", "dy"):
+            if step in cutoutparams and not np.isclose(
+                cutoutparams[step], getattr(self, step)
+            ):
+                mismatches.append(
+                    f"{step}: requested {cutoutparams[step]}, "
+                    f"stored {getattr(self, step)}"
+                )
+
+        if "dt" in cutoutparams and "dt" in self.data.attrs:
+            if not _same_frequency(cutoutparams["dt"], self.data.attrs["dt"]):
+                mismatches.append(
+                    f"dt: requested {cutoutparams['dt']}, "
+                    f"stored {self.data.attrs['dt']}"
+                )
+
+        dims = [dim for dim in ("x", "y", "time") if dim in cutoutparams]
+        if dims and not mismatches:
+            steps = {"dx": self.dx, "dy": self.dy}
+            if "dt" in self.data.attrs:
+                steps["dt"] = _frequency(self.data.attrs["dt"])
+            steps.update((k, cutoutparams[k]) for k in steps if k in cutoutparams)
+
+            # dimensions that are not requested span the stored coordinates
+            bounds = {
+                dim: slice(*self.data.indexes[dim][[0, -1]])
+                for dim in ("x", "y", "time")
+            }
+            requested = get_coords(
+                **{**bounds, **{dim: cutoutparams[dim] for dim in dims}}, **steps
+            )
+            for dim in dims:
+                if not requested.indexes[dim].equals(self.data.indexes[dim]):
+                    mismatches.append(f"{dim}: requested coordinates differ")
+
+        checked = {"x", "y", "time", "dx", "dy", "dt"}
+        for key, value in cutoutparams.items():
+            if key not in checked and value != self.data.attrs.get(key):
+                logger.warning(
+                    f"Ignoring {key}={value} for existing cutout {self.path}, "
+                    f"stored: {self.data.attrs.get(key)}"
+                )
+
+        if mismatches:
+            raise ValueError(
+                f"Existing cutout {self.path} does not match the requested "
+                "parameters:\n\t" + "\n\t".join(mismatches)
+            )
 
     def prepare(self, *args, **kwargs):
         """Obtains the data. See data.geocutout_prepare for details"""
@@ -93,55 +169,115 @@ class GeoCutout:
         Wrapper of xarray.Dataset().to_netcdf that makes parts of retrieved data
         storable before storing
         """
+        object_mode = self._object_mode
         self.to_saveable_mode()
         self.data.to_netcdf(filename)
-        self.to_object_mode()
+        if object_mode:
+            self.to_object_mode()
+
+    def to_zarr(self, store):
+        """
+        Stores the cutout in a Zarr store, chunked according to the
+        chunksize_* attributes. Sends self.data to saveable mode first,
+        as in to_netcdf. See storage.write_cutout
+        """
+        object_mode = self._object_mode
+        self.to_saveable_mode()
+        write_cutout(self.data, store, backend="zarr")
+        if object_mode:
+            self.to_object_mode()
+
+    def tile(self, x=slice(None), y=slice(None)):
+        """
+        GeoCutout restricted to the grid positions x and y (slices), which
+        shares path and attributes with self. Tiles are retrieved like a
+        cutout but never stored by themselves, see tiles
+        """
+        tile = copy.copy(self)
+        tile.data = self.data.isel(x=x, y=y)
+        return tile
+
+    def tiles(self, tilesize):
+        """
+        Splits the grid into tiles of at most tilesize cells along x and y.
+        Tiles are composed of whole chunks of the chunksize_* attributes,
+        such that tiles can be written to a Zarr store independently, and
+        a remainder of a single row or column is added to the last tile.
+
+        Args:
+            tilesize(int or dict): cells per tile, or per dimension {'x', 'y'}
+
+        Yields:
+            (dict, GeoCutout): positions {'x': slice, 'y': slice} and tile
+        """
+        if not isinstance(tilesize, dict):
+            tilesize = {"x": tilesize, "y": tilesize}
+        chunks = self.chunks or dict()
+
+        slices = dict()
+        for dim in ("x", "y"):
+            size = self.data.sizes[dim]
+            step = min(tilesize.get(dim) or size, size)
+            if chunks.get(dim):
+                step = -(-step // chunks[dim]) * chunks[dim]
+            starts = list(range(0, size, step))
+            if len(starts) > 1 and size - starts[-1] == 1:
+                starts.pop()
+            slices[dim] = [
+                slice(start, stop) for start, stop in zip(starts, starts[1:] + [size])
+            ]
+
+        for y in slices["y"]:
+            for x in slices["x"]:
+                yield {"x": x, "y": y}, self.tile(x=x, y=y)
 
     @staticmethod
     def open_dataset(filename):
         """
-        Wrapper of xarray.open_dataset() that reads filename and transforms
-        retrieved data into object mode.
-        Overwrites self.data
+        Lazily opens a stored cutout and brings lithologies stored in
+        earlier layouts into the compact layout of utils.LithField.
+        See storage.open_cutout
         """
-        ds = xr.open_dataset(filename)
-        if "major" in ds.variables:
-            ds["lithology"] = Lith.to_dataarray(ds)
-        ds = ds.drop(Lith.index)
-        return ds
+        return open_cutout(filename)
 
     def to_saveable_mode(self):
         """
-        Sends self.data to saveable_mode, where some functionalities
-        are not available but self.data can be saved as netcdf
+        Sends self.data to saveable_mode, where lithologies are held as
+        integer arrays (see utils.LithField) and self.data can be saved
+        as netcdf. This is the mode in which data is prepared.
         """
         if self._saveable_mode:
             return
-        self.data = xr.merge([self.data, Lith.to_dataset(self.data["lithology"])])
-        self.data = self.data.drop("lithology")
+        lith = Lith.to_dataset(self.data["lithology"])
+        self.data = self.data.drop_vars("lithology").assign(lith.data_vars)
 
     def to_object_mode(self):
         """
-        Sends self.data to object_mode, where some functionalities are
-        available but self.data can not be saved as netcdf
+        Sends self.data to object_mode, where lithologies are held as
+        utils.Lith objects, but self.data can not be saved as netcdf
         """
-        if self._object_mode:
+        if self._object_mode or "lithology" not in self.data:
             return
-        self.data["lithology"] = Lith.to_dataarray(self.data)
-        self.data = self.data.drop(Lith.index)
+        lith = Lith.to_dataarray(self.data)
+        self.data = self.data.drop_vars(LithField.variables).assign(lithology=lith)
+
+    @property
+    def data(self):
+        """xr.Dataset holding the cutout"""
+        return self._data
+
+    @data.setter
+    def data(self, ds):
+        """Sets the dataset and records in which mode its lithology is held"""
+        self._data = ds
+        self._mode = "object" if _holds_objects(ds) else "saveable"
 
     @property
     def _object_mode(self):
         """If True, self.data contains custom objects such as utils.Lith,
         can not be stored as a netcdf in that case, but has additional
         functionality"""
-        try:
-            self.data.to_netcdf("hold.nc")
-            os.remove("hold.nc")
-        except ValueError:
-            return True
-
-        return False
+        return self._mode == "object"
 
     @property
     def _saveable_mode(self):
@@ -160,8 +296,14 @@ class GeoCutout:
 
     @property
     def available_features(self):
-        """Lists available geodata for the cutout"""
-        raise NotImplementedError("implement me")
+        """Features whose variables are all contained in the cutout,
+        mapped to the module that provides them"""
+        available = dict()
+        for feature, module in feature_mapping.items():
+            variables = np.atleast_1d(datamodules[module].features[feature])
+            if all(var in self.data.variables for var in variables):
+                available[feature] = module
+        return available
 
     @property
     def coords(self):
@@ -197,15 +339,33 @@ class GeoCutout:
     @property
     def prepared(self):
         """Boolean indicating if all features have been prepared"""
-        logging.warning("GeoCutout.prepared is not yet fully implemented")
-        return self._prepared
+        return set(feature_mapping).issubset(self.available_features)
 
     @property
     def chunks(self):
         """Chunking of the cutout data used by dask."""
-        chunks = {
-            k.lstrip("chunksize_"): v
-            for k, v in self.data.attrs.items()
-            if k.startswith("chunksize_")
-        }
-        return None if chunks == {} else chunks
+        return chunks_from_attrs(self.data.attrs)
+
+
+def _holds_objects(ds):
+    """Returns if the lithology of ds is held as utils.Lith objects"""
+    return "lithology" in ds.variables and ds["lithology"].dtype == object
+
+
+def _frequency(dt):
+    """Offset alias dt, lowercased if pandas rejects it, e.g. 'H' becomes 'h'"""
+    try:
+        pd.tseries.frequencies.to_offset(dt)
+        return dt
+    except ValueError:
+        return str(dt).lower()
+
+
+def _same_frequency(a, b):
+    """Compares two pandas offset aliases, e.g. 'h' and 'H'"""
+    try:
+        return pd.tseries.frequencies.to_offset(a) == pd.tseries.frequencies.to_offset(
+            b
+        )
+    except ValueError:
+        return str(a).lower() == str(b).lower()
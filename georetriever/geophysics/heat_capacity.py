@@ -1,3 +1,36 @@
 from attrdict import AttrDict
+import numpy as np
 
-heat_capacity_database = AttrDict({})
+# volumetric heat capacity in MJ m-3 K-1 as (mean, variance), after the
+# ranges given in VDI 4640 Part 1 (2010). Each range is taken as 95%
+# interval around its midpoint.
+heat_capacity_database = AttrDict(
+    {
+        "granite": (2.55, 0.0527),
+        "diorite": (2.95, 0.0007),
+        "gabbro": (2.55, 0.0319),
+        "basalt": (2.45, 0.0059),
+        "gneiss": (2.1, 0.0234),
+        "marble": (2.1, 0.0026),
+        "quartzite": (2.1, 0.0104),
+        "mica schist": (2.3, 0.0026),
+        "sandstone": (2.2, 0.0937),
+        "limestone": (2.25, 0.0059),
+        "dolomite": (2.45, 0.0319),
+        "siltstone": (2.25, 0.0059),
+        "clayshale": (2.25, 0.0059),
+        "conglomerate": (2.2, 0.0416),
+        "clay": (2.5, 0.2108),  # water saturated
+        "sand": (2.55, 0.0319),  # water saturated
+    }
+)
+
+# as for thermal conductivity, generic rock is the average of all entries
+heat_capacity_database["generic"] = tuple(
+    (
+        np.around(
+            np.vstack(list(heat_capacity_database.values())).mean(axis=0),
+            decimals=4,
+        )
+    )
+)
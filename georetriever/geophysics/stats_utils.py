@@ -1,8 +1,12 @@
 import numpy as np
 import logging
+from functools import lru_cache
 from scipy import stats
+from scipy.stats import qmc
 from scipy.optimize import minimize
 
+from ..utils.geo_utils import factorize_rows
+
 
 def get_mean_variance(
     means,
@@ -21,9 +25,10 @@ def get_mean_variance(
                          bounds alphas and upper bounds betas. Then we set
                          Y_n = 1 - \sum_{i=1}^{n-1} Y_i
 
-    Since n is small (between 2 and 5, otherwise there will be a warning)
-    we uniformly sample from the (n-1)-hyperrectangle (constrained by alphas
-    and betas) and discard points outside the simplex.
+    We sample the simplex above the lower bounds alphas with a fixed
+    quasi-random Sobol sequence and discard points above the upper bounds
+    betas. The resulting moments are deterministic and memoized per
+    (alphas, betas), see simplex_moments.
 
     From this, mean and variance of the Y_i are computed. Using these
     we obtain
@@ -36,45 +41,158 @@ def get_mean_variance(
         vars(np.ndarray[float]): variances of X
         alphas(np.ndarray[float]): lower bounds of Y
         betas(np.ndarray[float]): upper bounds of Y
-        n_samples(int): number of MC samples
+        n_samples(int): number of accepted QMC samples
 
     Returns:
         [float, float]: estimated mean and variance of Z
     """
 
     assert len(means) == len(vars) == len(alphas) == len(betas)
-    assert (alphas.sum() <= 1.0) & (betas.sum() >= 1.0)
 
     if len(means.flatten()) == 1:
-        return means.mean(), variances.mean()
+        return means.mean(), vars.mean()
+
+    assert (alphas.sum() <= 1.0) & (betas.sum() >= 1.0)
 
-    if len(means) > 6:
-        logging.warning("Too many dimensions, estimates maybe inprecise")
+    EYi, VYi = simplex_moments(alphas, betas, n_samples=n_samples)
 
-    samples = np.random.uniform(
-        low=alphas[:-1], high=betas[:-1], size=(n_samples, len(alphas) - 1)
-    )
+    mean = (means * EYi).sum()
+    variance = (vars * VYi + vars * EYi**2 + means**2 * VYi).sum()
+
+    return np.around(mean, decimals=4), np.around(variance, decimals=4)
+
+
+def simplex_moments(alphas, betas, n_samples=10_000):
+    """
+    Returns means and variances of Y_i for Y sampled uniformly from the
+    simplex with lower bounds alphas and upper bounds betas, see
+    get_mean_variance
+
+    Results are memoized per (alphas, betas, n_samples), such that repeated
+    compositions cost a dictionary lookup.
+
+    Args:
+        alphas(np.ndarray[float]): lower bounds of Y
+        betas(np.ndarray[float]): upper bounds of Y
+        n_samples(int): minimal number of accepted QMC samples
 
-    mask = (1 - betas[-1] < samples.sum(axis=1)) & (
-        samples.sum(axis=1) < 1.0 - alphas[-1]
+    Returns:
+        [np.ndarray, np.ndarray]: E[Y_i] and Var[Y_i]
+    """
+    key = tuple(np.round(np.asarray(alphas, dtype=float), 9)), tuple(
+        np.round(np.asarray(betas, dtype=float), 9)
     )
+    EY, VY = _simplex_moments(*key, n_samples)
+    return np.array(EY), np.array(VY)
 
-    samples = samples[mask]
 
-    samples = np.vstack(
-        [
-            samples.T,
-            1 - samples.sum(axis=1),
-        ]
-    ).T
+@lru_cache(maxsize=4096)
+def _simplex_moments(alphas, betas, n_samples, max_samples=2**22):
+    """
+    Deterministic quasi-Monte-Carlo estimate of the moments of Y.
 
-    EYi = np.mean(samples, axis=0)
-    VYi = np.var(samples, axis=0)
+    Points are drawn uniformly from the simplex above the lower bounds
+    (tightened by the upper bounds of all other components), using a
+    scrambled Sobol sequence with fixed seed, and points exceeding an upper
+    bound are discarded. The sequence is extended until n_samples points
+    are accepted (at most max_samples are drawn).
+    """
+    alphas, betas = np.array(alphas), np.array(betas)
+
+    if len(alphas) == 1:
+        return (1.0,), (0.0,)
+
+    # Y_i >= 1 - sum of the other upper bounds, and vice versa
+    low = np.maximum(alphas, 1 - (betas.sum() - betas))
+    high = np.minimum(betas, 1 - (alphas.sum() - alphas))
+    mass = 1 - low.sum()
+
+    sobol = qmc.Sobol(d=len(alphas) - 1, scramble=True, seed=0)
+
+    accepted = list()
+    n_accepted, n_drawn = 0, 0
+    while n_accepted < n_samples and n_drawn < max_samples:
+        # doubles the drawn points, keeping the balance of the Sobol sequence
+        n_draw = max(n_drawn, 2 ** int(np.ceil(np.log2(n_samples))))
+        n_drawn += n_draw
+
+        # spacings of sorted uniforms are uniform on the simplex, which is
+        # shifted to the lower bounds such that only upper bounds reject
+        u = np.sort(sobol.random(n_draw), axis=1)
+        u = np.hstack([np.zeros((n_draw, 1)), u, np.ones((n_draw, 1))])
+        samples = low + mass * np.diff(u, axis=1)
+
+        inside = (samples <= high).all(axis=1)
+        accepted.append(samples[inside])
+        n_accepted += inside.sum()
+
+    if n_accepted < n_samples:
+        logging.warning(
+            f"Only {n_accepted} of {n_drawn} samples within the simplex, "
+            "estimates maybe inprecise"
+        )
 
-    mean = (means * EYi).sum()
-    variance = (vars * VYi + vars * EYi**2 + means**2 * VYi).sum()
+    samples = np.vstack(accepted)
+    return tuple(samples.mean(axis=0)), tuple(samples.var(axis=0))
 
-    return np.around(mean, decimals=4), np.around(variance, decimals=4)
+
+def get_mean_variance_batch(means, vars, alphas, betas, n_samples=10_000):
+    """
+    Batched get_mean_variance for many cells at once.
+
+    Components are given as padded 2D arrays with one row per cell, NaN
+    where a cell has fewer components. The moments of Y only depend on
+    the bounds, so they are estimated once per distinct row of
+    (alphas, betas) and gathered for all cells; mean and variance of Z
+    then follow in a few array operations.
+
+    Args:
+        means(np.ndarray[float]): (n_cells, n_components) means of X
+        vars(np.ndarray[float]): (n_cells, n_components) variances of X
+        alphas(np.ndarray[float]): (n_cells, n_components) lower bounds of Y
+        betas(np.ndarray[float]): (n_cells, n_components) upper bounds of Y
+        n_samples(int): number of QMC samples per distinct signature
+
+    Returns:
+        [np.ndarray, np.ndarray]: (n_cells,) estimated means and variances
+                                  of Z, NaN for cells without components
+    """
+
+    means, vars = np.atleast_2d(means), np.atleast_2d(vars)
+    alphas, betas = np.atleast_2d(alphas), np.atleast_2d(betas)
+    assert means.shape == vars.shape == alphas.shape == betas.shape
+
+    valid = ~np.isnan(alphas)
+
+    # rows of (alphas, betas), padded with -1, identify the moments of Y
+    signatures = np.hstack([np.where(valid, alphas, -1), np.where(valid, betas, -1)])
+    inverse, first = factorize_rows(np.round(signatures * 1e9).astype(np.int64))
+    signatures = signatures[first]
+
+    n = alphas.shape[1]
+    EY = np.zeros((len(signatures), n))
+    VY = np.zeros((len(signatures), n))
+
+    for i, signature in enumerate(signatures):
+        used = signature[:n] >= 0
+        if not used.any():
+            continue
+
+        a, b = signature[:n][used], signature[n:][used]
+        if len(a) > 1:
+            assert (a.sum() <= 1.0) & (b.sum() >= 1.0)
+        EY[i, used], VY[i, used] = simplex_moments(a, b, n_samples=n_samples)
+
+    EY, VY = EY[inverse], VY[inverse]
+    means, vars = np.where(valid, means, 0), np.where(valid, vars, 0)
+
+    mean = (means * EY).sum(axis=1)
+    variance = (vars * VY + vars * EY**2 + means**2 * VY).sum(axis=1)
+
+    empty = ~valid.any(axis=1)
+    mean[empty], variance[empty] = np.nan, np.nan
+
+    return mean, variance
 
 
 def get_mean_var(lower, upper, conf=0.95):
@@ -5,19 +5,95 @@ Adapted from atlite.gis
 import numpy as np
 import pandas as pd
 import xarray as xr
-import scipy
-import geopandas as gpd
-import rasterio as rio
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# origin and end of the global grids to which cutout coordinates are aligned
+grid_start = {"x": -180, "y": -90}
+grid_stop = {"x": 180, "y": 90}
+time_start = "1959"
+
+
+def aligned_range(lower, upper, start, stop, step):
+    """
+    Values of np.around(np.arange(start, stop, step), 9) within
+    [lower, upper], generated for the requested bounds only
+
+    Returns:
+        np.ndarray
+    """
+    n = int(np.ceil((stop - start) / step))
+    # np.arange fills start + i * delta, with delta as below
+    delta = (start + step) - start
+
+    first = max(int(np.floor((lower - start) / delta)) - 1, 0)
+    last = min(int(np.ceil((upper - start) / delta)) + 1, n - 1)
+    values = np.around(start + np.arange(first, last + 1) * delta, 9)
+
+    return values[(values >= lower) & (values <= upper)]
+
+
+def time_window(time):
+    """
+    First and last timestamp covered by a time selection, parsed as
+    pd.Period for strings, e.g. '2019-01' covers all of January.
+    Open slice bounds and unparsable selections yield None.
+    """
+
+    def bounds(t):
+        if t is None:
+            return None, None
+        try:
+            if isinstance(t, str):
+                period = pd.Period(t)
+                return period.start_time, period.end_time
+            return pd.Timestamp(t), pd.Timestamp(t)
+        except (TypeError, ValueError):
+            return None, None
+
+    if isinstance(time, slice):
+        return bounds(time.start)[0], bounds(time.stop)[1]
+    return bounds(time)
+
+
+def time_index(time, dt="h"):
+    """
+    Timestamps of frequency dt around a time selection, aligned to the
+    range pd.date_range(start=time_start, end="now", freq=dt). Only the
+    requested window is generated for fixed frequencies; o/w the whole
+    range is returned.
+    """
+    origin, now = pd.Timestamp(time_start), pd.Timestamp("now")
+    start, end = time_window(time)
+
+    try:
+        step = pd.Timedelta(pd.tseries.frequencies.to_offset(dt))
+    except (TypeError, ValueError):
+        step = None
+
+    if step is None:
+        return pd.date_range(start=origin, end=now, freq=dt)
+
+    # one step of padding keeps the resolution pandas infers for the
+    # index, on which partial string selection depends
+    start = origin if start is None else max(start - step, origin)
+    end = now if end is None else min(end + step, now)
+    start = origin + -(-(start - origin) // step) * step
+
+    return pd.date_range(start=start, end=end, freq=dt)
+
+
 def get_coords(x, y, time, dx=0.25, dy=0.25, dt="h"):
     """
     Create GeoCutout coordinate system on the basis of slices and step sizes
 
+    The coordinates are those of global grids starting at (-180, -90) and
+    of a time range starting in 1959, selected by the slices, but only the
+    requested part of the grids is generated.
+
     Parameters
     ----------
     x : slice
@@ -41,18 +117,53 @@ def get_coords(x, y, time, dx=0.25, dy=0.25, dt="h"):
 
     ds = xr.Dataset(
         {
-            "x": np.around(np.arange(-180, 180, dx), 9),
-            "y": np.around(np.arange(-90, 90, dy), 9),
-            "time": pd.date_range(start="1959", end="now", freq=dt),
+            "x": aligned_range(x.start, x.stop, grid_start["x"], grid_stop["x"], dx),
+            "y": aligned_range(y.start, y.stop, grid_start["y"], grid_stop["y"], dy),
+            "time": time_index(time, dt),
         }
     )
 
     ds = ds.assign_coords(lon=ds.coords["x"], lat=ds.coords["y"])
-    ds = ds.sel(x=x, y=y, time=time)
+    ds = ds.sel(time=time)
 
     return ds
 
 
+def grid_points(x, y, indexing="ij", start=0, stop=None):
+    """
+    Coordinates of the points start:stop of the grid spanned by x and y,
+    in the order of np.meshgrid(x, y, indexing=indexing) flattened.
+    Points are computed from their flat index, such that parts of a large
+    grid are obtained without building the full mesh.
+
+    Returns:
+        (np.ndarray, np.ndarray): x and y of the points
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    stop = len(x) * len(y) if stop is None else stop
+
+    if indexing == "ij":
+        i, j = np.divmod(np.arange(start, stop), len(y))
+    else:
+        j, i = np.divmod(np.arange(start, stop), len(x))
+
+    return x[i], y[j]
+
+
+def grid_blocks(x, y, indexing="ij", blocksize=1_000_000):
+    """
+    Iterates over the points of the grid spanned by x and y in blocks of
+    at most blocksize points, see grid_points
+
+    Yields:
+        (slice, np.ndarray, np.ndarray): flat positions, x and y of a block
+    """
+    size = len(x) * len(y)
+    for start in range(0, size, blocksize):
+        stop = min(start + blocksize, size)
+        yield (slice(start, stop),) + grid_points(x, y, indexing, start, stop)
+
+
 def maybe_swap_spatial_dims(ds, namex="x", namey="y"):
     """Swap order of spatial dimensions according to atlite concention."""
     swaps = {}
@@ -0,0 +1,138 @@
+"""
+Progress records of cutout preparations, which allow to resume
+interrupted runs
+"""
+
+import os
+import json
+import time
+import numpy as np
+from pathlib import Path
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Manifest:
+    """
+    Progress of the preparation of a cutout, stored as JSON next to it
+    (e.g. cutout.zarr.manifest.json).
+
+    For every feature the manifest records whether it is being prepared
+    ('running') or finished ('done'). Features prepared tile by tile also
+    record the tile size and the tiles already written to the cutout,
+    together with arrays needed to continue, such as the composition
+    table shared by the lithology of all tiles, which are kept in a .npz
+    checkpoint per feature.
+
+    Everything needed to resume lives next to the cutout, such that
+    the temporary directory of a run can be deleted when it fails.
+
+    Args:
+        cutout_path(str | path-like): NetCDF file or Zarr store of the cutout
+    """
+
+    def __init__(self, cutout_path):
+        cutout_path = Path(cutout_path)
+        self.path = cutout_path.with_name(cutout_path.name + ".manifest.json")
+
+        self.features = dict()
+        if self.path.exists():
+            with open(self.path) as f:
+                self.features = json.load(f)["features"]
+
+    def start(self, feature, tilesize=None, resume=True):
+        """
+        Records that feature is being prepared. The progress of an earlier,
+        interrupted run is kept if it used the same tilesize and resume is
+        True, o/w the progress of the feature is reset.
+
+        Returns:
+            bool: True if an interrupted run is resumed
+        """
+        entry = self.features.get(feature, dict())
+        resumed = (
+            resume
+            and entry.get("status") == "running"
+            and entry.get("tilesize") == json.loads(json.dumps(tilesize))
+            and bool(entry.get("tiles"))
+        )
+
+        if resumed:
+            logger.info(
+                f"Resuming {feature}, {len(entry['tiles'])} tiles are already stored"
+            )
+        else:
+            self._remove_checkpoint(feature)
+            self.features[feature] = {
+                "status": "running",
+                "tilesize": tilesize,
+                "tiles": list(),
+                "started": _now(),
+            }
+        self.save()
+        return resumed
+
+    def finished_tiles(self, feature):
+        """Keys of the tiles of feature already written, see tile_key"""
+        return set(self.features.get(feature, dict()).get("tiles", list()))
+
+    def tile_done(self, feature, region, **arrays):
+        """
+        Records that the tile at region (dict of slices) is written,
+        together with the arrays needed to continue after it
+        """
+        if arrays:
+            self._save_checkpoint(feature, arrays)
+        self.features[feature]["tiles"].append(tile_key(region))
+        self.save()
+
+    def checkpoint(self, feature):
+        """Arrays stored with the last finished tile of feature, or None"""
+        path = self._checkpoint_path(feature)
+        if not path.exists() or not self.finished_tiles(feature):
+            return None
+        with np.load(path, allow_pickle=False) as arrays:
+            return dict(arrays)
+
+    def done(self, feature):
+        """Records that feature is prepared, dropping its tile progress"""
+        started = self.features.get(feature, dict()).get("started")
+        self.features[feature] = {
+            "status": "done",
+            "started": started,
+            "finished": _now(),
+        }
+        self._remove_checkpoint(feature)
+        self.save()
+
+    def save(self):
+        """Writes the manifest, replacing the previous one at once"""
+        tmp = str(self.path) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"features": self.features}, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def _checkpoint_path(self, feature):
+        return self.path.with_name(self.path.name[: -len(".json")] + f".{feature}.npz")
+
+    def _save_checkpoint(self, feature, arrays):
+        path = self._checkpoint_path(feature)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    def _remove_checkpoint(self, feature):
+        path = self._checkpoint_path(feature)
+        if path.exists():
+            path.unlink()
+
+
+def tile_key(region):
+    """String identifying a tile by its positions, e.g. 'x=0:40,y=40:80'"""
+    return ",".join(f"{dim}={s.start}:{s.stop}" for dim, s in sorted(region.items()))
+
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
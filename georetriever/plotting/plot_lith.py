@@ -1,5 +1,5 @@
 import numpy as np
-from itertools import product
+import xarray as xr
 import matplotlib.pyplot as plt
 
 
@@ -8,7 +8,8 @@ def plot_lith(liths):
     Creates a plot of lithologies
 
     Args:
-        liths(xr.DataArray): matrix of lithology objects
+        liths(xr.Dataset or xr.DataArray): dataset with lithologies in the
+            layout of utils.LithField, or matrix of lithology objects
     """
 
     coords = liths.coords
@@ -18,11 +19,12 @@ def plot_lith(liths):
 
     extent = [x.min(), x.max(), y.min(), y.max()]
 
-    liths_np = liths.to_numpy()
-    image = np.zeros(tuple(list(liths_np.shape) + [3]))
-
-    for i, j in product(range(image.shape[0]), range(image.shape[1])):
-        image[i, j] = liths_np[i, j].colors
+    if isinstance(liths, xr.Dataset):
+        image = liths.lith.colors.transpose("y", "x", "rgb").to_numpy()
+    else:
+        liths = liths.transpose("y", "x")
+        image = np.array([lith.colors for lith in liths.to_numpy().ravel()])
+        image = image.reshape(liths.shape + (3,))
 
     image = image.astype(int)
     fig, ax = plt.subplots(1, 1, figsize=(16, 16))
@@ -0,0 +1,263 @@
+"""
+Reading and writing of GeoCutout data on disk
+"""
+
+import os
+import xarray as xr
+from pathlib import Path
+from tempfile import mkstemp, mkdtemp
+from shutil import rmtree
+from dask.diagnostics import ProgressBar
+
+from .utils import Lith, LithField
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Zarr stores are written and read without consolidated metadata, which is
+# not part of the Zarr v3 format and would have to be rewritten by every
+# region written concurrently
+CONSOLIDATED = False
+
+
+def get_backend(path):
+    """Returns 'zarr' for paths ending in .zarr, o/w 'netcdf'"""
+    return "zarr" if Path(path).suffix == ".zarr" else "netcdf"
+
+
+def chunks_from_attrs(attrs):
+    """Chunking of the cutout data stored as chunksize_* attributes"""
+    chunks = {
+        k[len("chunksize_") :]: v
+        for k, v in attrs.items()
+        if k.startswith("chunksize_")
+    }
+    return chunks or None
+
+
+def zarr_storable(ds):
+    """
+    Prepares ds to be written to a Zarr store: variables are chunked
+    following the chunksize_* attributes, such that dask writes every Zarr
+    chunk in parallel, chunk encodings inherited from a previously opened
+    store are dropped, and the lithology vocabulary is stored as variable
+    length strings.
+
+    Returns:
+        (xr.Dataset, dict): dataset and encoding to pass to to_zarr
+    """
+    ds = ds.copy()
+    for var in ds.variables.values():
+        var.encoding = {
+            k: v
+            for k, v in var.encoding.items()
+            if k not in ("chunks", "preferred_chunks")
+        }
+
+    chunks = chunks_from_attrs(ds.attrs)
+    if chunks:
+        ds = ds.chunk({dim: chunks.get(dim, -1) for dim in ds.dims})
+
+    if Lith.vocabulary in ds.variables:
+        ds[Lith.vocabulary] = ds[Lith.vocabulary].compute().astype(object)
+
+    if not chunks:
+        return ds, dict()
+
+    encoding = {
+        name: {"chunks": tuple(chunks.get(dim, ds.sizes[dim]) for dim in var.dims)}
+        for name, var in ds.variables.items()
+        if var.dims and name not in ds.indexes
+    }
+    return ds, encoding
+
+
+def aligned_chunks(offset, length, size):
+    """
+    Dask chunks along a dimension of the given length that is appended at
+    offset to a stored dimension with chunks of size: the first chunk
+    fills up the last stored chunk, such that no Zarr chunk is written by
+    two dask chunks.
+    """
+    first = min(-offset % size or size, length)
+    rest = length - first
+    return (first,) + (size,) * (rest // size) + ((rest % size,) if rest % size else ())
+
+
+def open_cutout(path):
+    """
+    Lazily opens a stored cutout, chunked according to its chunksize_*
+    attributes. Lithologies stored in earlier layouts are converted to
+    the compact layout of utils.LithField.
+
+    Args:
+        path(str | path-like): NetCDF file or Zarr store
+
+    Returns:
+        xr.Dataset
+    """
+    if get_backend(path) == "zarr":
+        ds = xr.open_zarr(path, chunks=None, consolidated=CONSOLIDATED)
+    else:
+        ds = xr.open_dataset(path)
+    source = ds
+
+    chunks = chunks_from_attrs(ds.attrs)
+    if chunks:
+        ds = ds.chunk({k: v for k, v in chunks.items() if k in ds.dims})
+
+    if "major" in ds.variables:
+        lith = LithField.from_dataset(ds)
+        dims = ds[Lith.index[0]].dims
+        coords = ds[Lith.index[0]].coords
+        ds = ds.drop_vars(Lith.index + [Lith.vocabulary], errors="ignore")
+        ds = ds.assign(lith.to_dataset(dims, coords).data_vars)
+
+    # chunking drops the reference to the file, which is closed by ds.close()
+    if ds is not source:
+        ds.set_close(source.close)
+    return ds
+
+
+def write_cutout(ds, path, backend=None):
+    """
+    Writes the whole dataset to path. The data is written to a temporary
+    file or store first, which then replaces path, such that ds may lazily
+    refer to data in the existing cutout.
+
+    Args:
+        ds(xr.Dataset): dataset in saveable mode
+        path(pathlib.Path): NetCDF file or Zarr store
+        backend(str): 'netcdf' or 'zarr', defaults to get_backend(path)
+    """
+    path = Path(path)
+    directory, filename = os.path.split(str(path))
+
+    with ProgressBar():
+        if (backend or get_backend(path)) == "zarr":
+            tmp = mkdtemp(suffix=filename, dir=directory)
+            ds, encoding = zarr_storable(ds)
+            ds.to_zarr(tmp, mode="w", encoding=encoding, consolidated=CONSOLIDATED)
+        else:
+            fd, tmp = mkstemp(suffix=filename, dir=directory)
+            os.close(fd)
+            ds.to_netcdf(tmp)
+
+    ds.close()
+    if path.is_dir():
+        rmtree(path)
+    elif path.exists():
+        path.unlink()
+    os.rename(tmp, path)
+
+
+def append_variables(ds, path, append_dim=None):
+    """
+    Adds the variables of ds to the cutout stored at path, without rewriting
+    the variables already stored. Global attributes of path are updated
+    with those of ds.
+
+    With append_dim, ds instead extends the stored variables along that
+    dimension, e.g. a later time range of time-dependent features. Only
+    the new chunks are written, which is only supported for Zarr stores.
+
+    Args:
+        ds(xr.Dataset): new variables in saveable mode
+        path(pathlib.Path): existing NetCDF file or Zarr store
+        append_dim(str): dimension along which to extend stored variables
+    """
+    if get_backend(path) != "zarr":
+        if append_dim is not None:
+            raise NotImplementedError(
+                f"Appending along {append_dim} is only supported for Zarr stores"
+            )
+        logger.info(f"Appending {', '.join(map(str, ds.data_vars))} to {path}")
+        with ProgressBar():
+            ds.to_netcdf(path, mode="a")
+        return
+
+    stored = stored_variables(path)
+    if append_dim is None:
+        ds = ds.drop_vars([name for name in ds.coords if name in stored])
+        logger.info(f"Appending {', '.join(map(str, ds.data_vars))} to {path}")
+    else:
+        ds = ds.drop_vars(
+            [name for name, var in ds.variables.items() if append_dim not in var.dims]
+        )
+        logger.info(f"Extending {', '.join(map(str, ds.data_vars))} along {append_dim}")
+
+    ds, encoding = zarr_storable(ds)
+    if append_dim is not None:
+        # the stored encoding is reused for variables that are extended
+        encoding = {k: v for k, v in encoding.items() if k not in stored}
+        size = (chunks_from_attrs(ds.attrs) or dict()).get(append_dim)
+        if size:
+            with xr.open_zarr(path, consolidated=CONSOLIDATED) as stored_ds:
+                offset = stored_ds.sizes[append_dim]
+            ds = ds.chunk(
+                {append_dim: aligned_chunks(offset, ds.sizes[append_dim], size)}
+            )
+
+    with ProgressBar():
+        ds.to_zarr(
+            path,
+            mode="a",
+            append_dim=append_dim,
+            encoding=encoding,
+            consolidated=CONSOLIDATED,
+        )
+
+
+def initialize_variables(template, path):
+    """
+    Creates the variables of template in the Zarr store at path, creating
+    the store if needed, without computing or writing their data. The
+    data is filled in afterwards region by region, see write_region.
+
+    Args:
+        template(xr.Dataset): lazy dataset of the full extent of the cutout
+        path(pathlib.Path): Zarr store
+    """
+    stored = stored_variables(path)
+    template = template.drop_vars([name for name in template.coords if name in stored])
+    template, encoding = zarr_storable(template)
+    # coordinates are written right away, only data variables are deferred
+    template = template.assign_coords(
+        {name: coord.compute() for name, coord in template.coords.items()}
+    )
+
+    logger.info(f"Creating {', '.join(map(str, template.data_vars))} in {path}")
+    template.to_zarr(
+        path,
+        mode="a" if stored else "w",
+        compute=False,
+        encoding=encoding,
+        consolidated=CONSOLIDATED,
+    )
+
+
+def write_region(ds, path, region):
+    """
+    Writes ds into a region of variables created by initialize_variables.
+    Only the chunks within the region are written.
+
+    Args:
+        ds(xr.Dataset): data of the region in saveable mode
+        path(pathlib.Path): Zarr store
+        region(dict): dimension -> slice of positions
+    """
+    ds.drop_vars(list(ds.coords)).to_zarr(
+        path, region=region, consolidated=CONSOLIDATED
+    )
+
+
+def stored_variables(path):
+    """Names of the variables stored at path"""
+    if not Path(path).exists():
+        return set()
+    if get_backend(path) == "zarr":
+        with xr.open_zarr(path, consolidated=CONSOLIDATED) as ds:
+            return set(ds.variables)
+    with xr.open_dataset(path) as ds:
+        return set(ds.variables)
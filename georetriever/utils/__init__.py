@@ -1,2 +1,11 @@
 from .geo_utils import Lith
-from .data_utils import polygons_to_xarray
+from .lith_field import LithField
+
+
+def __getattr__(name):
+    # regridding pulls in shapely, pyproj and scipy.sparse, imported on first use
+    if name == "polygons_to_xarray":
+        from .data_utils import polygons_to_xarray
+
+        return polygons_to_xarray
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
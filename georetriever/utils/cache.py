@@ -0,0 +1,462 @@
+import os
+import json
+import time
+import pickle
+import hashlib
+import tempfile
+import threading
+import contextlib
+from collections import Counter
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+default_cache_dir = os.environ.get(
+    "GEORETRIEVER_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "georetriever"),
+)
+
+_file_locks = dict()
+_file_locks_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Exclusive lock on the file at path, held by one thread of one process
+    at a time. Other processes are excluded through flock where available.
+    """
+    path = os.path.abspath(path)
+    with _file_locks_lock:
+        lock = _file_locks.setdefault(path, threading.Lock())
+
+    with lock, open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class PolygonCache:
+    """
+    On-disk store of map-unit polygons returned by a remote source,
+    keyed by unit id.
+
+    Every unit is stored once together with the attribute columns
+    passed on insertion. Points can be matched against all cached units
+    through a single vectorized point-in-polygon join, which uses the
+    spatial index of the underlying GeoDataFrame.
+    Queried points for which the source returned no unit are remembered
+    as well, such that they are not requested again.
+
+    Args:
+        path(str): pickle file the cache is persisted to
+        columns(List[str]): attribute columns stored for each unit
+        crs(int): coordinate reference system of stored geometries
+    """
+
+    def __init__(self, path, columns, crs=4326):
+
+        self.path = path
+        self.columns = list(columns)
+        self.crs = crs
+
+        self.units = gpd.GeoDataFrame(
+            {col: pd.Series(dtype=object) for col in self.columns},
+            geometry=gpd.GeoSeries([], crs=crs),
+        )
+        self.units.index.name = "unit_id"
+        self.empty_points = set()
+
+        if os.path.isfile(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.units)
+
+    def __contains__(self, unit_id):
+        return unit_id in self.units.index
+
+    def load(self):
+        """Reads units and empty points from self.path"""
+        with open(self.path, "rb") as f:
+            stored = pickle.load(f)
+
+        self.units = stored["units"]
+        self.empty_points = stored["empty_points"]
+        logger.info(f"Loaded {len(self)} cached units from {self.path}")
+
+    def save(self):
+        """
+        Persists the cache to self.path, replacing the file atomically.
+        Units and empty points saved to the file by other caches since
+        it was loaded are merged in first. Merging and writing hold a lock
+        on the file, such that concurrent writers do not lose units.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+
+        with file_lock(self.path + ".lock"):
+            if os.path.isfile(self.path):
+                with open(self.path, "rb") as f:
+                    stored = pickle.load(f)
+                units = stored["units"]
+                units = units[~units.index.isin(self.units.index)]
+                if len(units):
+                    self.units = pd.concat([self.units, units]) if len(self) else units
+                self.empty_points |= stored["empty_points"]
+
+            with tempfile.NamedTemporaryFile(
+                dir=directory, suffix=".tmp", delete=False
+            ) as f:
+                pickle.dump(
+                    {"units": self.units, "empty_points": self.empty_points},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(f.name, self.path)
+
+    def add(self, unit_id, geometry, **attrs):
+        """
+        Adds a unit to the cache; units already present are left untouched
+
+        Args:
+            unit_id: identifier of the unit, e.g. the Macrostrat 'map_id'
+            geometry(shapely.geometry.Polygon): outline of the unit
+            attrs: values for self.columns
+
+        Returns:
+            bool: True if the unit was not cached before
+        """
+        if unit_id in self:
+            return False
+
+        row = gpd.GeoDataFrame(
+            {col: [attrs.get(col)] for col in self.columns},
+            geometry=[geometry],
+            index=pd.Index([unit_id], name="unit_id"),
+            crs=self.crs,
+        )
+        if len(self.units):
+            self.units = pd.concat([self.units, row])
+        else:
+            self.units = row
+        return True
+
+    def add_empty(self, lng, lat):
+        """Remembers a point for which no unit is available"""
+        self.empty_points.add(_point_key(lng, lat))
+
+    def is_empty(self, lng, lat):
+        """Returns vectorized membership of points in self.empty_points"""
+        keys = [
+            _point_key(x, y) for x, y in zip(np.atleast_1d(lng), np.atleast_1d(lat))
+        ]
+        return np.array([key in self.empty_points for key in keys], dtype=bool)
+
+    def match(self, points):
+        """
+        Spatial join of points with all cached units.
+
+        Args:
+            points(gpd.GeoSeries or gpd.GeoDataFrame): points to be matched
+
+        Returns:
+            pd.Series: for each point the id of the first cached unit
+                       covering it, NaN where none does
+        """
+        if isinstance(points, gpd.GeoSeries):
+            points = gpd.GeoDataFrame(geometry=points)
+
+        matched = pd.Series(np.nan, index=points.index, dtype=object)
+        if not len(self.units) or not len(points):
+            return matched
+
+        if points.crs is None:
+            points = points.set_crs(self.crs)
+
+        joined = gpd.sjoin(
+            points[["geometry"]],
+            self.units.reset_index()[["unit_id", "geometry"]],
+            predicate="intersects",
+            how="inner",
+        )
+        joined = joined[~joined.index.duplicated(keep="first")]
+        matched.loc[joined.index] = joined["unit_id"].values
+
+        return matched
+
+
+def _point_key(lng, lat):
+    return (round(float(lng), 6), round(float(lat), 6))
+
+
+class DownloadCache:
+    """
+    Persistent, content-addressed cache of downloaded files.
+
+    Files are stored under the hash of their normalized request. Besides
+    exact matches, a lookup returns any cached file whose request covers
+    the requested one, i.e. has the same product and grid, a superset of
+    variables and time components and an enclosing area. Such files have
+    to be subset by the caller.
+    The total size of the cache is bounded by max_size; least recently
+    used files are evicted first. Files returned by lookup or add are
+    pinned and not evicted until they are released by the caller.
+    Checksums are verified on hits of files modified since they were last
+    verified, outside of the lock of the cache, and corrupted files are
+    discarded.
+
+    Args:
+        directory(str): directory holding files and index
+        max_size(float): maximum total size of cached files in bytes
+        verify(bool): verify sha256 checksums of modified files on hits.
+                      If False only file sizes are checked
+    """
+
+    def __init__(self, directory, max_size=20e9, verify=True):
+
+        self.directory = directory
+        self.max_size = max_size
+        self.verify = verify
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._pins = Counter()
+        self._index_path = os.path.join(directory, "index.json")
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.isfile(self._index_path):
+            with open(self._index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = dict()
+
+    @property
+    def stats(self):
+        """Hit and miss counts since creation"""
+        return {"hits": self.hits, "misses": self.misses}
+
+    @property
+    def size(self):
+        """Total size of cached files in bytes"""
+        return sum(entry["size"] for entry in self.index.values())
+
+    @staticmethod
+    def normalize(product, request):
+        """
+        Normalized form of a request: lists are sorted, scalars are
+        turned into single-element lists and numbers into floats
+        """
+        normalized = {"product": product}
+        for key, value in request.items():
+            if key in ("area", "grid"):
+                normalized[key] = [float(v) for v in value]
+            elif isinstance(value, (list, tuple, set, np.ndarray)):
+                normalized[key] = sorted(str(v) for v in value)
+            else:
+                normalized[key] = [str(value)]
+        return normalized
+
+    @classmethod
+    def key(cls, product, request):
+        """Content address of a request"""
+        normalized = json.dumps(cls.normalize(product, request), sort_keys=True)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    @staticmethod
+    def covers(cached, requested):
+        """Returns if the normalized request cached covers requested"""
+        if set(cached) != set(requested):
+            return False
+
+        for key, value in requested.items():
+            if key == "area":
+                north, west, south, east = cached[key]
+                n, w, s, e = value
+                if not (north >= n and west <= w and south <= s and east >= e):
+                    return False
+            elif key in ("product", "grid", "format", "product_type"):
+                if cached[key] != value:
+                    return False
+            elif not set(value).issubset(cached[key]):
+                return False
+
+        return True
+
+    def lookup(self, product, request):
+        """
+        Returns the path of a cached file answering the request, or None.
+        The file is pinned until it is passed to release.
+
+        Returns:
+            (str, bool): path and whether it matches the request exactly,
+                         (None, False) on a miss
+        """
+        requested = self.normalize(product, request)
+        key = self.key(product, request)
+
+        with self._lock:
+            candidates = [key] if key in self.index else list()
+            candidates += [
+                k
+                for k, entry in self.index.items()
+                if k != key and self.covers(entry["request"], requested)
+            ]
+            candidates = [(k, self.index[k]) for k in candidates]
+            self._pins.update(k for k, _ in candidates)
+
+        found = None
+        try:
+            for k, entry in candidates:
+                # checksums are computed without holding the lock
+                mtime = self._verify(k, entry)
+                with self._lock:
+                    if self.index.get(k) is not entry:
+                        continue
+                    if mtime is None:
+                        self._remove(k)
+                        continue
+                    self.hits += 1
+                    entry.update(last_access=time.time(), mtime=mtime)
+                    self._write_index()
+                    found = k
+                    return self._path(k), k == key
+
+            with self._lock:
+                self.misses += 1
+            return None, False
+
+        finally:
+            with self._lock:
+                self._unpin(k for k, _ in candidates if k != found)
+
+    def add(self, product, request, download):
+        """
+        Downloads a file into the cache. The file is pinned until it is
+        passed to release.
+
+        Args:
+            product(str): product of the request
+            request(dict): request parameters
+            download(callable): called with the target path, writes the file
+
+        Returns:
+            str: path of the cached file
+        """
+        key = self.key(product, request)
+        target = self._path(key)
+
+        tmp = f"{target}.{threading.get_ident()}.part"
+        download(tmp)
+        checksum = _sha256(tmp)
+
+        with self._lock:
+            os.replace(tmp, target)
+            self.index[key] = {
+                "request": self.normalize(product, request),
+                "size": os.path.getsize(target),
+                "sha256": checksum,
+                "mtime": os.stat(target).st_mtime_ns,
+                "last_access": time.time(),
+            }
+            self._pins[key] += 1
+            self._evict()
+            self._write_index()
+
+        return target
+
+    def release(self, path):
+        """
+        Unpins a file returned by lookup or add, such that later additions
+        may evict it
+        """
+        with self._lock:
+            self._unpin([os.path.basename(path)])
+
+    def clear(self):
+        """Removes all cached files"""
+        with self._lock:
+            for key in list(self.index):
+                self._remove(key)
+            self._write_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _verify(self, key, entry):
+        """
+        Checks the size of a cached file, and its checksum if it was modified
+        since it was last verified
+
+        Returns:
+            int: modification time of the valid file, None if it is invalid
+        """
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None or stat.st_size != entry["size"]:
+            logger.warning(f"Cached file {path} is missing or truncated")
+            return None
+        if (
+            self.verify
+            and stat.st_mtime_ns != entry.get("mtime")
+            and _sha256(path) != entry["sha256"]
+        ):
+            logger.warning(f"Checksum of cached file {path} does not match")
+            return None
+        return stat.st_mtime_ns
+
+    def _unpin(self, keys):
+        for key in keys:
+            self._pins[key] -= 1
+            if self._pins[key] <= 0:
+                del self._pins[key]
+
+    def _remove(self, key):
+        self.index.pop(key, None)
+        if os.path.isfile(self._path(key)):
+            os.remove(self._path(key))
+
+    def _evict(self):
+        """
+        Removes least recently used files until the size limit is met,
+        except for pinned files
+        """
+        by_age = sorted(self.index, key=lambda k: self.index[k]["last_access"])
+        for key in by_age:
+            if self.size <= self.max_size:
+                break
+            if not self._pins[key]:
+                logger.info(f"Evicting {self._path(key)} from download cache")
+                self._remove(key)
+
+    def _write_index(self):
+        tmp = self._index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self._index_path)
+
+
+def _sha256(path, blocksize=2**20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -1,113 +1,55 @@
-import numpy as np
-import xarray as xr
-import pandas as pd
-from shapely.geometry import Polygon, MultiPolygon
-import geopandas as gpd
+import os
 
+from .regrid import Regridder
+from .cache import default_cache_dir
 
-def polygons_to_xarray(da, gdf, cols):
+weights_dir = os.path.join(default_cache_dir, "regrid")
+
+
+def polygons_to_xarray(
+    da, gdf, cols, regridder=None, cache_dir=weights_dir, projection=None
+):
     """
-    Constructs box-shape polygons around points in da (xr.DataArray).
-    Conducts spatial join, to get for each box the polygons in gdf
-    that have overlap
-    Then iterates over the boxes, to each assigning the weighted
-    average of gdf[col] with weights determined by intersection area
-    per polygon.
-    Conducts all math in the respective UTM zone, to accurately
-    respect distances.
+    Constructs box-shape polygons around points in da (xr.DataArray)
+    and assigns to each box the weighted average of gdf[col] over
+    all polygons in gdf with overlap, with weights determined by
+    intersection area per polygon.
+    The overlap weights are computed once by a utils.regrid.Regridder,
+    which can be passed again to regrid further columns of the same
+    polygons onto the same grid without recomputing intersections.
+    The weights are also stored in cache_dir, keyed by the grid and a
+    hash of the polygons, such that later calls load them from disk.
+    Least recently used weights are evicted from cache_dir once they
+    exceed utils.regrid.max_weights_size.
+    Intersection areas are computed in degrees by default. With
+    projection='utm' they are computed in the local UTM zone of each
+    cell, and with any other CRS (e.g. the equal-area 'EPSG:6933') in
+    that CRS; geometries are reprojected in bulk, zone by zone.
 
     Args:
         da(xr.DataArray): only coords will be considered
         gdf(gpd.GeoDataFrame): data with polygons in area of coords
         cols(str or List[str]): columns of gdf that will be obtained
+        regridder(Regridder): weights of a previous call with the same
+                              grid and polygons
+        cache_dir(str): directory of stored weights, None to disable
+        projection(str): None, 'utm' or a CRS understood by pyproj
 
     Returns:
-        xr.DataArray
+        xr.Dataset with dims (y, x)
     """
 
     if isinstance(cols, str):
         cols = [cols]
 
-    coords = da.coords
-
-    x_range = list(coords.values())[0].values
-    y_range = list(coords.values())[1].values
-
-    x_offset = (x_range[1] - x_range[0]) / 2
-    y_offset = (y_range[1] - y_range[0]) / 2
-
-    x, y = np.meshgrid(x_range, y_range)
-
-    x = x.flatten()
-    y = y.flatten()
-
-    lower_lefts = np.vstack([x - x_offset, y - y_offset]).T
-    lower_rights = np.vstack([x + x_offset, y - y_offset]).T
-    upper_rights = np.vstack([x + x_offset, y + y_offset]).T
-    upper_lefts = np.vstack([x - x_offset, y + y_offset]).T
-
-    boxes = [
-        Polygon([ll, lr, ur, ul])
-        for ll, lr, ur, ul in zip(lower_lefts, lower_rights, upper_rights, upper_lefts)
-    ]
-    arr_as_df = gpd.GeoDataFrame(
-        {
-            "geometry": boxes,
-            "center_x": x,
-            "center_y": y,
-        },
-        crs="EPSG:4326",
-    )
-    arr_as_df["saveindex"] = arr_as_df.index
-    arr_as_df[cols] = np.zeros((len(arr_as_df), len(cols)))
-
-    overlaps = arr_as_df.sjoin(gdf, predicate="overlaps", how="left")
-
-    def get_weighted_mean(row):
-
-        try:
-            subset = gdf.loc[overlaps.loc[row.saveindex].index_right]
-        except KeyError:
-            values = np.zeros(len(cols))
-            values[:] = np.nan
-            return values
-
-        if isinstance(subset.geometry, Polygon) or isinstance(
-            subset.geometry, MultiPolygon
-        ):
-            return subset.loc[cols].values
-
-        weights = np.array(
-            [p.intersection(row.geometry).area for _, p in subset.geometry.items()]
-        )
-        values = subset[cols].values
-
-        if weights.sum() > 0:
-            weights = weights / weights.sum()
-        return np.matmul(values.T, weights)
-
-    arr_as_df[cols] = arr_as_df.apply(
-        lambda row: pd.Series(get_weighted_mean(row), index=cols), axis=1
-    )
-
-    xr_kwargs = dict(
-        coords=[y_range, x_range],
-        dims=["y", "x"],
-    )
-
-    rev_shape = tuple(list(da.shape)[::-1])
-
-    dataset = xr.DataArray(
-        # arr_as_df[cols[0]].values.reshape(da.shape),
-        arr_as_df[cols[0]].values.reshape(rev_shape),
-        **xr_kwargs
-    ).to_dataset(name=cols[0])
-
-    for col in cols[1:]:
-        dataset[col] = xr.DataArray(
-            # arr_as_df[col].values.reshape(da.shape),
-            arr_as_df[col].values.reshape(rev_shape),
-            **xr_kwargs
+    if regridder is None:
+        polygons = gdf.geometry if gdf.crs is None else gdf.geometry.to_crs(4326)
+        regridder = Regridder(
+            da.coords["x"].values,
+            da.coords["y"].values,
+            polygons,
+            cache_dir=cache_dir,
+            projection=projection,
         )
 
-    return dataset
+    return regridder.regrid(gdf, cols)
@@ -1,14 +1,12 @@
 import numpy as np
-from itertools import product
 import re
+import sys
 import pandas as pd
 import xarray as xr
 from copy import deepcopy
 from PIL import ImageColor
-from typing import Iterable
-
-from ..geophysics.stats_utils import get_mean_variance
-
+from functools import lru_cache
+from typing import Iterable, NamedTuple, Optional, Tuple
 
 nonelist = [None for _ in range(8)]
 
@@ -17,11 +15,53 @@ def rgb2hex(r, g, b):
     return "#{:02x}{:02x}{:02x}".format(r, g, b)
 
 
+def factorize_rows(records):
+    """
+    Hash-based equivalent of np.unique(records, axis=0) for integer arrays.
+
+    Args:
+        records(np.ndarray[int]): 2D array, rows are compared
+
+    Returns:
+        inverse(np.ndarray[int]): for each row the id of its distinct row
+        first(np.ndarray[int]): for each distinct row the index of its
+                                first occurrence
+    """
+    key = np.zeros(len(records), dtype=np.int64)
+    for col in np.asarray(records).T:
+        col = col.astype(np.int64) - col.min(initial=0)
+        key, uniques = pd.factorize(key * (col.max(initial=0) + 1) + col)
+        key = key.astype(np.int64)
+
+    first = np.full(len(uniques) if len(records) else 0, -1, dtype=np.int64)
+    first[key[::-1]] = np.arange(len(key))[::-1]
+
+    return key, first
+
+
+_non_alnum = re.compile(r"[^a-zA-Z0-9 ]")
+
+
+class LithRecord(NamedTuple):
+    """
+    Immutable result of parsing one 'lith' entry of a Macrostrat response
+
+    kind is 'major' for entries tagged with major and minor lithologies,
+    'percentages' for entries giving shares, and 'others' for plain lists
+    of rocks, which only fill others.
+    """
+
+    kind: str
+    major: Optional[str]
+    minors: Tuple[str, ...]
+    others: Tuple[str, ...]
+
+
 def get_minor_major(line):
     line = line.lower()
-    major = line.split("}")[0].split("{")[-1]
+    major = sys.intern(line.split("}")[0].split("{")[-1])
     minors = line.split("minor{")[-1].replace("}", "").split(",")
-    return {"major": major, "minors": minors}
+    return {"major": major, "minors": [sys.intern(minor) for minor in minors]}
 
 
 def get_percentages(line):
@@ -29,12 +69,11 @@ def get_percentages(line):
     shares = [part.split("[")[-1] for part in liths]
     shares = ["9" in part for part in shares]
     liths = [lith.split(" [")[0] for lith in liths]
-    liths = [re.sub(r"[^a-zA-Z0-9 ]", "", lith).lower() for lith in liths]
+    liths = [_non_alnum.sub("", lith).lower() for lith in liths]
     for i, lith in enumerate(liths):
-        lith = re.sub(r"[^a-zA-Z0-9 ]", "", lith).lower()
         if lith[0] == " ":
-            lith = lith[1:]
-            liths[i] = lith
+            liths[i] = lith[1:]
+    liths = [sys.intern(lith) for lith in liths]
 
     result = dict()
     result["minors"] = [lith for i, lith in enumerate(liths) if not shares[i]]
@@ -42,6 +81,43 @@ def get_percentages(line):
     return result
 
 
+@lru_cache(maxsize=2**16)
+def parse_lith_entry(entry):
+    """
+    Parses one 'lith' entry of a Macrostrat response, see
+    Lith.interpret_macrostrat. Results are cached per raw string, such that
+    map units returned for many cells are parsed once, and rock names are
+    interned.
+
+    Args:
+        entry(str): raw 'lith' string
+
+    Returns:
+        LithRecord
+    """
+    liths = list()
+
+    entry = entry.lower()
+
+    if "sedimentary rocks" in entry:
+        liths.append("sedimentary rocks")
+        entry = entry.replace("sedimentary rocks", "")
+
+    if "major" in entry:
+        parsed = get_minor_major(entry)
+        return LithRecord("major", parsed["major"], tuple(parsed["minors"]), ())
+
+    if "%" in entry:
+        parsed = get_percentages(entry)
+        return LithRecord("percentages", parsed["major"], tuple(parsed["minors"]), ())
+
+    entry = _non_alnum.sub("", entry)
+    entry = entry.replace(" and", "")
+    liths = liths + [lith for lith in entry.split(" ") if len(lith) > 0]
+
+    return LithRecord("others", None, (), tuple(sys.intern(lith) for lith in liths))
+
+
 class Lith:
 
     index = [
@@ -54,6 +130,8 @@ class Lith:
         "others3",
         "colors",
     ]
+    n_slots = len(index) - 1
+    vocabulary = "lith_vocabulary"
 
     def __init__(self, lith=None, /, comp=None):
 
@@ -96,30 +174,14 @@ class Lith:
         best_info = None
 
         for i, entry in col.items():
-            liths = list()
-
-            minor_major = None
+            record = parse_lith_entry(entry)
 
-            entry = entry.lower()
-
-            if "sedimentary rocks" in entry:
-                liths.append("sedimentary rocks")
-                entry = entry.replace("sedimentary rocks", "")
-
-            if "major" in entry:
-                minor_major = get_minor_major(entry)
-                self.composition.update(minor_major)
-                best_info = i
-
-            elif "%" in entry:
-                minor_major = get_percentages(entry)
-                self.composition.update(minor_major)
+            if record.kind != "others":
+                self.composition.update(major=record.major, minors=list(record.minors))
                 best_info = i
 
             else:
-                entry = re.sub(r"[^a-zA-Z0-9 ]", "", entry)
-                entry = entry.replace(" and", "")
-                liths = liths + [lith for lith in entry.split(" ") if len(lith) > 0]
+                liths = list(record.others)
 
                 if isinstance(self.composition["others"], list):
                     self.composition["others"] = list(
@@ -152,16 +214,6 @@ class Lith:
         """Returns True if no information has been passed to self.composition"""
         return bool(len([val for val in self.composition.values() if val is not None]))
 
-    @property
-    def thermal_conductivity(self):
-        """Returns thermal conductivity as mean and variance"""
-        raise NotImplementedError("implement me")
-
-    @property
-    def thermal_capacity(self):
-        """Returns thermal capacity as mean and variance"""
-        raise NotImplementedError("implement me")
-
     @property
     def colors(self):
         """Returns the average of obtained colors"""
@@ -245,72 +297,122 @@ class Lith:
 
         return instance
 
+    @classmethod
+    def encode(cls, liths):
+        """
+        Encodes an array of Lith objects as integer codes into a shared
+        vocabulary of rock names.
+        Each distinct Lith object is converted once; cells holding the same
+        object share its codes.
+
+        Args:
+            liths(np.ndarray): array of Lith objects
+
+        Returns:
+            codes(np.ndarray[int16]): shape liths.shape + (7,), codes of
+                [major, minor1, minor2, minor3, others1, others2, others3],
+                -1 where no rock is given
+            colors(np.ndarray[uint8]): shape liths.shape + (3,), RGB colors
+            vocabulary(np.ndarray[str]): rock names indexed by codes
+        """
+        flat = np.asarray(liths, dtype=object).ravel()
+
+        ids = np.fromiter(map(id, flat), dtype=np.int64, count=flat.size)
+        inverse, first = factorize_rows(ids[:, None])
+
+        lists = [flat[i].tolist()[:-1] for i in first]
+        colors = np.array([flat[i].colors for i in first]).reshape(-1, 3)
+
+        vocabulary = np.array(
+            sorted({name for names in lists for name in names if name is not None}),
+            dtype=str,
+        )
+        lookup = {name: code for code, name in enumerate(vocabulary)}
+        table = np.array(
+            [[lookup.get(name, -1) for name in names] for names in lists],
+            dtype=np.int16,
+        ).reshape(-1, cls.n_slots)
+
+        shape = np.shape(liths)
+        return (
+            table[inverse].reshape(shape + (cls.n_slots,)),
+            colors.clip(0, 255).astype(np.uint8)[inverse].reshape(shape + (3,)),
+            vocabulary,
+        )
+
     @classmethod
     def to_dataset(cls, data):
         """
-        Transforms a xr.DataArray of Lith objects into a xr.Dataset with
-        str entries that are the list version of Lith objects (see the 'tolist()'
-        method)
+        Transforms a xr.DataArray of Lith objects into a xr.Dataset of
+        integer arrays (see 'LithField.to_dataset()'), in which every
+        distinct composition is stored once.
         The resulting dataset can be stored as a netcdf file
 
         Args:
             data(xr.DataArray): entries must be Lith objects
 
         Returns:
-            xr.Dataset with Lith.index as vars. Coords are copied from da
+            xr.Dataset with 'lithology' and LithField.variables as vars.
+            Coords are copied from da
 
         """
-        assert isinstance(data, xr.DataArray)
+        from .lith_field import LithField
 
-        coords = data.coords
-        shape = data.shape
-
-        da_np = data.to_numpy()
-        hold = np.zeros((8,) + data.shape).astype(str)
-
-        for i, j in product(range(shape[0]), range(shape[1])):
-            hold[:, i, j] = da_np[i, j].tolist()
+        assert isinstance(data, xr.DataArray)
 
-        return xr.Dataset(
-            data_vars={
-                var_name: (["x", "y"], hold[i]) for i, var_name in enumerate(Lith.index)
-            },
-            coords=coords,
-        )
+        field = LithField.from_liths(data.to_numpy())
+        return field.to_dataset(data.dims, data.coords)
 
     @classmethod
     def to_dataarray(cls, data):
         """
-        Takes an xr.Dataset and merges the variables Lith.index to a single
-        xr.DataArray, which is returned. Note the resulting xr.DataArray can
-        not be saved anymore
+        Takes an xr.Dataset written by 'to_dataset()' and returns its
+        lithologies as a single xr.DataArray of Lith objects. Note the
+        resulting xr.DataArray can not be saved anymore.
+        Datasets holding Lith.index as variables, as written by earlier
+        versions, are converted as well.
 
         Args:
-            data(xr.Dataset): dataset containing Lith.index as variables
+            data(xr.Dataset): dataset containing encoded lithologies
 
         Returns
             xr.DataArray:
         """
+        from .lith_field import LithField
 
         assert isinstance(data, xr.Dataset)
-        assert set(cls.index).issubset(list(data.variables))
 
-        shape = data[cls.index[0]].shape
-        coords = data[cls.index[0]].coords
+        field = LithField.from_dataset(data)
+        if "lith_codes" in data.variables:
+            coords = data["lithology"].coords
+        else:
+            coords = data[cls.index[0]].coords
 
-        data_np = np.array([data[var_name] for var_name in Lith.index])
-        result = np.zeros(shape, dtype=Lith)
+        return xr.DataArray(field.to_liths(), coords=coords)
 
-        for i, j in product(range(shape[0]), range(shape[1])):
-            result[i, j] = Lith.from_list(data_np[:, i, j])
+    @property
+    def thermal_conductivity(self):
+        """Returns thermal conductivity as mean and variance"""
+        from ..geophysics.thermal_conductivity import thermal_conductivity_database
 
-        return xr.DataArray(result, coords=coords)
+        return self.property_statistics(thermal_conductivity_database)
 
     @property
-    def thermal_conductivity(self):
-        from ..geophysics import thermal_conductivity
+    def thermal_capacity(self):
+        """Returns volumetric heat capacity as mean and variance"""
+        from ..geophysics.heat_capacity import heat_capacity_database
+
+        return self.property_statistics(heat_capacity_database)
+
+    def property_statistics(self, db):
+        """
+        Returns mean and variance of a rock property of the composition
 
-        db = thermal_conductivity.thermal_conductivity_database
+        Args:
+            db(dict): rock name -> (mean, variance), with entry 'generic'
+                      for unknown rocks
+        """
+        from ..geophysics.stats_utils import get_mean_variance
 
         # prepares arguments for stats_utils.get_mean_variance
         # see that function for justification
@@ -341,12 +443,10 @@ class Lith:
 
         assert means, f"Empty Lith: {self.composition}"
 
-        tc_mean, tc_var = get_mean_variance(
+        return get_mean_variance(
             np.array(means), np.array(vars), np.array(alphas), np.array(betas)
         )
 
-        return tc_mean, tc_var
-
 
 def get_random_lith():
     """Passes a lithography oject, randomly filled out as it
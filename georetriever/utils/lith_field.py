@@ -0,0 +1,292 @@
+import numpy as np
+import xarray as xr
+from PIL import ImageColor
+
+from .geo_utils import Lith, factorize_rows
+
+
+class LithField:
+    """
+    Array-backed field of lithologies.
+
+    Instead of one Lith object per cell, each cell holds the id of a
+    composition in an interning table, such that every distinct composition
+    is stored once. A composition consists of the vocabulary codes of
+    [major, minor1, minor2, minor3, others1, others2, others3] (-1 where no
+    rock is given) and an RGB color.
+
+    Args:
+        index(np.ndarray[int]): composition id of each cell
+        codes(np.ndarray[int16]): (n_compositions, 7) vocabulary codes
+        colors(np.ndarray[uint8]): (n_compositions, 3) RGB colors
+        vocabulary(List[str]): rock names the codes refer to
+    """
+
+    slots = Lith.index[:-1]
+    variables = ["lith_codes", "lith_colors", Lith.vocabulary]
+
+    def __init__(self, index, codes, colors, vocabulary):
+
+        self.index = np.asarray(index, dtype=np.int32)
+        self.vocabulary = [str(name) for name in vocabulary]
+        self._codes = {name: code for code, name in enumerate(self.vocabulary)}
+
+        records = np.hstack(
+            [
+                np.asarray(codes, dtype=np.int16).reshape(-1, len(self.slots)),
+                np.asarray(colors, dtype=np.uint8).reshape(-1, 3),
+            ]
+        )
+        self._compositions = {
+            tuple(record): i for i, record in enumerate(records.tolist())
+        }
+
+    def __len__(self):
+        """Number of distinct compositions"""
+        return len(self._compositions)
+
+    @property
+    def shape(self):
+        return self.index.shape
+
+    @property
+    def table(self):
+        """(n_compositions, 10) array of codes followed by colors"""
+        return np.array(list(self._compositions), dtype=np.int16).reshape(
+            -1, len(self.slots) + 3
+        )
+
+    @property
+    def codes(self):
+        """Vocabulary codes of each composition"""
+        return self.table[:, : len(self.slots)]
+
+    @property
+    def colors(self):
+        """RGB colors of each composition"""
+        return self.table[:, len(self.slots) :].astype(np.uint8)
+
+    @classmethod
+    def empty(cls, shape):
+        """Field of the given shape, holding the empty composition everywhere"""
+        return cls.from_liths(np.full(shape, Lith(), dtype=object))
+
+    @classmethod
+    def from_codes(cls, codes, colors, vocabulary):
+        """
+        Interns per-cell codes and colors
+
+        Args:
+            codes(np.ndarray[int]): shape grid.shape + (7,)
+            colors(np.ndarray[int]): shape grid.shape + (3,)
+            vocabulary(List[str]): rock names the codes refer to
+        """
+        shape = codes.shape[:-1]
+        records = np.hstack(
+            [
+                codes.reshape(-1, len(cls.slots)).astype(np.int16),
+                colors.reshape(-1, 3).astype(np.int16),
+            ]
+        )
+        inverse, first = factorize_rows(records)
+
+        return cls(
+            inverse.reshape(shape),
+            records[first, : len(cls.slots)],
+            records[first, len(cls.slots) :],
+            vocabulary,
+        )
+
+    @classmethod
+    def from_liths(cls, liths):
+        """Creates a LithField from an array of Lith objects"""
+        return cls.from_codes(*Lith.encode(liths))
+
+    @classmethod
+    def from_dataset(cls, ds):
+        """
+        Reads a LithField from a dataset written by LithField.to_dataset.
+        Datasets holding per-cell variables Lith.index, as either integer
+        codes or strings, are converted as well.
+        """
+        if "lith_codes" in ds.variables:
+            return cls(
+                ds["lithology"].to_numpy(),
+                ds["lith_codes"].to_numpy(),
+                ds["lith_colors"].to_numpy(),
+                ds[Lith.vocabulary].to_numpy(),
+            )
+
+        dims = ds[cls.slots[0]].dims
+
+        if Lith.vocabulary in ds.variables:
+            codes = np.stack([ds[slot].to_numpy() for slot in cls.slots], axis=-1)
+            colors = ds["colors"].transpose(*dims, "rgb").to_numpy()
+            return cls.from_codes(codes, colors, ds[Lith.vocabulary].to_numpy())
+
+        names = np.stack([ds[slot].to_numpy().astype(str) for slot in cls.slots])
+        vocabulary = np.unique(names[names != "None"])
+        codes = np.searchsorted(vocabulary, names).astype(np.int16)
+        codes[names == "None"] = -1
+
+        hexcolors, inverse = np.unique(
+            ds["colors"].to_numpy().astype(str), return_inverse=True
+        )
+        rgb = np.array(
+            [ImageColor.getcolor(color, "RGB") for color in hexcolors], dtype=np.uint8
+        ).reshape(-1, 3)
+
+        return cls.from_codes(
+            np.moveaxis(codes, 0, -1),
+            rgb[inverse.reshape(ds[cls.slots[0]].shape)],
+            vocabulary,
+        )
+
+    def code(self, name):
+        """Vocabulary code of a rock name, extending the vocabulary if needed"""
+        if name is None:
+            return -1
+        name = str(name)
+        if name not in self._codes:
+            self._codes[name] = len(self.vocabulary)
+            self.vocabulary.append(name)
+        return self._codes[name]
+
+    def intern(self, lith):
+        """
+        Returns the composition id of a Lith object, adding its composition
+        to the table if it is not yet present
+        """
+        record = tuple(self.code(name) for name in lith.tolist()[:-1])
+        record = record + tuple(int(c) for c in np.clip(lith.colors, 0, 255))
+
+        return self._compositions.setdefault(record, len(self._compositions))
+
+    def merge(self, other):
+        """
+        Adds the compositions of another LithField to the table, translating
+        its vocabulary codes into codes of self
+
+        Returns:
+            np.ndarray[int32]: composition id in self of each composition of
+                               other, such that merge(other)[other.index]
+                               is the index of other in terms of self
+        """
+        codes = np.array([self.code(name) for name in other.vocabulary] + [-1])
+        records = np.hstack([codes[other.codes], other.colors]).tolist()
+
+        return np.array(
+            [
+                self._compositions.setdefault(tuple(record), len(self._compositions))
+                for record in records
+            ],
+            dtype=np.int32,
+        ).reshape(-1)
+
+    def to_liths(self):
+        """Array of Lith objects, one object per distinct composition"""
+        names = np.array(self.vocabulary + [None], dtype=object)
+
+        liths = np.empty(len(self), dtype=object)
+        for i, record in enumerate(self.table):
+            lith = Lith()
+            lith.major = names[record[0]]
+            lith.minors = names[record[1:4]].tolist()
+            lith.others = names[record[4 : len(self.slots)]].tolist()
+            lith.colors = record[len(self.slots) :]
+            liths[i] = lith
+
+        return liths[self.index]
+
+    def to_dataset(self, dims=("x", "y"), coords=None):
+        """
+        Returns the field as xr.Dataset that can be stored as netcdf:
+            lithology(dims): composition id of each cell
+            lith_codes(composition, lith_slot): vocabulary codes
+            lith_colors(composition, rgb): colors
+            lith_vocabulary(rock): rock names
+        """
+        return xr.Dataset(
+            data_vars={
+                "lithology": (dims, self.index),
+                "lith_codes": (("composition", "lith_slot"), self.codes),
+                "lith_colors": (("composition", "rgb"), self.colors),
+                Lith.vocabulary: (("rock",), np.array(self.vocabulary, dtype=str)),
+            },
+            coords=coords,
+        )
+
+
+@xr.register_dataset_accessor("lith")
+class LithAccessor:
+    """
+    Per-cell access to lithologies stored by LithField.to_dataset,
+    e.g. ds.lith.major. Works lazily on dask-backed datasets.
+    """
+
+    def __init__(self, ds):
+        self._ds = ds
+
+    def gather(self, table, dim=None):
+        """
+        Per-cell values of a per-composition table, e.g. a property
+        computed once for each composition
+
+        Args:
+            table(np.ndarray): values indexed by composition id, optionally
+                               with a second axis that becomes dim
+            dim(str): name of the dimension of the second axis
+        """
+        table = np.asarray(table)
+        core_dims = [[dim]] if dim else [[]]
+
+        return xr.apply_ufunc(
+            lambda index: table[index],
+            self._ds["lithology"],
+            output_core_dims=core_dims,
+            dask="parallelized",
+            output_dtypes=[table.dtype],
+            dask_gufunc_kwargs={"output_sizes": {dim: table.shape[1]}} if dim else {},
+        )
+
+    @property
+    def field(self):
+        """LithField of the dataset"""
+        return LithField.from_dataset(self._ds)
+
+    @property
+    def vocabulary(self):
+        """Rock names the codes refer to"""
+        return self._ds[Lith.vocabulary].to_numpy().tolist()
+
+    @property
+    def major(self):
+        """Vocabulary code of the major lithology, -1 where unknown"""
+        return self.gather(self._ds["lith_codes"][:, 0])
+
+    @property
+    def minors(self):
+        """Vocabulary codes of up to 3 minor lithologies along 'minor'"""
+        codes = self._ds["lith_codes"][:, 1:4].to_numpy()
+        return self.gather(codes, "minor")
+
+    @property
+    def others(self):
+        """Vocabulary codes of up to 3 unordered lithologies along 'other'"""
+        codes = self._ds["lith_codes"][:, 4 : len(LithField.slots)].to_numpy()
+        return self.gather(codes, "other")
+
+    @property
+    def colors(self):
+        """uint8 RGB colors along 'rgb'"""
+        return self.gather(self._ds["lith_colors"].to_numpy(), "rgb")
+
+    def names(self, codes):
+        """Translates an array of vocabulary codes into rock names, NaN for -1"""
+        names = np.array(self.vocabulary + [np.nan], dtype=object)
+        return xr.apply_ufunc(
+            lambda c: names[c],
+            codes,
+            dask="parallelized",
+            output_dtypes=[object],
+        )
@@ -0,0 +1,270 @@
+import os
+import hashlib
+import numpy as np
+from functools import lru_cache
+import xarray as xr
+import shapely
+import pyproj
+from scipy import sparse
+
+from ..gis import grid_blocks
+from .cache import DownloadCache
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# maximum total size in bytes of the weights stored in a cache directory
+max_weights_size = 2e9
+
+
+def grid_cells(x, y, blocksize=1_000_000):
+    """
+    Box-shaped cells around the points of a regular grid, built block by
+    block from gis.grid_blocks
+
+    Args:
+        x(np.ndarray): cell centers along x
+        y(np.ndarray): cell centers along y
+        blocksize(int): number of cells built at once
+
+    Returns:
+        np.ndarray[shapely.Polygon]: cells in row-major (y, x) order
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+
+    dx = abs(x[1] - x[0]) / 2 if len(x) > 1 else 0.5
+    dy = abs(y[1] - y[0]) / 2 if len(y) > 1 else 0.5
+
+    cells = np.empty(len(x) * len(y), dtype=object)
+    for block, xx, yy in grid_blocks(x, y, indexing="xy", blocksize=blocksize):
+        cells[block] = shapely.box(xx - dx, yy - dy, xx + dx, yy + dy)
+
+    return cells
+
+
+def utm_zones(lon, lat):
+    """EPSG codes of the UTM zones of points"""
+    zone = np.clip(np.floor((np.asarray(lon) + 180) / 6).astype(int), 0, 59) + 1
+    return np.where(np.asarray(lat) >= 0, 32600, 32700) + zone
+
+
+def project(geometries, crs, from_crs=4326):
+    """Transforms geometries to crs with a single vectorized pyproj call"""
+    transformer = pyproj.Transformer.from_crs(from_crs, crs, always_xy=True)
+    return shapely.transform(
+        geometries, lambda c: np.column_stack(transformer.transform(c[:, 0], c[:, 1]))
+    )
+
+
+def projected_areas(cells, polygons, cell_idx, polygon_idx, projection, chunksize):
+    """
+    Intersection areas of cell/polygon pairs computed after reprojection
+    of both geometries, either to a single CRS or, for projection 'utm',
+    to the UTM zone of each cell. Pairs are processed in chunks of at most
+    chunksize pairs per zone, and each geometry of a chunk is transformed
+    once.
+    """
+    areas = np.zeros(len(cell_idx))
+
+    if projection == "utm":
+        centers = shapely.centroid(cells)
+        zones = utm_zones(shapely.get_x(centers), shapely.get_y(centers))[cell_idx]
+    else:
+        zones = np.zeros(len(cell_idx), dtype=int)
+
+    for zone in np.unique(zones):
+        crs = f"EPSG:{zone}" if projection == "utm" else projection
+        in_zone = np.flatnonzero(zones == zone)
+
+        for start in range(0, len(in_zone), chunksize):
+            pairs = in_zone[start : start + chunksize]
+
+            cells_used, cell_pos = np.unique(cell_idx[pairs], return_inverse=True)
+            polys_used, poly_pos = np.unique(polygon_idx[pairs], return_inverse=True)
+
+            projected_cells = project(cells[cells_used], crs)
+            projected_polys = project(polygons[polys_used], crs)
+
+            areas[pairs] = shapely.area(
+                shapely.intersection(
+                    projected_cells[cell_pos], projected_polys[poly_pos]
+                )
+            )
+
+    return areas
+
+
+def overlap_weights(cells, polygons, projection=None, chunksize=500_000):
+    """
+    Sparse matrix of intersection areas between cells and polygons
+
+    All intersecting pairs are found in a single STRtree query, and their
+    intersection areas are computed in one vectorized call. By default,
+    areas are computed in the geographic coordinates of the geometries.
+    With a projection, they are computed in projected coordinates (m²).
+
+    Args:
+        cells(np.ndarray[shapely.Geometry]): cell geometries in EPSG:4326
+        polygons(np.ndarray[shapely.Geometry]): polygon geometries in EPSG:4326
+        projection(str): None, 'utm' for the UTM zone of each cell, or any
+                         CRS understood by pyproj, e.g. the equal-area
+                         'EPSG:6933'
+        chunksize(int): maximum number of pairs reprojected at once
+
+    Returns:
+        scipy.sparse.csr_matrix: (n_cells, n_polygons) intersection areas
+    """
+    cells, polygons = np.asarray(cells), np.asarray(polygons)
+
+    tree = shapely.STRtree(polygons)
+    cell_idx, polygon_idx = tree.query(cells, predicate="intersects")
+
+    if projection is None:
+        areas = shapely.area(
+            shapely.intersection(cells[cell_idx], polygons[polygon_idx])
+        )
+    else:
+        areas = projected_areas(
+            cells, polygons, cell_idx, polygon_idx, projection, chunksize
+        )
+    overlap = areas > 0
+
+    return sparse.csr_matrix(
+        (areas[overlap], (cell_idx[overlap], polygon_idx[overlap])),
+        shape=(len(cells), len(polygons)),
+    )
+
+
+def weights_key(x, y, polygons, projection=None):
+    """
+    Hash identifying the weights of a grid and a set of polygons,
+    computed from the cell centers, the projection and the WKB of all
+    polygons
+    """
+    digest = hashlib.sha256(str(projection).encode())
+    for coord in (x, y):
+        digest.update(np.round(np.asarray(coord, dtype=float), 9).tobytes())
+    for wkb in shapely.to_wkb(polygons):
+        digest.update(wkb)
+    return digest.hexdigest()
+
+
+def weights_cache(directory):
+    """
+    Cache of regridding weights in directory, shared by all Regridders
+    using it. Least recently used weights are evicted once their total
+    size exceeds max_weights_size, see utils.cache.DownloadCache
+    """
+    return _weights_cache(os.path.abspath(directory))
+
+
+@lru_cache(maxsize=None)
+def _weights_cache(directory):
+    return DownloadCache(directory, max_size=max_weights_size)
+
+
+class Regridder:
+    """
+    Area-weighted regridding of polygon attributes onto a regular grid.
+
+    The cell-by-polygon overlap weights are computed once on creation,
+    normalized per cell, and then reused for any attribute of the
+    polygons. Regridding a column is a single sparse matrix product.
+    If cache_dir is given, the weights are stored there as .npz file
+    keyed by weights_key, and loaded instead of recomputed whenever the
+    same polygons are regridded onto the same grid again. The size of
+    the stored weights is bounded, see weights_cache.
+
+    Args:
+        x(np.ndarray): cell centers along x
+        y(np.ndarray): cell centers along y
+        polygons(gpd.GeoSeries or array of shapely geometries): polygons in
+                 the coordinate reference system of x and y
+        cache_dir(str): directory of stored weights, None to disable
+        projection(str): CRS in which intersection areas are computed, see
+                         overlap_weights. Defaults to geographic coordinates
+    """
+
+    def __init__(self, x, y, polygons, cache_dir=None, projection=None):
+
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+
+        polygons = np.asarray(getattr(polygons, "values", polygons))
+
+        path, cache = None, None
+        if cache_dir is not None:
+            cache = weights_cache(cache_dir)
+            request = {"key": weights_key(self.x, self.y, polygons, projection)}
+            path, _ = cache.lookup("regrid", request)
+
+        if path is not None:
+            logger.debug(f"Loading regridding weights from {path}")
+            self.weights = sparse.load_npz(path).tocsr()
+        else:
+            self.weights = self.compute_weights(self.x, self.y, polygons, projection)
+            if cache is not None:
+                path = cache.add("regrid", request, self.save)
+
+        if path is not None:
+            cache.release(path)
+
+        # cells without any overlap obtain NaN
+        self.covered = np.asarray(self.weights.sum(axis=1)).flatten() > 0
+
+    @staticmethod
+    def compute_weights(x, y, polygons, projection=None):
+        """Overlap weights of the grid cells, normalized to sum to 1 per cell"""
+        weights = overlap_weights(grid_cells(x, y), polygons, projection)
+
+        totals = np.asarray(weights.sum(axis=1)).flatten()
+        with np.errstate(divide="ignore"):
+            scale = np.where(totals > 0, 1 / totals, 0)
+
+        return sparse.csr_matrix(sparse.diags(scale) @ weights)
+
+    def save(self, path):
+        """Writes the weights to path (.npz)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp = path + ".tmp.npz"
+        sparse.save_npz(tmp, self.weights)
+        os.replace(tmp, path)
+
+    @property
+    def shape(self):
+        return len(self.y), len(self.x)
+
+    def __call__(self, values):
+        """
+        Area-weighted mean of values over the polygons overlapping each cell
+
+        Args:
+            values(np.ndarray): one value per polygon
+
+        Returns:
+            np.ndarray: shape (len(y), len(x)), NaN for cells without overlap
+        """
+        result = self.weights @ np.asarray(values, dtype=float)
+        result[~self.covered] = np.nan
+        return result.reshape(self.shape)
+
+    def regrid(self, gdf, cols):
+        """
+        Regrids columns of a GeoDataFrame whose geometries are the polygons
+        passed on creation
+
+        Args:
+            gdf(gpd.GeoDataFrame): polygon data
+            cols(List[str]): columns to regrid
+
+        Returns:
+            xr.Dataset with one variable per column and dims (y, x)
+        """
+        return xr.Dataset(
+            {col: (("y", "x"), self(gdf[col].to_numpy())) for col in cols},
+            coords={"y": self.y, "x": self.x},
+        )
@@ -31,12 +31,13 @@ setup(
         "numexpr",
         "xarray>=0.20",
         "netcdf4",
+        "zarr",
         "dask>=2021.10.0",
         "toolz",
         "requests",
         "pyyaml",
         "rasterio>1.2.10",
-        "shapely",
+        "shapely>=2",
         "progressbar2",
         "tqdm",
         "pyproj>=2",
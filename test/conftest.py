@@ -0,0 +1,69 @@
+"""
+Helpers shared by the tests of the dataset modules
+"""
+
+import xarray as xr
+
+from georetriever import GeoCutout
+from georetriever.gis import get_coords
+from georetriever.utils import LithField
+
+
+class DummyCutout:
+    """Stand-in for a GeoCutout, providing the coordinates of the given bounds"""
+
+    def __init__(self, **kwargs):
+        self.coords = get_coords(**kwargs).coords
+        self.chunks = None
+        self.dx, self.dy = kwargs.get("dx", 0.25), kwargs.get("dy", 0.25)
+
+
+def assert_tiled_matches_whole(
+    tmp_path, params, features, tilesizes, before_prepare=None, **prepare_kwargs
+):
+    """
+    Prepares features for the whole cutout 'whole.nc' at once and for each
+    (name, tilesize) in tilesizes tile by tile, in cutouts with chunks of 2
+    cells, and asserts that all prepared variables agree. Lithologies are
+    compared by composition, as composition ids depend on the tiling.
+
+    Args:
+        tmp_path(pathlib.Path): directory of the cutouts
+        params(dict): parameters of the cutouts
+        features(List[str]): features to prepare
+        tilesizes(List[(str, int or dict)]): file names and tile sizes
+        before_prepare(callable): called before each preparation, e.g. to
+                                  reset caches
+        **prepare_kwargs: passed to GeoCutout.prepare
+
+    Returns:
+        (GeoCutout, List[GeoCutout]): the whole and the tiled cutouts
+    """
+    whole = GeoCutout(tmp_path / "whole.nc", **params)
+    if before_prepare:
+        before_prepare()
+    whole.prepare(features=features, **prepare_kwargs)
+
+    tiled = list()
+    for name, tilesize in tilesizes:
+        gc = GeoCutout(tmp_path / name, chunksize_x=2, chunksize_y=2, **params)
+        if before_prepare:
+            before_prepare()
+        gc.prepare(features=features, tilesize=tilesize, **prepare_kwargs)
+
+        assert set(gc.data.attrs["prepared_features"]) == set(
+            whole.data.attrs["prepared_features"]
+        )
+        for var in whole.data.data_vars:
+            if var in LithField.variables or var == "lithology":
+                continue
+            xr.testing.assert_allclose(
+                gc.data[var].transpose(*whole.data[var].dims), whole.data[var]
+            )
+        if "lithology" in whole.data:
+            assert [
+                lith.tolist() for lith in gc.data.lith.field.to_liths().ravel()
+            ] == [lith.tolist() for lith in whole.data.lith.field.to_liths().ravel()]
+        tiled.append(gc)
+
+    return whole, tiled
@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import xarray as xr
+from scipy.interpolate import RegularGridInterpolator
+
+from georetriever.datasets import aquifer_depth
+
+from .conftest import DummyCutout, assert_tiled_matches_whole
+
+
+def test_interpolation(tmp_path, monkeypatch):
+    monkeypatch.setattr(aquifer_depth, "cache_dir", str(tmp_path / "cache"))
+    x, y = np.meshgrid(np.arange(-5, 5, 0.25), np.arange(40, 50, 0.25))
+    table = np.column_stack(
+        [x.flatten(), y.flatten()]
+        + [np.sin(k * x.flatten()) + np.cos(y.flatten()) for k in range(1, 8)]
+    )
+    path = tmp_path / "tesauro.txt"
+    np.savetxt(path, table, delimiter="\t", header="\t".join(aquifer_depth.columns))
+
+    cutout = DummyCutout(
+        x=slice(-1, 1.5), y=slice(44, 45), time="2019-01-01", dx=0.1, dy=0.1
+    )
+    values = aquifer_depth.interpolate(cutout.coords, ["Basement", "Moho"], str(path))
+
+    assert os.path.isfile(aquifer_depth.converted_path(path))
+    assert values.shape == (26, 11, 2)
+
+    x_mesh, y_mesh = np.meshgrid(
+        cutout.coords["x"].values, cutout.coords["y"].values, indexing="ij"
+    )
+    for i, column in enumerate(["Basement", "Moho"]):
+        grid = table[:, aquifer_depth.columns.index(column)].reshape(y.shape)
+        expected = RegularGridInterpolator((x[0], y[:, 0]), grid.T)
+        np.testing.assert_allclose(values[..., i], expected((x_mesh, y_mesh)))
+
+    outside = DummyCutout(
+        x=slice(20, 21), y=slice(0, 1), time="2019-01-01", dx=0.5, dy=0.5
+    )
+    assert np.isnan(aquifer_depth.interpolate(outside.coords, ["UC"], str(path))).all()
+
+    monkeypatch.setattr(aquifer_depth, "file_path", str(path))
+    ds = aquifer_depth.get_data(cutout, "crustal_structure")
+    basement = aquifer_depth.get_data(cutout, "aquifer_depth")["aquifer_depth"]
+
+    assert set(ds.data_vars) == set(aquifer_depth.features["crustal_structure"])
+    np.testing.assert_array_equal(ds["crust_basement"], basement)
+    np.testing.assert_array_equal(ds["crust_moho"], values[..., 1])
+
+
+def test_interpolation_independent_of_bounds(tmp_path, monkeypatch):
+    # cache_dir cannot be created, the table is kept in memory instead
+    (tmp_path / "file").touch()
+    monkeypatch.setattr(aquifer_depth, "cache_dir", str(tmp_path / "file" / "cache"))
+
+    # regular 0.25 degree grid like the Tesauro et al. table, with an
+    # irregular outline and values without spatial structure
+    rng = np.random.default_rng(0)
+    x, y = np.meshgrid(np.arange(-10, 30, 0.25), np.arange(36, 70, 0.25))
+    inside = (x / 20) ** 2 + ((y - 53) / 17) ** 2 < 1
+    table = np.column_stack(
+        [x[inside], y[inside]] + [rng.uniform(0, 40, inside.sum()) for _ in range(7)]
+    )
+    path = tmp_path / "tesauro.txt"
+    np.savetxt(path, table, delimiter="\t", header="\t".join(aquifer_depth.columns))
+
+    small = DummyCutout(x=slice(0, 3), y=slice(45, 47), time="2019", dx=0.1, dy=0.1)
+    large = DummyCutout(x=slice(2, 8), y=slice(46, 52), time="2019", dx=0.1, dy=0.1)
+
+    values = [
+        xr.DataArray(
+            aquifer_depth.interpolate(cutout.coords, ["Basement"], str(path))[..., 0],
+            coords={"x": cutout.coords["x"], "y": cutout.coords["y"]},
+            dims=["x", "y"],
+        )
+        for cutout in [small, large]
+    ]
+    shared = dict(x=slice(2, 3), y=slice(46, 47))
+    small, large = (v.sel(**shared) for v in values)
+
+    assert small.size == 11 * 11 and np.isfinite(small).all()
+    np.testing.assert_allclose(small.values, large.values, rtol=1e-12)
+    assert not os.path.exists(aquifer_depth.converted_path(path))
+
+
+def test_tiled_prepare(tmp_path, monkeypatch):
+    rng = np.random.default_rng(1)
+    x, y = np.meshgrid(np.arange(-5, 5, 0.25), np.arange(40, 50, 0.25))
+    table = np.column_stack(
+        [x.flatten(), y.flatten()] + [rng.uniform(0, 40, x.size) for _ in range(7)]
+    )
+    path = tmp_path / "tesauro.txt"
+    np.savetxt(path, table, delimiter="\t", header="\t".join(aquifer_depth.columns))
+    monkeypatch.setattr(aquifer_depth, "file_path", str(path))
+    monkeypatch.setattr(aquifer_depth, "cache_dir", str(tmp_path / "cache"))
+
+    params = dict(x=slice(-1, 1.5), y=slice(44, 46), time="2019", dx=0.1, dy=0.1)
+    features = ["aquifer_depth", "crustal_structure"]
+
+    tilesizes = [("tiled.zarr", 6), ("tiled.nc", {"x": 8, "y": 4})]
+    whole, _ = assert_tiled_matches_whole(tmp_path, params, features, tilesizes)
+
+    for var in ["aquifer_depth"] + aquifer_depth.features["crustal_structure"]:
+        assert var in whole.data
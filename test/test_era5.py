@@ -0,0 +1,248 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import xarray as xr
+import pytest
+
+from georetriever import GeoCutout
+from georetriever.manifest import Manifest
+from georetriever.datasets import era5
+from georetriever.utils import cache as cache_module
+from georetriever.utils.cache import DownloadCache
+
+from .conftest import DummyCutout, assert_tiled_matches_whole
+
+
+class MockResult:
+    def __init__(self, request):
+        self.request = request
+
+    def download(self, target):
+        """
+        Writes the requested variables on the requested grid to target.
+        Unlike a real download this uses HDF5, so it takes era5.netcdf_lock.
+        """
+        north, west, south, east = self.request["area"]
+        dx, dy = self.request["grid"]
+
+        days = pd.date_range(
+            f"{self.request['year']}-{min(self.request['month'])}-01",
+            periods=366,
+            freq="D",
+        )
+        days = days[
+            days.month.isin(self.request["month"])
+            & days.day.isin(self.request["day"])
+            & (days.year == int(self.request["year"]))
+        ]
+        hours = [pd.Timedelta(hours=int(t[:2])) for t in self.request["time"]]
+        time = pd.DatetimeIndex([day + hour for day in days for hour in hours])
+
+        coords = {
+            "time": time,
+            "latitude": np.arange(north, south - dy / 2, -dy),
+            "longitude": np.arange(west, east + dx / 2, dx),
+        }
+        names = {"2m_temperature": "t2m", "soil_temperature_level_4": "stl4"}
+
+        ds = xr.Dataset(
+            {
+                names[v]: (
+                    list(coords),
+                    time.month.values[:, None, None]
+                    + 100 * (coords["latitude"][:, None] - 50)
+                    + coords["longitude"],
+                )
+                for v in self.request["variable"]
+            },
+            coords=coords,
+        )
+        with era5.netcdf_lock:
+            ds.to_netcdf(target)
+
+
+class MockClient:
+    """Stand-in for cdsapi.Client recording concurrent requests"""
+
+    requests = list()
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def retrieve(self, product, request):
+        cls = MockClient
+        with cls.lock:
+            cls.requests.append(request)
+            cls.running += 1
+            cls.max_running = max(cls.max_running, cls.running)
+        threading.Event().wait(0.1)
+        with cls.lock:
+            cls.running -= 1
+        return MockResult(request)
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    MockClient.requests = list()
+    MockClient.max_running = 0
+    monkeypatch.setattr(era5.cdsapi, "Client", MockClient)
+    monkeypatch.setattr(era5, "_download_cache", DownloadCache(tmp_path / "cache"))
+    return MockClient
+
+
+def test_concurrent_retrieval(tmp_path, client):
+    cutout = DummyCutout(
+        x=slice(0, 1),
+        y=slice(50, 51),
+        time=slice("2018-11-30", "2019-02-01"),
+        dx=0.25,
+        dy=0.25,
+        dt="D",
+    )
+
+    ds = era5.get_data(
+        cutout,
+        "temperature",
+        tmpdir=str(tmp_path),
+        monthly=True,
+        split_variables=True,
+    )
+
+    assert len(client.requests) == 4 * 2
+    assert client.max_running > 1
+    assert ds["time"].to_index().equals(cutout.coords["time"].to_index())
+    np.testing.assert_array_equal(
+        ds["temperature"].isel(x=0, y=0).values, ds.time.dt.month.values
+    )
+    assert set(ds.data_vars) == {"temperature", "soil temperature"}
+
+
+def test_download_cache(tmp_path, client):
+    cache = era5.download_cache()
+    year = DummyCutout(
+        x=slice(0, 1), y=slice(50, 51), time="2019", dx=0.25, dy=0.25, dt="D"
+    )
+    era5.get_data(year, "temperature")
+
+    assert len(client.requests) == 1
+    assert cache.stats == {"hits": 0, "misses": 1}
+
+    # a smaller area and time span is served from the cached yearly file
+    month = DummyCutout(
+        x=slice(0.25, 0.75), y=slice(50, 50.5), time="2019-03", dx=0.25, dy=0.25, dt="D"
+    )
+    ds = era5.get_data(month, "temperature")
+
+    assert len(client.requests) == 1
+    assert cache.stats == {"hits": 1, "misses": 1}
+    assert ds["time"].to_index().equals(month.coords["time"].to_index())
+    assert ds.sizes["x"] == 3 and ds.sizes["y"] == 3
+    xr.testing.assert_allclose(
+        ds["temperature"], (3 + 100 * (ds["y"] - 50) + ds["x"]).broadcast_like(ds)
+    )
+
+    # corrupted files are discarded and downloaded again
+    (path,) = [tmp_path / "cache" / key for key in cache.index]
+    path.write_bytes(b"corrupted")
+    era5.get_data(month, "temperature")
+
+    assert len(client.requests) == 2
+    assert len(cache.index) == 1
+
+    cache.max_size = 0
+    era5.get_data(year, "temperature")
+    assert len(cache.index) == 1
+
+
+def test_streamed_prepare(tmp_path, client):
+    params = dict(
+        x=slice(0, 1),
+        y=slice(50, 51),
+        time=slice("2019-01-30", "2019-03-02"),
+        dx=0.25,
+        dy=0.25,
+        dt="D",
+    )
+    module_params = {"era5": {"monthly": True, "cache": False}}
+
+    whole = GeoCutout(tmp_path / "whole.nc", **params)
+    whole.prepare(features=["temperature"], module_params=module_params)
+
+    # each month is written to the store as it is downloaded
+    streamed = GeoCutout(tmp_path / "streamed.zarr", chunksize_time=10, **params)
+    streamed.prepare(features=["temperature"], module_params=module_params)
+
+    assert len(client.requests) == 2 * 3
+    assert len(era5.download_cache().index) == 0
+    assert Manifest(streamed.path).features["temperature"]["status"] == "done"
+    assert "temperature" in streamed.data.attrs["prepared_features"]
+    for name in ["temperature", "soil temperature"]:
+        xr.testing.assert_allclose(
+            streamed.data[name].transpose(*whole.data[name].dims),
+            whole.data[name],
+        )
+
+
+def test_tiled_prepare(tmp_path, client):
+    params = dict(
+        x=slice(0, 1.5),
+        y=slice(50, 51),
+        time=slice("2019-01-30", "2019-02-02"),
+        dx=0.25,
+        dy=0.25,
+        dt="D",
+    )
+    _, (tiled, streamed) = assert_tiled_matches_whole(
+        tmp_path,
+        params,
+        ["temperature"],
+        [("tiled.nc", 2), ("tiled.zarr", 3)],
+        module_params={"era5": {"monthly": True}},
+    )
+    assert {"temperature", "soil temperature"} <= set(tiled.data.data_vars)
+
+    # one request per month, served from the cache to each tile of NetCDF
+    # files and to each period of Zarr stores
+    cache = era5.download_cache()
+    assert len(client.requests) == 2
+    assert len(list(tiled.tiles(2))) == 6
+    assert cache.stats["hits"] == 6 * 2 + 2
+
+
+def test_download_cache_pins(tmp_path, monkeypatch):
+    hashed = list()
+    sha256 = cache_module._sha256
+    monkeypatch.setattr(
+        cache_module, "_sha256", lambda path: hashed.append(path) or sha256(path)
+    )
+    cache = DownloadCache(tmp_path / "cache", max_size=0)
+    request = {"year": "2019", "month": ["1"], "variable": ["2m_temperature"]}
+
+    def write(content):
+        return lambda target: open(target, "wb").write(content)
+
+    first = cache.add("product", request, write(b"first"))
+    second = cache.add("product", {**request, "year": "2020"}, write(b"second"))
+
+    # pinned files are not evicted
+    assert os.path.isfile(first) and os.path.isfile(second)
+    cache.release(first)
+    cache.release(second)
+    cache.add("product", {**request, "year": "2021"}, write(b"third"))
+    assert not os.path.isfile(first) and not os.path.isfile(second)
+
+    # files are only hashed again if they were modified
+    hashed.clear()
+    path, exact = cache.lookup("product", {**request, "year": "2021"})
+    assert exact and not hashed
+    cache.release(path)
+
+    with open(path, "wb") as f:
+        f.write(b"THIRD")
+    os.utime(path, ns=(0, 0))
+    assert cache.lookup("product", {**request, "year": "2021"}) == (None, False)
+    assert hashed == [path]
@@ -1,4 +1,22 @@
-from georetriever import GeoCutout
+import os
+import sys
+import threading
+import shutil
+import subprocess
+import pytest
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from georetriever import GeoCutout, data
+from georetriever.datasets import modules
+from georetriever.utils import Lith, LithField
+from georetriever.storage import append_variables, open_cutout
+from georetriever.manifest import Manifest
+
+from .conftest import assert_tiled_matches_whole
+
+test_data = os.path.join(os.path.dirname(__file__), "test_data.nc")
 
 
 def test_data_retrieval():
@@ -31,5 +49,301 @@ def test_data_retrieval():
     assert data.equals(gc.data)
 
 
+def test_load_existing_cutout(tmp_path, caplog):
+    path = tmp_path / "existing.nc"
+    shutil.copy(test_data, path)
+
+    params = dict(x=slice(-1.5, -1), y=slice(50, 51), dx=0.1, dy=0.1)
+    gc = GeoCutout(path, time="2019-01-01", **params)
+
+    assert set(gc.available_features) == {"temperature", "lithology"}
+    assert gc.data["lithology"].dtype == "int32"
+
+    with pytest.raises(ValueError):
+        GeoCutout(path, time="2019-01-02", **params)
+
+    # coordinates are compared on their own
+    GeoCutout(path, x=params["x"])
+    with pytest.raises(ValueError):
+        GeoCutout(path, time="2019-01-02")
+    with pytest.raises(ValueError):
+        GeoCutout(path, y=slice(50, 52), dy=0.1)
+
+    with caplog.at_level("WARNING"):
+        GeoCutout(path, chunksize_x=10)
+    assert "Ignoring chunksize_x=10" in caplog.text
+
+
+def fake_temperature(geocutout, feature, **kwargs):
+    coords = {k: geocutout.coords[k] for k in ["time", "y", "x"]}
+    shape = tuple(c.size for c in coords.values())
+    return xr.Dataset(
+        {
+            "temperature": (list(coords), np.random.rand(*shape)),
+            "soil temperature": (list(coords), np.random.rand(*shape)),
+        },
+        coords=coords,
+    )
+
+
+def fake_lithology(geocutout, feature, **kwargs):
+    coords = {k: geocutout.coords[k] for k in ["x", "y"]}
+    field = LithField.empty(tuple(c.size for c in coords.values()))
+    return field.to_dataset(("x", "y"), coords)
+
+
+@pytest.fixture
+def fake_modules(monkeypatch):
+    """Replaces remote retrievals by synthetic data, recording the calls"""
+    calls = list()
+
+    def recorded(get_data):
+        def wrapper(geocutout, feature, **kwargs):
+            calls.append(feature)
+            return get_data(geocutout, feature, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(modules["era5"], "get_data", recorded(fake_temperature))
+    # the fake is retrieved at once, not in chunks
+    monkeypatch.delattr(modules["era5"], "get_data_chunks")
+    monkeypatch.setattr(modules["macrostrat"], "get_data", recorded(fake_lithology))
+    return calls
+
+
+params = dict(x=slice(0, 1), y=slice(50, 51), time="2019-01-01", dx=0.1, dy=0.1)
+
+
+def test_incremental_prepare(tmp_path, fake_modules):
+    calls = fake_modules
+    path = tmp_path / "incremental.nc"
+
+    gc = GeoCutout(path, **params)
+    gc.prepare(features=["temperature"])
+    temperature = gc.data["temperature"].values
+
+    gc.prepare(features=["temperature", "lithology"])
+    assert calls == ["temperature", "lithology"]
+    np.testing.assert_array_equal(gc.data["temperature"].values, temperature)
+
+    gc = GeoCutout(path, **params)
+    gc.prepare(features=["temperature", "lithology"])
+    assert calls == ["temperature", "lithology"]
+    assert gc.prepared is False
+
+    gc.prepare(features=["temperature"], overwrite=True)
+    assert calls == ["temperature", "lithology", "temperature"]
+
+
+def test_parallel_prepare(tmp_path, monkeypatch):
+    writes = list()
+    monkeypatch.setattr(data, "write_cutout", lambda *args: writes.append(args))
+    monkeypatch.setattr(data, "open_cutout", lambda path: xr.Dataset())
+
+    # both retrievals have to be running at once to pass the barrier
+    barrier = threading.Barrier(2, timeout=10)
+    calls = list()
+
+    def concurrent(get_data):
+        def wrapper(geocutout, feature, **kwargs):
+            calls.append(feature)
+            barrier.wait()
+            return get_data(geocutout, feature, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(modules["era5"], "get_data", concurrent(fake_temperature))
+    monkeypatch.delattr(modules["era5"], "get_data_chunks")
+    monkeypatch.setattr(modules["macrostrat"], "get_data", concurrent(fake_lithology))
+
+    gc = GeoCutout(tmp_path / "parallel.nc", **params)
+    gc.prepare(features=["temperature", "lithology"], parallel=True)
+
+    assert sorted(calls) == ["lithology", "temperature"]
+    assert len(writes) == 1
+    assert {"temperature", "lithology"}.issubset(writes[0][0].data_vars)
+
+
+def test_lazy_modules():
+    code = (
+        "import sys, georetriever; "
+        "from georetriever.datasets import modules; "
+        "assert 'georetriever.datasets.era5' not in sys.modules; "
+        "assert 'cdsapi' not in sys.modules; "
+        "assert modules['era5'].features; "
+        "assert 'cdsapi' in sys.modules"
+    )
+    # the tests may be run from test/, the package is imported from the root
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=root)
+
+
+def test_geophysical_properties(tmp_path, fake_modules, monkeypatch):
+    liths = [
+        Lith.from_list(["sandstone", "clay", None, None, None, None, None, "#aabbcc"])
+    ]
+    liths.append(Lith.from_list(["granite"] + [None] * 6 + ["#000000"]))
+    liths.append(Lith.from_list([None] * 4 + ["marble", "limestone", None, "#ffffff"]))
+
+    def fake_lithology(geocutout, feature, **kwargs):
+        coords = {k: geocutout.coords[k] for k in ["x", "y"]}
+        shape = tuple(c.size for c in coords.values())
+        cells = np.array(liths + [Lith()], dtype=object)[np.arange(np.prod(shape)) % 4]
+        field = LithField.from_liths(cells.reshape(shape))
+        return field.to_dataset(("x", "y"), coords)
+
+    monkeypatch.setattr(modules["macrostrat"], "get_data", fake_lithology)
+
+    gc = GeoCutout(tmp_path / "geophysics.nc", **params)
+    gc.prepare(features=["thermal_conductivity", "heat_capacity"], parallel=True)
+
+    for feature, prop in [
+        ("thermal_conductivity", "thermal_conductivity"),
+        ("heat_capacity", "thermal_capacity"),
+    ]:
+        mean = gc.data[f"{feature}_mean"]
+        variance = gc.data[f"{feature}_variance"]
+        assert mean.dims == gc.data["lithology"].dims
+
+        flat_mean, flat_var = mean.values.ravel(), variance.values.ravel()
+        for i, lith in enumerate(liths):
+            np.testing.assert_allclose(
+                [flat_mean[i], flat_var[i]], getattr(lith, prop), atol=1e-4
+            )
+        assert np.isnan(flat_mean[3]) and np.isnan(flat_var[3])
+
+
+def test_zarr_backend(tmp_path, fake_modules, monkeypatch):
+    liths = [Lith.from_list(["granite"] + [None] * 6 + ["#000000"]), Lith()]
+
+    def fake_lithology(geocutout, feature, **kwargs):
+        coords = {k: geocutout.coords[k] for k in ["x", "y"]}
+        shape = tuple(c.size for c in coords.values())
+        cells = np.array(liths, dtype=object)[np.arange(np.prod(shape)) % 2]
+        return LithField.from_liths(cells.reshape(shape)).to_dataset(("x", "y"), coords)
+
+    monkeypatch.setattr(modules["macrostrat"], "get_data", fake_lithology)
+
+    gc = GeoCutout(tmp_path / "cutout.nc", backend="zarr", chunksize_x=4, **params)
+    assert gc.path.suffix == ".zarr"
+
+    gc.prepare(features=["temperature"])
+    temperature = gc.data["temperature"].values
+    chunks = (gc.data.sizes["time"], gc.data.sizes["y"], 4)
+    assert gc.data["temperature"].encoding["chunks"] == chunks
+
+    gc.prepare(features=["lithology"])
+    gc = GeoCutout(tmp_path / "cutout.zarr")
+    np.testing.assert_array_equal(gc.data["temperature"].values, temperature)
+    assert gc.data["lithology"].encoding["chunks"][0] == 4
+    assert gc.data.lith.vocabulary == ["granite"]
+
+    later = gc.data[["temperature", "soil temperature"]].load()
+    later = later.assign_coords(time=later.indexes["time"] + pd.Timedelta("1D"))
+    append_variables(later, gc.path, append_dim="time")
+
+    ds = open_cutout(gc.path)
+    assert ds.sizes["time"] == 2 * len(temperature)
+    np.testing.assert_array_equal(
+        ds["temperature"].values[len(temperature) :], temperature
+    )
+
+
+def test_tiled_prepare(tmp_path, monkeypatch):
+    liths = [
+        Lith.from_list(["granite"] + [None] * 6 + ["#000000"]),
+        Lith.from_list(["sandstone", "clay"] + [None] * 5 + ["#aabbcc"]),
+        Lith(),
+    ]
+
+    def point_lithology(geocutout, feature, **kwargs):
+        coords = {k: geocutout.coords[k] for k in ["x", "y"]}
+        x, y = np.meshgrid(coords["x"], coords["y"], indexing="ij")
+        cells = np.array(liths, dtype=object)[
+            np.round(10 * (x + 2 * y)).astype(int) % 3
+        ]
+        return LithField.from_liths(cells).to_dataset(("x", "y"), coords)
+
+    def point_temperature(geocutout, feature, **kwargs):
+        coords = {k: geocutout.coords[k] for k in ["time", "y", "x"]}
+        hours = coords["time"].dt.hour
+        return xr.Dataset(
+            {
+                "temperature": hours + coords["y"] * coords["x"],
+                "soil temperature": hours - coords["x"] + 0 * coords["y"],
+            }
+        ).transpose("time", "y", "x")
+
+    monkeypatch.setattr(modules["macrostrat"], "get_data", point_lithology)
+    monkeypatch.setattr(modules["era5"], "get_data", point_temperature)
+    monkeypatch.delattr(modules["era5"], "get_data_chunks")
+
+    features = ["temperature", "thermal_conductivity", "heat_capacity"]
+    tilesizes = [("tiled.zarr", 3), ("tiled.nc", {"x": 4, "y": 5})]
+    whole, (_, gc) = assert_tiled_matches_whole(
+        tmp_path, params, features, tilesizes, max_workers=3
+    )
+    assert {
+        "temperature",
+        "soil temperature",
+        "thermal_conductivity_mean",
+        "thermal_conductivity_variance",
+        "heat_capacity_mean",
+        "heat_capacity_variance",
+        "lithology",
+    } <= set(whole.data.data_vars)
+
+    # tiles consist of whole chunks, a single remaining column joins the last tile
+    tiles = [region for region, _ in gc.tiles({"x": 3, "y": 10})]
+    assert [r["x"] for r in tiles] == [slice(0, 4), slice(4, 8), slice(8, 11)]
+    assert all(r["y"] == slice(0, 11) for r in tiles)
+
+
+def test_resume_tiled_prepare(tmp_path, monkeypatch):
+    liths = [
+        Lith.from_list(["granite"] + [None] * 6 + ["#000000"]),
+        Lith.from_list(["sandstone", "clay"] + [None] * 5 + ["#aabbcc"]),
+        Lith.from_list(["marble"] + [None] * 6 + ["#ffffff"]),
+    ]
+    calls = list()
+
+    def failing_lithology(geocutout, feature, **kwargs):
+        calls.append(feature)
+        if len(calls) == 5:
+            raise ConnectionError("Macrostrat is not available")
+        coords = {k: geocutout.coords[k] for k in ["x", "y"]}
+        x, y = np.meshgrid(coords["x"], coords["y"], indexing="ij")
+        cells = np.array(liths, dtype=object)[
+            np.round(10 * (x + 2 * y)).astype(int) % 3
+        ]
+        return LithField.from_liths(cells).to_dataset(("x", "y"), coords)
+
+    monkeypatch.setattr(modules["macrostrat"], "get_data", failing_lithology)
+
+    path = tmp_path / "resumed.zarr"
+    gc = GeoCutout(path, **params)
+    with pytest.raises(ConnectionError):
+        gc.prepare(features=["lithology"], tilesize=4, max_workers=1)
+
+    manifest = Manifest(path)
+    assert manifest.features["lithology"]["status"] == "running"
+    assert len(manifest.finished_tiles("lithology")) == 4
+
+    interrupted = len(calls)
+    gc = GeoCutout(path, **params)
+    assert "lithology" not in gc.data.attrs["prepared_features"]
+    gc.prepare(features=["lithology"], tilesize=4, max_workers=1)
+
+    # 9 tiles in total, 4 of which were stored by the interrupted run
+    assert len(calls) - interrupted == 9 - 4
+    assert Manifest(path).features["lithology"]["status"] == "done"
+
+    expected = failing_lithology(gc, "lithology")
+    tiled = LithField.from_dataset(gc.data).to_liths()
+    assert [lith.tolist() for lith in tiled.ravel()] == [
+        lith.tolist() for lith in LithField.from_dataset(expected).to_liths().ravel()
+    ]
+
+
 if __name__ == "__main__":
     test_data_retrieval()
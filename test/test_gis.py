@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from georetriever.gis import get_coords, grid_points, grid_blocks
+
+
+@pytest.mark.parametrize(
+    "x, y, time, dx, dy, dt",
+    [
+        (slice(-1.5, -1), slice(51, 50), "2019-01-01", 0.1, 0.1, "h"),
+        (slice(0, 1), slice(50, 51), "2019-01", 1 / 3, 0.25, "3h"),
+        (slice(-180, 179.99), slice(-5, 5.55), "2019-01-01 05", 0.01, 0.05, "h"),
+        (
+            slice(10.123, 10.5),
+            slice(-3, 2),
+            slice("2019-01-05", "2019-01-25"),
+            0.3,
+            1.0,
+            "D",
+        ),
+    ],
+)
+def test_get_coords(x, y, time, dx, dy, dt):
+    coords = get_coords(x, y, time, dx=dx, dy=dy, dt=dt)
+
+    x_global = np.around(np.arange(-180, 180, dx), 9)
+    y_global = np.around(np.arange(-90, 90, dy), 9)
+    time_global = pd.date_range(start="1959", end="2020", freq=dt)
+    time_global = xr.DataArray(time_global, coords={"time": time_global})
+
+    x0, x1 = sorted([x.start, x.stop])
+    y0, y1 = sorted([y.start, y.stop])
+    np.testing.assert_array_equal(
+        coords["x"], x_global[(x_global >= x0) & (x_global <= x1)]
+    )
+    np.testing.assert_array_equal(
+        coords["y"], y_global[(y_global >= y0) & (y_global <= y1)]
+    )
+    np.testing.assert_array_equal(
+        coords["time"].values, time_global.sel(time=time).values
+    )
+
+
+def test_grid_points():
+    x, y = np.arange(4.0), np.arange(10.0, 13.0)
+
+    for indexing in ["ij", "xy"]:
+        xx, yy = np.meshgrid(x, y, indexing=indexing)
+        np.testing.assert_array_equal(
+            grid_points(x, y, indexing), (xx.ravel(), yy.ravel())
+        )
+
+        blocks = list(grid_blocks(x, y, indexing, blocksize=5))
+        assert [len(bx) for _, bx, _ in blocks] == [5, 5, 2]
+        for block, bx, by in blocks:
+            np.testing.assert_array_equal(bx, xx.ravel()[block])
+            np.testing.assert_array_equal(by, yy.ravel()[block])
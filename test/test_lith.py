@@ -1,5 +1,10 @@
-from georetriever.utils import Lith
-from georetriever.utils.geo_utils import get_random_lith
+import numpy as np
+import pandas as pd
+import xarray as xr
+import dask.array
+
+from georetriever.utils import Lith, LithField
+from georetriever.utils.geo_utils import get_random_lith, parse_lith_entry
 
 
 def test_lith_conversion():
@@ -10,5 +15,61 @@ def test_lith_conversion():
     assert lith_list == lith_obj.tolist()
 
 
+def test_lith_codec(tmp_path):
+    liths = np.array([get_random_lith() for _ in range(5)] + [Lith()], dtype=object)
+    liths = liths[np.random.randint(0, len(liths), size=(7, 4))]
+    da = xr.DataArray(liths, coords={"x": np.arange(7), "y": np.arange(4)})
+
+    ds = Lith.to_dataset(da)
+    assert len(ds["lith_codes"]) <= len({id(lith) for lith in liths.ravel()})
+    assert ds.lith.colors.dtype == np.uint8
+    assert ds.lith.minors.shape == (7, 4, 3)
+
+    # names are looked up lazily, chunk by chunk
+    chunked = ds.chunk({"x": 2, "y": 3})
+    names = chunked.lith.names(chunked.lith.major)
+    assert isinstance(names.data, dask.array.Array)
+    expected = [lith.major for lith in liths.ravel()]
+    assert [
+        None if pd.isnull(name) else name for name in names.values.ravel()
+    ] == expected
+
+    ds.to_netcdf(tmp_path / "lith.nc")
+    with xr.open_dataset(tmp_path / "lith.nc") as stored:
+        decoded = Lith.to_dataarray(stored)
+
+    for lith, restored in zip(liths.ravel(), decoded.values.ravel()):
+        assert lith.tolist() == restored.tolist()
+
+
+def test_lith_field_interning():
+    lith = get_random_lith()
+    field = LithField.empty((3, 2))
+
+    assert field.intern(lith) == field.intern(Lith.from_list(lith.tolist())) == 1
+    assert len(field) == 2
+    assert field.to_liths()[0, 0].tolist() == Lith().tolist()
+
+
+def test_interpret_macrostrat():
+    units = pd.Series(
+        ["Sandstone [90%], shale [10%]", "Sedimentary rocks and limestone"] * 2
+    )
+    parse_lith_entry.cache_clear()
+
+    lith = Lith()
+    lith, best_info = lith.interpret_macrostrat(units, return_best_info=True)
+
+    assert lith.major == "sandstone" and lith.minors == ["shale"]
+    assert sorted(lith.others) == ["limestone", "sedimentary rocks"]
+    assert best_info == 2
+    assert parse_lith_entry.cache_info().misses == 2
+
+    record = parse_lith_entry(units[1])
+    assert record.others == ("sedimentary rocks", "limestone")
+    lith.others.append("granite")
+    assert parse_lith_entry(units[1]) == record
+
+
 if __name__ == "__main__":
     test_lith_conversion()
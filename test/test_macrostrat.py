@@ -0,0 +1,196 @@
+import json
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+import geopandas as gpd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from shapely.geometry import box
+
+from georetriever.datasets import macrostrat
+from georetriever.utils import Lith
+from georetriever.utils.cache import PolygonCache
+
+from .conftest import DummyCutout, assert_tiled_matches_whole
+
+
+def canned_units(lng, lat):
+    """GeoJSON of a half degree square map unit around each point on land"""
+    if lng > 0.5:
+        return {"type": "FeatureCollection", "features": []}
+
+    x0, y0 = np.floor(lng * 2) / 2, np.floor(lat * 2) / 2
+    ring = [[x0, y0], [x0 + 0.5, y0], [x0 + 0.5, y0 + 0.5], [x0, y0 + 0.5], [x0, y0]]
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [ring]},
+                "properties": {
+                    "map_id": int(1000 * x0 + 2 * y0),
+                    "lith": "Major:{sandstone}, Minor:{shale}",
+                    "color": "#aabbcc",
+                },
+            }
+        ],
+    }
+
+
+@pytest.fixture
+def server():
+    """Local stand-in for the Macrostrat API, failing every third request"""
+
+    class Handler(BaseHTTPRequestHandler):
+        requests = list()
+
+        def do_GET(self):
+            Handler.requests.append(self.path)
+            if len(Handler.requests) % 3 == 0:
+                self.send_response(503)
+                self.end_headers()
+                return
+
+            query = parse_qs(urlparse(self.path).query)
+            body = canned_units(float(query["lng"][0]), float(query["lat"][0]))
+            body = json.dumps(body).encode()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{httpd.server_port}/map", Handler.requests
+
+    httpd.shutdown()
+
+
+def test_polygon_cache(tmp_path, server):
+    url, requests = server
+
+    cutout = DummyCutout(
+        x=slice(-1, 0.9), y=slice(50, 50.9), time="2019-01-01", dx=0.1, dy=0.1
+    )
+    cache = str(tmp_path / "units.pkl")
+    client = macrostrat.MacrostratClient(
+        url, concurrency=4, rate_limit=None, backoff=0.01
+    )
+
+    ds = macrostrat.get_data(cutout, "lithology", cache=cache, client=client)
+
+    major = ds.lith.names(ds.lith.major)
+    assert major.shape == (20, 10)
+    assert major.sel(x=-1, y=50).item() == "sandstone"
+    assert np.isnan(major.sel(x=0.9, y=50).item())
+    assert len(ds["lith_codes"]) == 2
+
+    requests.clear()
+    macrostrat.get_data(cutout, "lithology", cache=cache, client=client)
+
+    assert not requests
+
+
+def test_client_retries(server):
+    url, requests = server
+
+    client = macrostrat.MacrostratClient(url, concurrency=2, backoff=0.01)
+    points = [(-0.9, 50.1), (-0.4, 50.1), (0.1, 50.6), (0.9, 50.6)]
+
+    results = dict(client.map(points))
+
+    assert set(results) == set(points)
+    assert results[(-0.9, 50.1)]["map_id"].item() == -1000 + 100
+    assert results[(0.9, 50.6)].empty
+    assert len(requests) == 5
+
+
+def test_units_without_map_id(tmp_path):
+    """Responses lacking 'map_id' are keyed by their geometry"""
+
+    class CannedClient:
+        concurrency = 2
+
+        def map(self, points):
+            for lng, lat in points:
+                units = canned_units(lng, lat)
+                for unit in units["features"]:
+                    del unit["properties"]["map_id"]
+                    if lng < 0:
+                        unit["properties"]["lith"] = "Major:{granite}"
+                yield (lng, lat), gpd.GeoDataFrame.from_features(
+                    units["features"], crs=4326
+                )
+
+    cutout = DummyCutout(
+        x=slice(-0.4, 0.4), y=slice(50.1, 50.4), time="2019-01-01", dx=0.1, dy=0.1
+    )
+    cache = str(tmp_path / "units.pkl")
+    ds = macrostrat.get_data(cutout, "lithology", cache=cache, client=CannedClient())
+
+    major = ds.lith.names(ds.lith.major)
+    assert major.sel(x=-0.4, y=50.1).item() == "granite"
+    assert major.sel(x=0.4, y=50.1).item() == "sandstone"
+
+    # the cache holds both units under distinct, stable ids
+    stored = PolygonCache(cache, columns=Lith.index)
+    assert len(stored) == 2
+    first = canned_units(-0.4, 50.1)["features"][0]
+    del first["properties"]["map_id"]
+    unit_id, _, _ = macrostrat.interpret_units(
+        gpd.GeoDataFrame.from_features([first], crs=4326)
+    )
+    assert unit_id in stored
+
+
+def test_tiled_prepare(tmp_path, server):
+    url, requests = server
+
+    client = macrostrat.MacrostratClient(
+        url, concurrency=4, rate_limit=None, backoff=0.01
+    )
+    params = dict(x=slice(-1, 0.9), y=slice(50, 50.9), time="2019", dx=0.1, dy=0.1)
+
+    cache = tmp_path / "units.pkl"
+
+    # every cutout starts from an empty polygon cache
+    whole, _ = assert_tiled_matches_whole(
+        tmp_path,
+        params,
+        ["lithology"],
+        [("tiled.zarr", 8), ("tiled.nc", {"x": 4, "y": 8})],
+        before_prepare=lambda: cache.unlink(missing_ok=True),
+        module_params={"macrostrat": {"cache": str(cache), "client": client}},
+        max_workers=4,
+    )
+    assert "lithology" in whole.data
+
+
+def test_concurrent_cache_writers(tmp_path):
+    path = str(tmp_path / "units.pkl")
+
+    def write(worker):
+        cache = PolygonCache(path, columns=["lith"])
+        for i in range(5):
+            cache.add(f"{worker}-{i}", box(worker, i, worker + 1, i + 1), lith="clay")
+            cache.add_empty(worker, -i)
+            cache.save()
+
+    threads = [threading.Thread(target=write, args=(w,)) for w in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    cache = PolygonCache(path, columns=["lith"])
+    assert len(cache) == 8 * 5
+    assert len(cache.empty_points) == 8 * 5
+    assert not list(tmp_path.glob("*.tmp"))
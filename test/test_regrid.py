@@ -0,0 +1,63 @@
+import numpy as np
+import xarray as xr
+import geopandas as gpd
+from shapely.geometry import box
+
+from georetriever.utils import polygons_to_xarray
+from georetriever.utils.regrid import Regridder, utm_zones, weights_cache
+
+
+def test_polygons_to_xarray(tmp_path, monkeypatch):
+    x, y = np.arange(0, 2, 0.5), np.arange(10, 11, 0.5)
+    da = xr.DataArray(np.zeros((4, 2)), coords={"x": x, "y": y}, dims=["x", "y"])
+
+    gdf = gpd.GeoDataFrame(
+        {"depth": [1.0, 3.0], "density": [2.0, 4.0]},
+        geometry=[box(-0.25, 9.75, 0.5, 11), box(0.5, 9.75, 1, 11)],
+        crs=4326,
+    )
+
+    ds = polygons_to_xarray(da, gdf, ["depth", "density"], cache_dir=tmp_path)
+
+    assert ds["depth"].dims == ("y", "x")
+    # cell at x=0 lies within the first polygon, cell at x=0.5 is split
+    assert ds["depth"].sel(x=0, y=10).item() == 1.0
+    assert ds["depth"].sel(x=0.5, y=10.5).item() == 2.0
+    assert ds["density"].sel(x=1, y=10).item() == 4.0
+    assert ds["depth"].sel(x=1.5, y=10).isnull()
+
+    regridder = Regridder(x, y, gdf.geometry)
+    xr.testing.assert_identical(
+        polygons_to_xarray(da, gdf, "depth", regridder=regridder), ds[["depth"]]
+    )
+
+    # weights are stored once per grid and polygon set
+    cache = weights_cache(tmp_path)
+    assert cache.stats == {"hits": 0, "misses": 1} and len(cache.index) == 1
+    cached = polygons_to_xarray(da, gdf, ["depth", "density"], cache_dir=tmp_path)
+    xr.testing.assert_identical(cached, ds)
+    assert cache.stats == {"hits": 1, "misses": 1} and len(cache.index) == 1
+
+    # the least recently used weights are evicted beyond the size limit
+    monkeypatch.setattr(cache, "max_size", cache.size)
+    polygons_to_xarray(da, gdf.iloc[:1], "depth", cache_dir=tmp_path)
+    assert len(cache.index) == 1 and cache.size <= cache.max_size
+
+
+def test_projected_weights():
+    # grid crossing the border of UTM zones 31 and 32 at 6°E
+    x, y = np.arange(4, 8, 0.5), np.arange(60, 62, 0.5)
+    polygons = [box(3.5, 59, 6.2, 63), box(6.2, 59, 9, 63)]
+    gdf = gpd.GeoDataFrame({"depth": [0.0, 1.0]}, geometry=polygons, crs=4326)
+
+    np.testing.assert_array_equal(
+        utm_zones([5.9, 6.1, 6.1], [1, 1, -1]), [32631, 32632, 32732]
+    )
+
+    geographic = Regridder(x, y, gdf.geometry)(gdf["depth"])
+    for projection in ["utm", "EPSG:6933"]:
+        projected = Regridder(x, y, gdf.geometry, projection=projection)
+        np.testing.assert_allclose(projected(gdf["depth"]), geographic, atol=0.02)
+
+    # the cell centered at 6°E overlaps the second polygon by a tenth
+    np.testing.assert_allclose(geographic[:, 4], 0.1)
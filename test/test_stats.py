@@ -0,0 +1,53 @@
+import numpy as np
+
+from georetriever.geophysics import stats_utils
+
+
+def test_batched_mean_variance(monkeypatch):
+    nan = np.nan
+    means = np.array([[2.0, 3.0, nan], [1.0, 4.0, nan], [2.5, nan, nan], [nan] * 3])
+    vars = np.array([[0.1, 0.2, nan], [0.3, 0.1, nan], [0.4, nan, nan], [nan] * 3])
+    alphas = np.array([[0.5, 0.0, nan], [0.5, 0.0, nan], [0.5, nan, nan], [nan] * 3])
+    betas = np.array([[1.0, 0.5, nan], [1.0, 0.5, nan], [0.99, nan, nan], [nan] * 3])
+
+    calls = list()
+    simplex_moments = stats_utils.simplex_moments
+
+    def counted(alphas, betas, **kwargs):
+        calls.append(tuple(alphas))
+        return simplex_moments(alphas, betas, **kwargs)
+
+    monkeypatch.setattr(stats_utils, "simplex_moments", counted)
+
+    mean, variance = stats_utils.get_mean_variance_batch(
+        means, vars, alphas, betas, n_samples=200_000
+    )
+
+    # the first two cells share their bounds
+    assert sorted(calls) == [(0.5,), (0.5, 0.0)]
+
+    for i in range(2):
+        expected = stats_utils.get_mean_variance(
+            means[i, :2], vars[i, :2], alphas[i, :2], betas[i, :2], n_samples=200_000
+        )
+        np.testing.assert_allclose([mean[i], variance[i]], expected, rtol=1e-2)
+
+    assert (mean[2], variance[2]) == (2.5, 0.4)
+    assert np.isnan(mean[3]) and np.isnan(variance[3])
+
+
+def test_simplex_moments():
+    # Y_1 ~ U[0.5, 1] and Y_2 = 1 - Y_1
+    EY, VY = stats_utils.simplex_moments(np.array([0.5, 0.0]), np.array([1.0, 0.5]))
+    np.testing.assert_allclose(EY, [0.75, 0.25], atol=1e-4)
+    np.testing.assert_allclose(VY, [0.5**2 / 12] * 2, atol=1e-4)
+
+    # uniform on the full simplex, i.e. Dirichlet(1, 1, 1)
+    EY, VY = stats_utils.simplex_moments(np.zeros(3), np.ones(3))
+    np.testing.assert_allclose(EY, [1 / 3] * 3, atol=1e-3)
+    np.testing.assert_allclose(VY, [2 / 36] * 3, atol=1e-3)
+
+    hits = stats_utils._simplex_moments.cache_info().hits
+    again = stats_utils.simplex_moments(np.zeros(3), np.ones(3))
+    np.testing.assert_array_equal(again[0], EY)
+    assert stats_utils._simplex_moments.cache_info().hits == hits + 1